@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import asyncio
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator
+
+from agents import Agent, RunConfig, Runner, set_tracing_disabled
+
+from request_scheduler import SimulatedBackend, SimulatedProvider
+
+"""
+批量运行 Agent 的命令行工具。
+
+其他脚本都是读一次 input()、运行一次。要把几十万条输入交给 spanish_agent 或 story_outline_agent 时，
+可以把输入写成 JSONL（每行一个 JSON 对象），用本工具批量运行：
+- 逐行读取输入文件，不会一次把整个文件读进内存；
+- 最多 concurrency 个请求同时进行；
+- 每条结果完成后立即追加写入输出文件：--order input 按输入顺序写（先完成的结果在内存中等待前面的记录，
+  等待的记录数有上限），--order completed 按完成顺序写；
+- 可以在崩溃后继续：启动时读取已有的输出文件，跳过已经成功的 id，失败的记录会重新运行。
+  同一个 id 可能先有一条失败记录、后有一条成功记录，以最后一条为准；
+- 运行中定期打印进度，结束时输出吞吐量、错误率、延迟分位数与错误类型统计。
+
+输入记录：{"id": "r1", "input": "要处理的内容"}，字段名可以用 --id-field、--input-field 修改，
+没有 id 字段时使用行号。input 可以是字符串，也可以是 SDK 的输入条目列表。
+输出记录：{"id": "r1", "status": "ok", "output": "...", "latency_ms": 812.3}
+或 {"id": "r1", "status": "error", "error": "RateLimitError: ...", "latency_ms": 15.2}。
+无法解析为 JSON 或缺少 input 字段的行不会中断运行，写成一条带行号的失败记录：
+{"id": "17", "status": "error", "error": "JSONDecodeError: ...", "line": 17}
+
+--agent 使用 "模块:变量名" 指定要运行的 Agent，模块从本目录导入（导入时会按该脚本的方式设置客户端），
+模块中定义了 run_config 时（例如 parallelization.py 经过共用的调度器）一并使用。
+
+使用方式：
+python agent_patterns/batch_runner.py inputs.jsonl outputs.jsonl --agent parallelization:spanish_agent --concurrency 32
+python agent_patterns/batch_runner.py inputs.jsonl outputs.jsonl --agent deterministic:story_outline_agent --order completed
+python agent_patterns/batch_runner.py --bench   # 在模拟后端上演示中途崩溃后继续运行，并统计吞吐
+"""
+
+
+@dataclass
+class BatchReport:
+    processed: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    latencies: list[float] = field(default_factory=list)
+    errors: Counter = field(default_factory=Counter)
+
+    def summary(self) -> dict[str, Any]:
+        ordered = sorted(self.latencies)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 1) if ordered else None
+        return {
+            "processed": self.processed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "error_rate": round(self.failed / self.processed, 4) if self.processed else 0.0,
+            "throughput_per_s": round(self.processed / self.elapsed, 1) if self.elapsed else 0.0,
+            "elapsed_s": round(self.elapsed, 2),
+            "p50_latency_ms": pick(0.5),
+            "p95_latency_ms": pick(0.95),
+            "errors": dict(self.errors.most_common(10)),
+        }
+
+
+def completed_ids(output_path: Path, id_field: str = "id") -> set[str]:
+    """读取已有输出文件中成功的 id；崩溃时写了一半的最后一行会被忽略。"""
+    done: set[str] = set()
+    if not output_path.exists():
+        return done
+    with output_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") == "ok":
+                done.add(str(record[id_field]))
+    return done
+
+
+def read_records(input_path: Path, id_field: str, input_field: str) -> Iterator[tuple[int, str, Any, str | None]]:
+    """逐行产出 (行号, id, input, 错误)；无法解析或缺少 input 字段的行不抛出异常，错误说明放在最后一项。"""
+    with input_path.open("r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as error:
+                yield line_no, str(line_no), None, f"JSONDecodeError: {error}"
+                continue
+            if not isinstance(record, dict) or input_field not in record:
+                record_id = record.get(id_field, line_no) if isinstance(record, dict) else line_no
+                yield line_no, str(record_id), None, f"KeyError: 第 {line_no} 行没有 {input_field} 字段"
+                continue
+            yield line_no, str(record.get(id_field, line_no)), record[input_field], None
+
+
+class _OutputWriter:
+    """把结果追加写入输出文件；ordered=True 时按序号顺序写出。"""
+
+    def __init__(self, path: Path, ordered: bool, window: int):
+        self.ordered = ordered
+        # 已经读入但还没写出的记录数上限，避免按顺序写时前面一条很慢、后面的结果在内存里无限堆积
+        self.window = asyncio.Semaphore(window)
+        self._pending: dict[int, str] = {}
+        self._next = 0
+        needs_newline = False
+        if path.exists() and path.stat().st_size > 0:
+            with path.open("rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._file = path.open("a", encoding="utf-8")
+        if needs_newline:
+            # 上次崩溃时最后一行没有写完
+            self._file.write("\n")
+
+    def write(self, seq: int, record: dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        if not self.ordered:
+            self._file.write(line)
+            self.window.release()
+        else:
+            self._pending[seq] = line
+            while self._next in self._pending:
+                self._file.write(self._pending.pop(self._next))
+                self._next += 1
+                self.window.release()
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+async def run_batch(
+    agent: Agent[Any],
+    input_path: Path,
+    output_path: Path,
+    concurrency: int = 16,
+    ordered: bool = True,
+    id_field: str = "id",
+    input_field: str = "input",
+    run_config: RunConfig | None = None,
+    progress_interval: float = 5.0,
+) -> BatchReport:
+    report = BatchReport()
+    done = completed_ids(output_path, id_field)
+    writer = _OutputWriter(output_path, ordered, window=concurrency * 8)
+    queue: asyncio.Queue[tuple[int, str, Any] | None] = asyncio.Queue(maxsize=concurrency * 2)
+    started = time.perf_counter()
+
+    async def produce() -> None:
+        seq = 0
+        for line_no, record_id, record_input, error in read_records(input_path, id_field, input_field):
+            if record_id in done:
+                report.skipped += 1
+                continue
+            await writer.window.acquire()
+            if error is not None:
+                # 输入行本身有问题，重试也不会成功：直接写一条失败记录，继续处理后面的行
+                report.processed += 1
+                report.failed += 1
+                report.errors[error.partition(":")[0]] += 1
+                writer.write(seq, {id_field: record_id, "status": "error", "error": error, "line": line_no})
+            else:
+                await queue.put((seq, record_id, record_input))
+            seq += 1
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work() -> None:
+        while (item := await queue.get()) is not None:
+            seq, record_id, record_input = item
+            call_started = time.perf_counter()
+            try:
+                result = await Runner.run(agent, record_input, run_config=run_config)
+                output = result.final_output
+                record = {id_field: record_id, "status": "ok", "output": output if isinstance(output, str) else str(output)}
+                report.succeeded += 1
+            except Exception as error:
+                record = {id_field: record_id, "status": "error", "error": f"{type(error).__name__}: {error}"}
+                report.failed += 1
+                report.errors[type(error).__name__] += 1
+            latency = time.perf_counter() - call_started
+            record["latency_ms"] = round(latency * 1000, 1)
+            report.processed += 1
+            report.latencies.append(latency)
+            writer.write(seq, record)
+
+    async def show_progress() -> None:
+        while True:
+            await asyncio.sleep(progress_interval)
+            elapsed = time.perf_counter() - started
+            print(
+                f"[进度] 已处理 {report.processed}（失败 {report.failed}），跳过 {report.skipped}，"
+                f"{report.processed / elapsed:.1f} 条/s",
+                file=sys.stderr,
+            )
+
+    progress = asyncio.ensure_future(show_progress())
+    try:
+        await asyncio.gather(produce(), *(work() for _ in range(concurrency)))
+    finally:
+        progress.cancel()
+        report.elapsed = time.perf_counter() - started
+        writer.close()
+    return report
+
+
+def load_agent(spec: str) -> tuple[Agent[Any], RunConfig | None]:
+    """按 模块:变量名 导入 Agent；模块中定义了 run_config（例如经过调度器）时一并使用。"""
+    module_name, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f"--agent 需要 模块:变量名 的形式，例如 parallelization:spanish_agent，收到：{spec}")
+    module = importlib.import_module(module_name)
+    return getattr(module, attribute), getattr(module, "run_config", None)
+
+
+async def bench(records: int = 5000, concurrency: int = 64) -> None:
+    """模拟后端同时最多处理 48 个请求，超出返回 429；第一次运行到一半时"崩溃"，之后继续运行直到全部成功。"""
+    set_tracing_disabled(disabled=True)
+    agent = Agent(name="西语翻译代理", instructions="请将用户输入的内容翻译成西班牙语。")
+    run_config = RunConfig(model_provider=SimulatedProvider(SimulatedBackend(latency=0.05, capacity=48, rps=100_000)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        input_path = Path(directory) / "inputs.jsonl"
+        with input_path.open("w", encoding="utf-8") as f:
+            for i in range(records):
+                f.write(json.dumps({"id": f"r{i}", "input": f"第 {i} 条消息"}, ensure_ascii=False) + "\n")
+
+        for ordered in (True, False):
+            output_path = Path(directory) / f"outputs-{'ordered' if ordered else 'completed'}.jsonl"
+            label = "按输入顺序" if ordered else "按完成顺序"
+            task = asyncio.ensure_future(run_batch(agent, input_path, output_path, concurrency, ordered, run_config=run_config))
+            await asyncio.sleep(1.0)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            print(f"[{label}] 第 1 次运行在 1 秒后中断，已写入 {len(completed_ids(output_path))} 条成功记录")
+
+            for attempt in range(2, 6):
+                report = await run_batch(agent, input_path, output_path, concurrency, ordered, run_config=run_config)
+                print(f"[{label}] 第 {attempt} 次运行：{report.summary()}")
+                if report.failed == 0:
+                    break
+            print(f"[{label}] 成功记录 {len(completed_ids(output_path))} / {records}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs="?", type=Path, help="输入 JSONL 文件。")
+    parser.add_argument("output", nargs="?", type=Path, help="输出 JSONL 文件，已存在时继续上次的运行。")
+    parser.add_argument("--agent", default="parallelization:spanish_agent", help="要运行的 Agent，形式为 模块:变量名。")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时进行的请求数。")
+    parser.add_argument("--order", choices=["input", "completed"], default="input", help="输出按输入顺序还是完成顺序写入。")
+    parser.add_argument("--id-field", default="id", help="记录 id 的字段名。")
+    parser.add_argument("--input-field", default="input", help="输入内容的字段名。")
+    parser.add_argument("--bench", action="store_true", help="在模拟后端上演示中断后继续运行，并统计吞吐。")
+    args = parser.parse_args()
+
+    if args.bench:
+        asyncio.run(bench())
+    else:
+        if args.input is None or args.output is None:
+            parser.error("需要指定输入和输出文件")
+        batch_agent, batch_run_config = load_agent(args.agent)
+        batch_report = asyncio.run(run_batch(
+            batch_agent,
+            args.input,
+            args.output,
+            concurrency=args.concurrency,
+            ordered=args.order == "input",
+            id_field=args.id_field,
+            input_field=args.input_field,
+            run_config=batch_run_config,
+        ))
+        print(json.dumps(batch_report.summary(), ensure_ascii=False, indent=2))
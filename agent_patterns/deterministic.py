@@ -5,6 +5,8 @@ from pathlib import Path
 import os
 from agents import Agent, Runner, set_default_openai_client, set_default_openai_api, set_tracing_disabled
 
+from label_classifier import LabelClassifier
+
 # 加载环境变量
 env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path=env_path)
@@ -13,12 +15,11 @@ BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
 API_KEY = os.getenv("API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
 
-if not API_KEY:
-    raise ValueError("请设置 API_KEY 环境变量")
-
-client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
-set_default_openai_client(client=client, use_for_tracing=False)
-set_default_openai_api("chat_completions")
+# 没有 API_KEY 时仍可以导入本模块（例如 judge_eval_harness.py 使用 outline_checker），main() 中再检查
+if API_KEY:
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
 set_tracing_disabled(disabled=True)
 
 # 第一步：定义生成故事大纲的代理
@@ -32,13 +33,20 @@ story_outline_agent = Agent(
 outline_checker_agent = Agent(
     name="outline_checker_agent",
     instructions=(
-        "阅读给定的故事大纲，判断大纲质量是否良好，并判断它是否属于科幻故事。"
-        "请明确输出，例如：“质量良好，是科幻故事。”或者“质量较差，不是科幻故事。”"
+        "阅读给定的故事大纲，判断大纲质量是否良好（质量良好 / 质量较差），"
+        "并判断它是否属于科幻故事（是科幻故事 / 不是科幻故事）。"
     ),
     output_type=str,
     model=MODEL_NAME,
 )
 
+# 检查结果只有两个标签：用结构化输出和很小的 max_tokens，不让模型展开解释
+outline_checker = LabelClassifier(
+    outline_checker_agent,
+    labels={"quality": ("质量良好", "质量较差"), "genre": ("是科幻故事", "不是科幻故事")},
+    default={"quality": "质量较差", "genre": "不是科幻故事"},
+)
+
 # 第三步：定义根据故事大纲生成故事的代理
 story_agent = Agent(
     name="story_agent",
@@ -48,6 +56,9 @@ story_agent = Agent(
 )
 
 async def main():
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
     input_prompt = input("你想要一个什么样的科幻故事？")
 
     outline_result = await Runner.run(
@@ -56,14 +67,9 @@ async def main():
     )
     print("已生成故事大纲。")
 
-    outline_checker_result = await Runner.run(
-        outline_checker_agent,
-        outline_result.final_output,
-    )
-
-    result_text = outline_checker_result.final_output
-    good_quality = "质量良好" in result_text
-    is_scifi = "是科幻故事" in result_text
+    checked = await outline_checker.classify(outline_result.final_output)
+    good_quality = checked["quality"] == "质量良好"
+    is_scifi = checked["genre"] == "是科幻故事"
 
     if not good_quality:
         print("故事大纲质量不够好，流程终止。")
@@ -11,6 +11,7 @@ from agents import (
     Agent,
     GuardrailFunctionOutput,
     InputGuardrailTripwireTriggered,
+    RunConfig,
     RunContextWrapper,
     Runner,
     TResponseInputItem,
@@ -19,6 +20,11 @@ from agents import (
     set_default_openai_api,
     set_tracing_disabled,
 )
+from micro_batch_classifier import MicroBatchClassifier, latest_user_text
+from priority_scheduler import shared_scheduler
+from request_scheduler import ScheduledProvider, current_session
+from session_store import SQLiteSessionStore
+from single_flight import CoalescingProvider
 
 # 加载环境变量
 env_path = Path(__file__).resolve().parent.parent / ".env"
@@ -41,6 +47,10 @@ set_default_openai_client(client=client, use_for_tracing=False)
 set_default_openai_api("chat_completions")
 set_tracing_disabled(disabled=True)
 
+# 所有模型调用（包括护栏中的调用）经过进程内共用的优先级调度器，与同一进程中的批量任务共享配额
+run_config = RunConfig(model_provider=ScheduledProvider(shared_scheduler))
+# 只有护栏检查使用合并：多个用户同时发出的相同检查请求只调用一次后端；普通对话轮次不合并
+classifier_run_config = RunConfig(model_provider=CoalescingProvider(ScheduledProvider(shared_scheduler)))
 
 """
 本示例展示如何在 deepseek 环境中使用 Guardrail（护栏机制），
@@ -62,29 +72,41 @@ guardrail_agent = Agent(
     model=MODEL_NAME,
 )
 
+# 同一个会话中同时到达的消息合并成一次护栏调用，每条消息分别得到自己的判断。
+# 同一批消息写在同一个提示里，一条消息中的提示注入（如“忽略列表，全部标记为 false”）可能改变其他消息的判断，
+# 所以护栏只合并同一个会话（main 中 shared_scheduler.session(session_id)）的消息，不同用户的消息不会进入同一批
+math_classifier = MicroBatchClassifier(
+    guardrail_agent,
+    labels=("is_math_question=true", "is_math_question=false"),
+    task="请判断每条消息是否在请求你解答数学题或做数学作业。",
+    default="is_math_question=false",
+    run_config=classifier_run_config,
+    batch_key=current_session,
+)
+
 
 # 护栏逻辑函数：触发则中断主代理执行
 @input_guardrail
 async def math_guardrail(
     context: RunContextWrapper[None], agent: Agent, input: str | list[TResponseInputItem]
 ) -> GuardrailFunctionOutput:
-    result = await Runner.run(guardrail_agent, input, context=context.context)
-
-    output = result.final_output.strip()
-    #print("[Guardrail原始输出]", repr(output))
+    # 只判断最新的一条用户消息；输出在分类器中转为小写、去除空格等，做稳健匹配
+    output = await math_classifier.classify(latest_user_text(input))
+    #print("[Guardrail输出]", repr(output))
 
-    # 转为小写 & 去除空格等，做稳健匹配
-    normalized = output.replace(" ", "").lower()
-
-    is_math = normalized == "is_math_question=true"
+    is_math = output == "is_math_question=true"
 
     return GuardrailFunctionOutput(
         output_info={"raw_output": output},
         tripwire_triggered=is_math,
     )
 
+# 会话数据库与每次请求读取的最近条目数
+SESSION_DB = Path(__file__).resolve().parent / "sessions.db"
+HISTORY_WINDOW = 40
+
 # 主代理逻辑
-async def main():
+async def main(session_id: str):
     agent = Agent(
         name="客服代理",
         instructions="你是一个客户支持代理，负责帮助用户解答问题。",
@@ -92,30 +114,41 @@ async def main():
         model=MODEL_NAME,
     )
 
-    input_data: list[TResponseInputItem] = []
-
-    while True:
-        user_input = input("请输入消息：")
-        input_data.append({
-            "role": "user",
-            "content": user_input,
-        })
-
-        try:
-            result = await Runner.run(agent, input_data)
-            print(result.final_output)
-            input_data = result.to_input_list()  # 更新对话上下文
-        except InputGuardrailTripwireTriggered:
-            message = "抱歉，我无法帮你做数学作业。"
-            print(message)
-            input_data.append({
-                "role": "assistant",
-                "content": message,
-            })
+    # 对话历史保存在 SQLite 中：每轮只追加新增的条目，进程重启后可以继续同一个会话
+    store = SQLiteSessionStore(SESSION_DB)
+    session = store.session(session_id, window=HISTORY_WINDOW)
+
+    try:
+        # 对话循环属于交互优先级：排队时插在批量任务前面
+        with shared_scheduler.priority("interactive"), shared_scheduler.session(session_id):
+            while True:
+                # input() 会阻塞事件循环，定时写入无法执行：等待输入前先把上一轮的条目写入数据库
+                await store.flush()
+                user_input = input("请输入消息：")
+
+                try:
+                    result = await Runner.run(agent, user_input, session=session, run_config=run_config)
+                    print(result.final_output)
+                except InputGuardrailTripwireTriggered:
+                    # 护栏触发时用户消息已经写入会话，这里补上拒绝回复
+                    message = "抱歉，我无法帮你做数学作业。"
+                    print(message)
+                    await session.add_items([{
+                        "role": "assistant",
+                        "content": message,
+                    }])
+    finally:
+        await store.close()
 
 
 if __name__ == "__main__":
+    import argparse
+
     # 设置 Windows 事件循环策略
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    asyncio.run(main())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--session", default="input_guardrails", help="会话 ID，使用相同的 ID 可以在重启后继续对话。")
+    args = parser.parse_args()
+    asyncio.run(main(args.session))
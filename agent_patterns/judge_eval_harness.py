@@ -0,0 +1,395 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from agents import RunConfig, TResponseInputItem, set_tracing_disabled
+
+from deterministic import outline_checker
+from label_classifier import LabelClassifier, LabelParseError
+from llm_as_a_judge import EVALUATION_CRITERIA, evaluation_classifier, evaluator
+from priority_scheduler import PriorityScheduler, shared_scheduler
+from request_scheduler import ScheduledProvider, SimulatedBackend, SimulatedProvider
+
+"""
+离线评分：用 llm_as_a_judge.py 的 evaluator 与 deterministic.py 的 outline_checker_agent
+给大量已保存的输出打分，统计分数分布。
+
+- 逐行读取数据集（JSONL，每行 {"id": ..., "input": 用户需求, "output": 要评分的大纲}），不会一次读进内存；
+- 最多 concurrency 个模型调用同时进行；默认经过共用的 shared_scheduler，以 batch 优先级排队，
+  不会挤占同一进程中交互对话的配额。调度器同时最多放行 max_in_flight - interactive_reserve 个批量请求，
+  concurrency 超过这个数时会在 stderr 提示并按它截断；命令行单独运行时没有交互对话，
+  会按 --concurrency 新建一个 PriorityScheduler，而不是使用 shared_scheduler；
+- 结果缓存：按 评审员名称 + 提示词 + 模型 + 评审输入 的哈希缓存标签，--cache 指定的文件在多次运行之间保留，
+  同一次运行中重复的输出也只评一次；修改评审提示词后缓存自然失效；
+- 评审员直接输出枚举标签（见 label_classifier.py），离线评分使用的 evaluator 不带"第一次不能给出 pass"的要求；
+- 回复无法解析（例如被截断）时不会当成 default 标签：这条评审记为失败（LabelParseError），
+  不写入缓存、不计入分数分布，下次运行会重新评审；
+- 结果写成 NDJSON，每条记录一行、字段全部展开为一层（evaluator_score、outline_checker_quality……），
+  pandas.read_json(path, lines=True)、DuckDB read_json_auto 都可以直接按列读取；
+- 结束时输出每个标签的分布、缓存命中、错误与 token 用量，并写入 <output>.summary.json。
+
+使用方式：
+python agent_patterns/judge_eval_harness.py outputs.jsonl scores.ndjson --cache judge_cache.ndjson --concurrency 32
+python agent_patterns/judge_eval_harness.py outputs.jsonl scores.ndjson --judges outline_checker
+python agent_patterns/judge_eval_harness.py --bench   # 在模拟模型上对几千条输出评分，对比冷缓存与热缓存
+"""
+
+
+@dataclass
+class Judge:
+    name: str
+    classifier: LabelClassifier
+    # 把数据集中的一条记录转换成评审员的输入
+    build_input: Callable[[dict[str, Any]], str | list[TResponseInputItem]]
+
+
+def _evaluator_input(record: dict[str, Any]) -> list[TResponseInputItem]:
+    items: list[TResponseInputItem] = []
+    if record.get("input"):
+        items.append({"content": record["input"], "role": "user"})
+    items.append({"content": record["output"], "role": "assistant"})
+    items.append({"content": "请评审上面的故事大纲。", "role": "user"})
+    return items
+
+
+def default_judges() -> dict[str, Judge]:
+    offline_evaluator = evaluator.clone(name="离线故事大纲评审员", instructions=EVALUATION_CRITERIA)
+    return {
+        "evaluator": Judge(
+            "evaluator",
+            LabelClassifier(
+                offline_evaluator,
+                labels=evaluation_classifier.labels,
+                default=evaluation_classifier.default,
+                notes=evaluation_classifier.notes,
+            ),
+            _evaluator_input,
+        ),
+        "outline_checker": Judge("outline_checker", outline_checker, lambda record: record["output"]),
+    }
+
+
+class JudgeCache:
+    """评审结果缓存；path 不为 None 时每条新结果追加写入该 NDJSON 文件，下次运行时读回。"""
+
+    def __init__(self, path: Path | None = None):
+        self.path = path
+        self.hits = 0
+        self._entries: dict[str, dict[str, str]] = {}
+        self._file = None
+        if path is not None:
+            if path.exists():
+                with path.open("r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            # 上次中断时写了一半的最后一行
+                            continue
+                        self._entries[entry["key"]] = entry["labels"]
+            self._file = path.open("a", encoding="utf-8")
+
+    @staticmethod
+    def key(judge: Judge, judge_input: Any) -> str:
+        agent = judge.classifier.agent
+        described = [judge.name, agent.instructions, str(agent.model), judge_input]
+        return hashlib.sha256(json.dumps(described, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> dict[str, str] | None:
+        labels = self._entries.get(key)
+        if labels is not None:
+            self.hits += 1
+        return labels
+
+    def put(self, key: str, labels: dict[str, str]) -> None:
+        self._entries[key] = labels
+        if self._file is not None:
+            self._file.write(json.dumps({"key": key, "labels": labels}, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+@dataclass
+class EvaluationReport:
+    records: int = 0
+    judge_calls: int = 0
+    cache_hits: int = 0
+    failed: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    elapsed: float = 0.0
+    errors: Counter = field(default_factory=Counter)
+    # "evaluator.score" -> Counter({"pass": 812, ...})
+    distributions: dict[str, Counter] = field(default_factory=dict)
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "records": self.records,
+            "judge_calls": self.judge_calls,
+            "cache_hits": self.cache_hits,
+            "failed": self.failed,
+            "records_per_s": round(self.records / self.elapsed, 1) if self.elapsed else 0.0,
+            "elapsed_s": round(self.elapsed, 2),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "errors": dict(self.errors.most_common(10)),
+            "distributions": {
+                name: {label: {"count": count, "ratio": round(count / sum(counter.values()), 4)} for label, count in counter.most_common()}
+                for name, counter in sorted(self.distributions.items())
+            },
+        }
+
+
+def read_dataset(path: Path, id_field: str, input_field: str, output_field: str) -> Iterator[dict[str, Any]]:
+    with path.open("r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield {"id": str(record.get(id_field, line_no)), "input": record.get(input_field), "output": record[output_field]}
+
+
+async def run_evaluation(
+    dataset_path: Path,
+    output_path: Path,
+    judges: dict[str, Judge],
+    concurrency: int = 16,
+    cache: JudgeCache | None = None,
+    run_config: RunConfig | None = None,
+    id_field: str = "id",
+    input_field: str = "input",
+    output_field: str = "output",
+    progress_interval: float = 5.0,
+    scheduler: PriorityScheduler = shared_scheduler,
+) -> EvaluationReport:
+    """run_config 为 None 时经过 scheduler 以 batch 优先级排队；传入 run_config 时 scheduler 只用于标记优先级。"""
+    report = EvaluationReport()
+    if cache is None:
+        cache = JudgeCache()
+    if run_config is None:
+        run_config = RunConfig(model_provider=ScheduledProvider(scheduler))
+        batch_slots = scheduler.max_in_flight - scheduler.interactive_reserve
+        if concurrency > batch_slots:
+            # 多出来的 worker 只会在调度器里排队，不会提高吞吐
+            print(
+                f"[提示] 调度器最多同时放行 {batch_slots} 个批量请求，concurrency 从 {concurrency} 降为 {batch_slots}",
+                file=sys.stderr,
+            )
+            concurrency = batch_slots
+    calls = asyncio.Semaphore(concurrency)
+    # 同一次运行中正在评审的输入，重复的输出等待同一次评审
+    pending: dict[str, asyncio.Future] = {}
+    queue: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue(maxsize=concurrency * 4)
+    started = time.perf_counter()
+
+    async def judge_record(judge: Judge, record: dict[str, Any]) -> tuple[dict[str, str], bool]:
+        judge_input = judge.build_input(record)
+        key = JudgeCache.key(judge, judge_input)
+        labels = cache.get(key)
+        if labels is not None:
+            return labels, True
+        if key in pending:
+            return await asyncio.shield(pending[key]), True
+        future = pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            async with calls:
+                report.judge_calls += 1
+                try:
+                    labels, usage = await judge.classifier.classify_with_usage(judge_input, run_config=run_config, strict=True)
+                except LabelParseError as error:
+                    # 解析失败的结果不缓存，否则一次截断的回复会在之后每次运行中都变成 default 标签
+                    report.input_tokens += error.usage.input_tokens
+                    report.output_tokens += error.usage.output_tokens
+                    raise
+            report.input_tokens += usage.input_tokens
+            report.output_tokens += usage.output_tokens
+            cache.put(key, labels)
+            future.set_result(labels)
+            return labels, False
+        except BaseException as error:
+            future.set_exception(error)
+            # 没有人等待时也要取走异常，避免 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del pending[key]
+
+    async def produce() -> None:
+        for record in read_dataset(dataset_path, id_field, input_field, output_field):
+            await queue.put(record)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work(output: Any) -> None:
+        while (record := await queue.get()) is not None:
+            row: dict[str, Any] = {"id": record["id"]}
+            record_started = time.perf_counter()
+            results = await asyncio.gather(
+                *(judge_record(judge, record) for judge in judges.values()), return_exceptions=True
+            )
+            cached = 0
+            for judge, result in zip(judges.values(), results):
+                if isinstance(result, BaseException):
+                    if not isinstance(result, Exception):
+                        raise result
+                    report.failed += 1
+                    report.errors[type(result).__name__] += 1
+                    row[f"{judge.name}_error"] = f"{type(result).__name__}: {result}"
+                    continue
+                labels, hit = result
+                cached += hit
+                for name, value in labels.items():
+                    row[f"{judge.name}_{name}"] = value
+                    if name in judge.classifier.labels:
+                        report.distributions.setdefault(f"{judge.name}.{name}", Counter())[value] += 1
+            row["cached_judges"] = cached
+            row["latency_ms"] = round((time.perf_counter() - record_started) * 1000, 1)
+            report.records += 1
+            report.cache_hits += cached
+            output.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    async def show_progress() -> None:
+        while True:
+            await asyncio.sleep(progress_interval)
+            elapsed = time.perf_counter() - started
+            print(
+                f"[进度] 已评分 {report.records} 条，模型调用 {report.judge_calls} 次，缓存命中 {report.cache_hits} 次，"
+                f"{report.records / elapsed:.1f} 条/s",
+                file=sys.stderr,
+            )
+
+    progress = asyncio.ensure_future(show_progress())
+    try:
+        with output_path.open("w", encoding="utf-8") as output, scheduler.priority("batch"):
+            await asyncio.gather(produce(), *(work(output) for _ in range(concurrency)))
+    finally:
+        progress.cancel()
+        report.elapsed = time.perf_counter() - started
+    output_path.with_name(output_path.name + ".summary.json").write_text(
+        json.dumps(report.summary(), ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+    return report
+
+
+def _simulated_judges(system_instructions: str | None, input: Any) -> str:
+    """模拟两个评审员：大纲中的"质量"决定评分，出现"飞船"算科幻故事。"""
+    text = input if isinstance(input, str) else json.dumps(input, ensure_ascii=False)
+    quality = float(text.split("质量 ")[-1][:4]) if "质量 " in text else 0.0
+    if "信号丢失" in text:
+        # 少数记录的回复总是被截断，评审应记为失败而不是 default 标签
+        return '{"score": "pa'
+    if "判断大纲质量" in (system_instructions or ""):
+        return json.dumps({
+            "quality": "质量良好" if quality >= 0.5 else "质量较差",
+            "genre": "是科幻故事" if "飞船" in text else "不是科幻故事",
+        }, ensure_ascii=False)
+    score = "pass" if quality >= 0.8 else "needs_improvement" if quality >= 0.4 else "fail"
+    return json.dumps({"score": score, "feedback": "结尾可以更有力。"}, ensure_ascii=False)
+
+
+async def bench(records: int = 3000, concurrency: int = 32) -> None:
+    """records 条已保存的输出（约 20% 重复）；第一次运行冷缓存，第二次运行复用缓存文件。"""
+    set_tracing_disabled(disabled=True)
+    rng = random.Random(0)
+    backend = SimulatedBackend(latency=0.05, capacity=concurrency, rps=1_000_000, responder=_simulated_judges)
+    run_config = RunConfig(model_provider=SimulatedProvider(backend))
+    judges = default_judges()
+
+    with tempfile.TemporaryDirectory() as directory:
+        dataset_path = Path(directory) / "outputs.jsonl"
+        cache_path = Path(directory) / "judge_cache.ndjson"
+        outputs: list[str] = []
+        with dataset_path.open("w", encoding="utf-8") as f:
+            for i in range(records):
+                if outputs and rng.random() < 0.2:
+                    outline = rng.choice(outputs)
+                else:
+                    topic = "一艘飞船在深空发现了信号" if rng.random() < 0.6 else "两位老朋友在小镇重逢"
+                    if rng.random() < 0.01:
+                        topic = "一艘飞船信号丢失"
+                    outline = f"大纲 {i}：{topic}（质量 {rng.betavariate(4, 2):.2f}）"
+                    outputs.append(outline)
+                f.write(json.dumps({"id": f"r{i}", "input": "一个科幻故事", "output": outline}, ensure_ascii=False) + "\n")
+
+        for label in ("冷缓存", "热缓存"):
+            cache = JudgeCache(cache_path)
+            calls_before = backend.calls
+            report = await run_evaluation(
+                dataset_path, Path(directory) / "scores.ndjson", judges, concurrency, cache, run_config
+            )
+            cache.close()
+            summary = report.summary()
+            print(
+                f"[{label}] {summary['records']} 条，{summary['records_per_s']} 条/s，耗时 {summary['elapsed_s']} s，"
+                f"模型调用 {backend.calls - calls_before} 次，缓存命中 {summary['cache_hits']} 次，失败 {summary['failed']} {summary['errors']}"
+            )
+        for name, distribution in summary["distributions"].items():
+            print(f"  {name}: " + "，".join(f"{value} {item['ratio']:.1%}" for value, item in distribution.items()))
+
+        started = time.perf_counter()
+        with (Path(directory) / "scores.ndjson").open("r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        print(f"  读回 {len(rows)} 行结果用时 {(time.perf_counter() - started) * 1000:.1f} ms，列：{sorted(rows[0])}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset", nargs="?", type=Path, help="要评分的数据集（JSONL）。")
+    parser.add_argument("output", nargs="?", type=Path, help="评分结果（NDJSON），同时写出 <output>.summary.json。")
+    parser.add_argument("--judges", default="evaluator,outline_checker", help="使用哪些评审员，逗号分隔。")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时进行的模型调用数。")
+    parser.add_argument("--cache", type=Path, help="评审结果缓存文件，多次运行之间复用。")
+    parser.add_argument("--id-field", default="id", help="记录 id 的字段名。")
+    parser.add_argument("--input-field", default="input", help="用户需求的字段名（可以没有）。")
+    parser.add_argument("--output-field", default="output", help="要评分的输出的字段名。")
+    parser.add_argument("--bench", action="store_true", help="在模拟模型上演示冷缓存与热缓存的评分吞吐。")
+    args = parser.parse_args()
+
+    if args.bench:
+        asyncio.run(bench())
+    else:
+        if args.dataset is None or args.output is None:
+            parser.error("需要指定数据集和输出文件")
+        if not os.getenv("API_KEY"):
+            raise ValueError("请设置 API_KEY 环境变量")
+        available = default_judges()
+        unknown = set(args.judges.split(",")) - set(available)
+        if unknown:
+            parser.error(f"未知的评审员：{', '.join(sorted(unknown))}，可选：{', '.join(available)}")
+        judge_cache = JudgeCache(args.cache)
+        try:
+            evaluation_report = asyncio.run(run_evaluation(
+                args.dataset,
+                args.output,
+                {name: available[name] for name in args.judges.split(",")},
+                concurrency=args.concurrency,
+                cache=judge_cache,
+                # 单独运行时进程里没有交互对话，调度器按 --concurrency 放行批量请求，另外保留 1 个交互名额
+                scheduler=PriorityScheduler(max_in_flight=args.concurrency + 1),
+                id_field=args.id_field,
+                input_field=args.input_field,
+                output_field=args.output_field,
+            ))
+        finally:
+            judge_cache.close()
+        print(json.dumps(evaluation_report.summary(), ensure_ascii=False, indent=2))
@@ -0,0 +1,402 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Literal, Mapping, Sequence
+
+import openai
+from pydantic import Field, create_model
+
+from agents import (
+    Agent,
+    AgentOutputSchema,
+    Model,
+    ModelBehaviorError,
+    ModelProvider,
+    ModelResponse,
+    ModelSettings,
+    RunConfig,
+    RunContextWrapper,
+    RunHooks,
+    Runner,
+    TResponseInputItem,
+    Usage,
+    set_tracing_disabled,
+)
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseCreatedEvent,
+    ResponseOutputMessage,
+    ResponseOutputText,
+    ResponseTextDeltaEvent,
+)
+from openai.types.responses.response_usage import InputTokensDetails, OutputTokensDetails, ResponseUsage
+
+"""
+只输出几个固定标签的分类调用。
+
+routing.py 的 language_detector、deterministic.py 的 outline_checker_agent、llm_as_a_judge.py 的 evaluator、
+input_guardrails.py 的 guardrail_agent 实际只需要返回一两个很短的标签，但都是让模型自由输出文本，
+再用 "质量良好" in text、parse_feedback 逐行扫描之类的方式解析。模型一旦展开解释，就白白多输出很多 token，
+还可能解析错（"是科幻故事" 也出现在 "不是科幻故事" 里）。
+
+LabelClassifier 包装原来的 Agent：
+- labels 给出每个字段允许的取值，notes 给出可以自由填写的短文本字段（例如评审建议）；
+- 默认使用结构化输出：每个标签字段是枚举，模型只能输出符合 JSON Schema 的对象；
+- 服务商不支持结构化输出（例如返回 400）时自动改为文本模式，只在提示中要求输出 JSON；
+- 两种模式都设置很小的 max_tokens（按字段数估算）与 temperature=0；
+- 文本输出依次尝试：JSON 对象、key=value 或 key: value 行、在全文中查找取值
+  （较长的取值优先，"不是科幻故事" 不会被当成 "是科幻故事"）；仍然解析不出的字段使用 default，
+  classify_with_usage(..., strict=True) 时改为抛出 LabelParseError，调用方可以区分"判为 default"与"没有解析出来"；
+- stats() 返回调用次数、每次分类平均输出的 token 数、文本模式与无法解析的次数。
+
+使用方式：
+    checker = LabelClassifier(
+        outline_checker_agent,
+        labels={"quality": ("质量良好", "质量较差"), "genre": ("是科幻故事", "不是科幻故事")},
+        default={"quality": "质量较差", "genre": "不是科幻故事"},
+    )
+    result = await checker.classify(outline)   # {"quality": "质量良好", "genre": "是科幻故事"}
+
+python agent_patterns/label_classifier.py --bench   # 在会"跑题"的模拟模型上对比自由文本与标签分类器的输出 token 数
+"""
+
+# 服务商不支持 json_schema 格式的结构化输出时返回的错误
+UNSUPPORTED_SCHEMA_ERRORS = (openai.BadRequestError, openai.UnprocessableEntityError)
+
+
+class LabelParseError(ValueError):
+    """strict 模式下，文本输出中有标签字段解析不出来（例如回复被截断）；usage 是这一次调用的用量。"""
+
+    def __init__(self, fields: Sequence[str], output: str, usage: Usage):
+        super().__init__(f"无法解析字段 {', '.join(fields)}：{output[:80]!r}")
+        self.fields = tuple(fields)
+        self.output = output
+        self.usage = usage
+
+
+def _normalize(text: str) -> str:
+    return text.strip().strip("`'\"“”。.，,").replace(" ", "").lower()
+
+
+def _find_choice(text: str, choices: Sequence[str]) -> str | None:
+    """在全文中查找唯一出现的取值；较长的取值先占位，被它覆盖的较短取值不算。"""
+    lowered = text.lower()
+    taken: list[tuple[int, int]] = []
+    found: set[str] = set()
+    for choice in sorted(choices, key=len, reverse=True):
+        needle = choice.lower()
+        for match in re.finditer(re.escape(needle), lowered):
+            span = match.span()
+            if any(start < span[1] and span[0] < end for start, end in taken):
+                continue
+            taken.append(span)
+            found.add(choice)
+    return found.pop() if len(found) == 1 else None
+
+
+def parse_labels(text: str, labels: Mapping[str, Sequence[str]], notes: Sequence[str] = ()) -> dict[str, str]:
+    """从模型的文本输出中解析标签与短文本字段，解析不出的字段不出现在结果中。"""
+    values: dict[str, str] = {}
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            data = None
+        if isinstance(data, dict):
+            values = {key: str(value) for key, value in data.items() if key in labels or key in notes}
+    for name in [*labels, *notes]:
+        if name in values:
+            continue
+        # key=value、key: value，也兼容被截断的 JSON（"key": "value...）
+        line = re.search(rf'"?{re.escape(name)}"?\s*[:=：]\s*"?([^"\n]*)', text, re.IGNORECASE)
+        if line:
+            values[name] = line.group(1).strip().rstrip(",}")
+    result: dict[str, str] = {}
+    for name, choices in labels.items():
+        by_normalized = {_normalize(choice): choice for choice in choices}
+        label = by_normalized.get(_normalize(values.get(name, "")))
+        if label is None:
+            label = _find_choice(values.get(name) or text, choices)
+        if label is not None:
+            result[name] = label
+    for name in notes:
+        if name in values:
+            result[name] = values[name]
+    return result
+
+
+class LabelClassifier:
+    def __init__(
+        self,
+        agent: Agent[Any],
+        labels: Mapping[str, Sequence[str]],
+        default: Mapping[str, str],
+        notes: Mapping[str, str] | None = None,
+        run_config: RunConfig | None = None,
+        structured: bool = True,
+        max_tokens: int | None = None,
+    ):
+        for name, choices in labels.items():
+            if default.get(name) not in choices:
+                raise ValueError(f"字段 {name} 的 default 必须是取值之一：{default.get(name)}")
+        self.agent = agent
+        self.labels = {name: tuple(choices) for name, choices in labels.items()}
+        self.default = dict(default)
+        # 短文本字段：名称 -> 说明，例如 {"feedback": "你的建议，不超过 80 字"}
+        self.notes = dict(notes or {})
+        self.run_config = run_config
+        self.structured = structured
+        # 每个标签字段约 12 个 token，每个短文本字段约 120 个 token
+        self.max_tokens = max_tokens or 8 + 12 * len(self.labels) + 120 * len(self.notes)
+        self.calls = 0
+        self.output_tokens = 0
+        self.text_calls = 0
+        self.unparsed = 0
+        settings = agent.model_settings.resolve(ModelSettings(max_tokens=self.max_tokens, temperature=0))
+        fields: dict[str, Any] = {name: (Literal[choices], ...) for name, choices in self.labels.items()}
+        fields.update({name: (str, Field(description=description)) for name, description in self.notes.items()})
+        schema = create_model(f"{agent.name}_labels".replace(" ", "_"), **fields)
+        self._structured_agent = agent.clone(output_type=AgentOutputSchema(schema), model_settings=settings)
+        example = {name: "|".join(choices) for name, choices in self.labels.items()}
+        example.update(self.notes)
+        self._text_agent = agent.clone(
+            output_type=str,
+            model_settings=settings,
+            instructions=(
+                f"{agent.instructions}\n"
+                f"只输出一个 JSON 对象，格式为 {json.dumps(example, ensure_ascii=False)}，不要输出其他内容。"
+            ),
+        )
+
+    async def classify(self, input: str | list[TResponseInputItem]) -> dict[str, str]:
+        labels, _ = await self.classify_with_usage(input)
+        return labels
+
+    async def classify_with_usage(
+        self, input: str | list[TResponseInputItem], run_config: RunConfig | None = None, strict: bool = False
+    ) -> tuple[dict[str, str], Usage]:
+        """与 classify 相同，另外返回这一次分类的用量；run_config 不为 None 时替换构造时的 run_config。
+
+        strict=True 时，标签字段解析不出来不再使用 default，而是抛出 LabelParseError。
+        """
+        self.calls += 1
+        run_config = run_config or self.run_config
+        usage = Usage()
+        if self.structured:
+            recorder = _UsageRecorder()
+            try:
+                result = await Runner.run(self._structured_agent, input, run_config=run_config, hooks=recorder)
+            except UNSUPPORTED_SCHEMA_ERRORS:
+                # 服务商不支持结构化输出，之后都使用文本模式
+                self.structured = False
+            except ModelBehaviorError:
+                # 输出不符合 JSON Schema（很少见），这一次改用文本模式；
+                # 失败的这次调用同样计费，异常里通常没有 run_data，用量取自 on_llm_end 记录的模型响应
+                usage.add(recorder.usage)
+                self.output_tokens += recorder.usage.output_tokens
+            else:
+                usage.add(result.context_wrapper.usage)
+                self.output_tokens += result.context_wrapper.usage.output_tokens
+                return {**self.default, **result.final_output.model_dump()}, usage
+        self.text_calls += 1
+        result = await Runner.run(self._text_agent, input, run_config=run_config)
+        usage.add(result.context_wrapper.usage)
+        self.output_tokens += result.context_wrapper.usage.output_tokens
+        output = str(result.final_output)
+        parsed = parse_labels(output, self.labels, tuple(self.notes))
+        missing = [name for name in self.labels if name not in parsed]
+        if missing:
+            self.unparsed += 1
+            if strict:
+                raise LabelParseError(missing, output, usage)
+        return {**self.default, **{name: "" for name in self.notes if name not in self.default}, **parsed}, usage
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "output_tokens": self.output_tokens,
+            "avg_output_tokens": round(self.output_tokens / self.calls, 1) if self.calls else 0.0,
+            "structured": self.structured,
+            "text_calls": self.text_calls,
+            "unparsed": self.unparsed,
+            "max_tokens": self.max_tokens,
+        }
+
+
+class _UsageRecorder(RunHooks):
+    """累计一次 run 中每个模型响应的用量；run 抛出异常时也能拿到已经发生的调用的用量。"""
+
+    def __init__(self):
+        self.usage = Usage()
+
+    async def on_llm_end(self, context: RunContextWrapper[Any], agent: Agent[Any], response: ModelResponse) -> None:
+        self.usage.add(response.usage)
+
+
+class _RamblingBackend(Model):
+    """用于 --bench 的模拟模型：自由输出时经常附带大段解释；按 max_tokens 截断，输出 token 按 2 字符 1 个计算。"""
+
+    def __init__(self, latency: float = 0.05, token_latency: float = 0.002, structured: bool = True):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.structured = structured
+
+    def _answer(self, input: Any) -> tuple[str, str]:
+        text = input if isinstance(input, str) else json.dumps(input, ensure_ascii=False)
+        return ("质量良好" if "完整" in text else "质量较差"), ("是科幻故事" if "飞船" in text else "不是科幻故事")
+
+    async def get_response(self, system_instructions: str | None, input: Any, model_settings: ModelSettings, tools: Any, output_schema: Any, *args: Any, **kwargs: Any) -> ModelResponse:
+        quality, genre = self._answer(input)
+        if output_schema is not None and not output_schema.is_plain_text():
+            if not self.structured:
+                raise openai.BadRequestError("response_format json_schema is unavailable", response=_FakeResponse(), body=None)
+            text = json.dumps({"quality": quality, "genre": genre}, ensure_ascii=False)
+        elif "只输出一个 JSON 对象" in (system_instructions or ""):
+            text = json.dumps({"quality": quality, "genre": genre}, ensure_ascii=False)
+            if random.random() < 0.2:
+                text = f"好的，判断如下：\n```json\n{text}\n```"
+        else:
+            text = f"{quality}，{genre}。" if random.random() < 0.3 else (
+                f"我仔细阅读了这个大纲。整体来看{quality}：情节有起承转合，人物动机也基本交代清楚了。"
+                f"从题材上说，{genre}，因为故事的核心设定围绕{'未来科技与太空探索' if genre == '是科幻故事' else '日常生活与人物关系'}展开。"
+                "如果要进一步改进，可以加强结尾的冲突，并补充主角的成长线。总结：" + f"{quality}，{genre}。"
+            )
+        if model_settings.max_tokens:
+            text = text[: model_settings.max_tokens * 2]
+        output_tokens = max(1, math.ceil(len(text) / 2))
+        await asyncio.sleep(self.latency + self.token_latency * output_tokens)
+        message = ResponseOutputMessage(
+            id="msg",
+            type="message",
+            role="assistant",
+            status="completed",
+            content=[ResponseOutputText(type="output_text", text=text, annotations=[])],
+        )
+        return ModelResponse(
+            output=[message],
+            usage=Usage(requests=1, input_tokens=120, output_tokens=output_tokens, total_tokens=120 + output_tokens),
+            response_id=None,
+        )
+
+    async def stream_response(
+        self, system_instructions: str | None, input: Any, model_settings: ModelSettings, tools: Any, output_schema: Any, *args: Any, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        # 把 get_response 的结果按流式事件重放：created -> 一个文本增量 -> completed
+        response = await self.get_response(system_instructions, input, model_settings, tools, output_schema, *args, **kwargs)
+        message = response.output[0]
+        usage = response.usage
+        created = Response(
+            id="resp",
+            created_at=time.time(),
+            model="rambling",
+            object="response",
+            output=[],
+            tool_choice="auto",
+            parallel_tool_calls=False,
+            tools=[],
+        )
+        yield ResponseCreatedEvent(type="response.created", response=created, sequence_number=0)
+        yield ResponseTextDeltaEvent(
+            type="response.output_text.delta",
+            item_id=message.id,
+            output_index=0,
+            content_index=0,
+            delta=message.content[0].text,
+            logprobs=[],
+            sequence_number=1,
+        )
+        completed = created.model_copy(update={
+            "output": [message],
+            "status": "completed",
+            "usage": ResponseUsage(
+                input_tokens=usage.input_tokens,
+                input_tokens_details=InputTokensDetails(cached_tokens=0, cache_write_tokens=0),
+                output_tokens=usage.output_tokens,
+                output_tokens_details=OutputTokensDetails(reasoning_tokens=0),
+                total_tokens=usage.total_tokens,
+            ),
+        })
+        yield ResponseCompletedEvent(type="response.completed", response=completed, sequence_number=2)
+
+
+class _FakeResponse:
+    """openai.BadRequestError 需要一个带 request 属性的响应对象。"""
+
+    status_code = 400
+    headers: dict[str, str] = {}
+    request = None
+
+
+class _BackendProvider(ModelProvider):
+    def __init__(self, backend: Model):
+        self.backend = backend
+
+    def get_model(self, model_name: str | None) -> Model:
+        return self.backend
+
+
+async def bench(samples: int = 200) -> None:
+    """用 outline_checker_agent 的提示对 samples 个大纲做质量与题材判断，对比输出 token 数、延迟与判断正确率。"""
+    set_tracing_disabled(disabled=True)
+    checker_agent = Agent(
+        name="outline_checker_agent",
+        instructions=(
+            "阅读给定的故事大纲，判断大纲质量是否良好，并判断它是否属于科幻故事。"
+            "请明确输出，例如：“质量良好，是科幻故事。”或者“质量较差，不是科幻故事。”"
+        ),
+        output_type=str,
+    )
+    outlines = [
+        f"大纲 {i}：{'一艘飞船在深空发现了信号' if i % 2 else '两位老朋友在小镇重逢'}，{'结构完整' if i % 3 else '只有开头'}。"
+        for i in range(samples)
+    ]
+    expected = [("质量良好" if "完整" in o else "质量较差", "是科幻故事" if "飞船" in o else "不是科幻故事") for o in outlines]
+    labels = {"quality": ("质量良好", "质量较差"), "genre": ("是科幻故事", "不是科幻故事")}
+    default = {"quality": "质量较差", "genre": "不是科幻故事"}
+
+    async def free_text(run_config: RunConfig) -> tuple[list[tuple[str, str]], int]:
+        # 原来的做法：自由输出，再用子串判断
+        results = await asyncio.gather(*(Runner.run(checker_agent, o, run_config=run_config) for o in outlines))
+        answers = [
+            ("质量良好" if "质量良好" in r.final_output else "质量较差", "是科幻故事" if "是科幻故事" in r.final_output else "不是科幻故事")
+            for r in results
+        ]
+        return answers, sum(r.context_wrapper.usage.output_tokens for r in results)
+
+    for label, structured in (("自由文本 + 子串判断", None), ("标签分类器（结构化输出）", True), ("标签分类器（不支持结构化输出的服务商）", False)):
+        run_config = RunConfig(model_provider=_BackendProvider(_RamblingBackend(structured=structured is not False)))
+        started = time.perf_counter()
+        if structured is None:
+            answers, tokens = await free_text(run_config)
+            extra = ""
+        else:
+            classifier = LabelClassifier(checker_agent, labels, default, run_config=run_config)
+            results = await asyncio.gather(*(classifier.classify(o) for o in outlines))
+            answers = [(r["quality"], r["genre"]) for r in results]
+            tokens = classifier.output_tokens
+            extra = f"，{classifier.stats()}"
+        elapsed = time.perf_counter() - started
+        correct = sum(a == e for a, e in zip(answers, expected))
+        print(
+            f"[{label}] 每次分类平均输出 {tokens / samples:.1f} 个 token，"
+            f"总耗时 {elapsed:.2f} s，正确 {correct}/{samples}{extra}"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="对比自由文本与标签分类器的输出 token 数。")
+    args = parser.parse_args()
+    if args.bench:
+        asyncio.run(bench())
+    else:
+        parser.print_help()
@@ -1,10 +1,16 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import json
 import os
-from dataclasses import dataclass
+import random
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Literal
+from typing import Any, Literal
 
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
@@ -12,13 +18,18 @@ from dotenv import load_dotenv
 from agents import (
     Agent,
     ItemHelpers,
+    RunConfig,
     Runner,
     TResponseInputItem,
+    Usage,
     set_default_openai_client,
     set_default_openai_api,
     set_tracing_disabled,
 )
 
+from label_classifier import LabelClassifier
+from request_scheduler import SimulatedBackend, SimulatedProvider
+
 # 加载 .env 环境变量
 env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path=env_path)
@@ -27,18 +38,36 @@ BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
 API_KEY = os.getenv("API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
 
-if not API_KEY:
-    raise ValueError("请设置 _API_KEY 环境变量")
-
-client = AsyncOpenAI(
-    base_url=BASE_URL,
-    api_key=API_KEY,
-)
+# 没有 API_KEY 时仍可以导入本模块并运行 --bench，main() 中再检查
+if API_KEY:
+    client = AsyncOpenAI(
+        base_url=BASE_URL,
+        api_key=API_KEY,
+    )
 
-set_default_openai_client(client=client, use_for_tracing=False)
-set_default_openai_api("chat_completions")
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
 set_tracing_disabled(disabled=True)
 
+"""
+生成故事大纲，由评审员打分，没通过就根据反馈重新生成。
+
+原来的循环没有次数上限，并且把越来越长的 input_items（每一版大纲和每一条反馈）
+同时发给生成器和评审员，每一轮的输入 token 都比上一轮多。现在：
+- max_iterations 限制最多生成几轮，用完后返回评分最好的一版（同分取较新的）；
+- 只发送最新的一版大纲与反馈：生成器收到 用户需求 + 上一版大纲 + 反馈，评审员收到 用户需求 + 待评审的大纲；
+- 评审结果按 用户需求 + 大纲 的哈希缓存，同一版大纲不再重复评审。
+  评审员被要求第一轮一定不能给出 pass，所以第一轮的结果不写入、也不读取缓存；
+- 每一轮记录生成与评审的耗时、输入与输出 token 数；
+- --candidates N：每轮并发生成 N 个大纲、并发评审，保留评分最好的一个，下一轮基于它改进。
+  每轮的耗时接近单个大纲，但更容易出现高分大纲，到通过评审所需的串行轮数更少（token 用量约为 N 倍）。
+
+使用方式：
+python agent_patterns/llm_as_a_judge.py --max-iterations 5
+python agent_patterns/llm_as_a_judge.py --candidates 3
+python agent_patterns/llm_as_a_judge.py --bench   # 在模拟模型上对比完整历史与只发送最新大纲的 token 数，以及每轮 1、3、5 个候选到通过的耗时
+"""
+
 # 故事大纲生成代理
 story_outline_generator = Agent(
     name="故事大纲生成器",
@@ -49,20 +78,30 @@ story_outline_generator = Agent(
     model=MODEL_NAME,
 )
 
-# 故事评审代理，返回结构化字符串：score=xxx\nfeedback=xxx
+# 评审标准；离线评分（judge_eval_harness.py）只使用这部分，不带"第一次不能给出 pass"的要求
+EVALUATION_CRITERIA = (
+    "你负责评审故事大纲是否足够优秀。\n"
+    "给出评分 score（pass、needs_improvement 或 fail）和简短的改进建议 feedback。"
+)
+
+# 故事评审代理，给出评分 score 与建议 feedback
 evaluator = Agent(
     name="故事大纲评审员",
-    instructions=(
-        "你负责评审故事大纲是否足够优秀。\n"
-        "请只返回如下格式内容，不要添加其他语言：\n"
-        "score=pass|needs_improvement|fail\n"
-        "feedback=你的建议内容\n"
-        "请注意第一次一定不能给出 pass"
-    ),
+    instructions=EVALUATION_CRITERIA + "\n请注意第一次一定不能给出 pass",
     output_type=str,
     model=MODEL_NAME,
 )
 
+# 评分是枚举，建议限制在一两句话：结构化输出 + 很小的 max_tokens，不再逐行解析自由文本
+evaluation_classifier = LabelClassifier(
+    evaluator,
+    labels={"score": ("pass", "needs_improvement", "fail")},
+    notes={"feedback": "改进建议，不超过 80 字"},
+    default={"score": "fail"},
+)
+
+SCORE_RANK = {"fail": 0, "needs_improvement": 1, "pass": 2}
+
 
 @dataclass
 class EvaluationFeedback:
@@ -70,56 +109,287 @@ class EvaluationFeedback:
     score: Literal["pass", "needs_improvement", "fail"]
 
 
-def parse_feedback(raw_text: str) -> EvaluationFeedback:
-    """解析评审员返回的字符串为结构化对象"""
-    lines = raw_text.strip().splitlines()
-    score = "fail"
-    feedback = ""
+class VerdictCache:
+    """按 用户需求 + 大纲 的哈希缓存评审结果，最多保留 max_entries 条（最近最少使用的先淘汰）。"""
 
-    for line in lines:
-        if line.lower().startswith("score="):
-            score = line.split("=", 1)[1].strip()
-        elif line.lower().startswith("feedback="):
-            feedback = line.split("=", 1)[1].strip()
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, EvaluationFeedback] = OrderedDict()
 
-    return EvaluationFeedback(score=score, feedback=feedback)
+    @staticmethod
+    def key(request: str, outline: str) -> str:
+        return hashlib.sha256(f"{request}\n{outline}".encode("utf-8")).hexdigest()
 
+    def get(self, key: str) -> EvaluationFeedback | None:
+        verdict = self._entries.get(key)
+        if verdict is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return verdict
 
-# 主函数
-async def main() -> None:
-    msg = input("你想听一个什么样的故事？")
-    input_items: list[TResponseInputItem] = [{"content": msg, "role": "user"}]
-    latest_outline: str | None = None
-
-    while True:
-        # 1. 生成故事大纲
-        story_outline_result = await Runner.run(
-            story_outline_generator,
-            input_items,
-        )
-        input_items = story_outline_result.to_input_list()
-        latest_outline = ItemHelpers.text_message_outputs(story_outline_result.new_items)
-        print("故事大纲已生成：")
-        print(latest_outline)
-
-        # 2. 执行评审逻辑（字符串输出 + 结构化解析）
-        evaluator_result = await Runner.run(evaluator, input_items)
-        raw_output = evaluator_result.final_output
-        print("评审原始输出：\n", raw_output)
-        result = parse_feedback(raw_output)
-
-        if result.score == "pass":
-            print("大纲已通过评审，流程结束。")
+    def put(self, key: str, verdict: EvaluationFeedback) -> None:
+        self._entries[key] = verdict
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+verdict_cache = VerdictCache()
+
+
+@dataclass
+class IterationStats:
+    iteration: int
+    score: str
+    # 这一轮直接使用缓存结果的评审次数
+    cached: int
+    generate_ms: float
+    evaluate_ms: float
+    input_tokens: int
+    output_tokens: int
+    candidates: int = 1
+
+
+@dataclass
+class JudgeResult:
+    outline: str
+    feedback: EvaluationFeedback
+    passed: bool
+    iterations: list[IterationStats] = field(default_factory=list)
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "passed": self.passed,
+            "iterations": len(self.iterations),
+            "cached_evaluations": sum(stats.cached for stats in self.iterations),
+            "input_tokens": sum(stats.input_tokens for stats in self.iterations),
+            "output_tokens": sum(stats.output_tokens for stats in self.iterations),
+            "elapsed_ms": round(sum(stats.generate_ms + stats.evaluate_ms for stats in self.iterations), 1),
+        }
+
+
+async def evaluate(
+    input_items: list[TResponseInputItem], run_config: RunConfig | None = None
+) -> tuple[EvaluationFeedback, Usage]:
+    """调用评审员，得到结构化的评分与建议；无法解析评分时按 fail 处理"""
+    labels, usage = await evaluation_classifier.classify_with_usage(input_items, run_config=run_config)
+    return EvaluationFeedback(score=labels["score"], feedback=labels["feedback"]), usage
+
+
+async def judge_loop(
+    request: str,
+    max_iterations: int = 5,
+    trim_history: bool = True,
+    cache: VerdictCache | None = verdict_cache,
+    run_config: RunConfig | None = None,
+    verbose: bool = False,
+    candidates: int = 1,
+) -> JudgeResult:
+    """反复生成与评审直到通过或用完 max_iterations 轮；trim_history=False 时按原来的方式发送完整历史。
+
+    candidates > 1 时每轮并发生成 candidates 个大纲、并发评审，保留评分最好的一个，下一轮基于它改进。
+    """
+    if max_iterations < 1:
+        raise ValueError(f"max_iterations 至少为 1，收到：{max_iterations}")
+    if candidates < 1:
+        raise ValueError(f"candidates 至少为 1，收到：{candidates}")
+    if candidates > 1 and not trim_history:
+        raise ValueError("每轮生成多个候选时只能发送最新大纲（trim_history=True）")
+    history: list[TResponseInputItem] = [{"content": request, "role": "user"}]
+    best: JudgeResult | None = None
+    iterations: list[IterationStats] = []
+    feedback: EvaluationFeedback | None = None
+    outline = ""
+
+    async def generate(candidate: int) -> tuple[str, Usage]:
+        if trim_history and feedback is not None:
+            generator_input: list[TResponseInputItem] = [
+                {"content": request, "role": "user"},
+                {"content": outline, "role": "assistant"},
+                {"content": f"Feedback: {feedback.feedback}", "role": "user"},
+            ]
+        else:
+            generator_input = list(history)
+        if candidates > 1:
+            # 同一轮的候选使用不同的提示，避免模型给出相同的大纲
+            generator_input.append({"content": f"请给出与其他版本不同的写法（候选 {candidate + 1}/{candidates}）。", "role": "user"})
+        story_outline_result = await Runner.run(story_outline_generator, generator_input, run_config=run_config)
+        if not trim_history:
+            history[:] = story_outline_result.to_input_list()
+        return ItemHelpers.text_message_outputs(story_outline_result.new_items), story_outline_result.context_wrapper.usage
+
+    async def judge(candidate_outline: str, iteration: int) -> tuple[EvaluationFeedback, Usage, bool]:
+        key = VerdictCache.key(request, candidate_outline)
+        cached = cache.get(key) if cache is not None and iteration > 1 else None
+        if cached is not None:
+            return cached, Usage(), True
+        if trim_history:
+            evaluator_input: list[TResponseInputItem] = [
+                {"content": request, "role": "user"},
+                {"content": candidate_outline, "role": "assistant"},
+                {"content": f"请评审上面的故事大纲（第 {iteration} 次评审）。", "role": "user"},
+            ]
+        else:
+            evaluator_input = history
+        verdict, evaluation_usage = await evaluate(evaluator_input, run_config=run_config)
+        if cache is not None and iteration > 1:
+            cache.put(key, verdict)
+        return verdict, evaluation_usage, False
+
+    for iteration in range(1, max_iterations + 1):
+        # 1. 生成故事大纲（多个候选时并发生成）
+        started = time.perf_counter()
+        generated = await asyncio.gather(*(generate(candidate) for candidate in range(candidates)))
+        generate_ms = (time.perf_counter() - started) * 1000
+        usage = Usage()
+        for _, generation_usage in generated:
+            usage.add(generation_usage)
+        if verbose:
+            for candidate, (candidate_outline, _) in enumerate(generated, start=1):
+                print(f"第 {iteration} 轮故事大纲已生成{f'（候选 {candidate}）' if candidates > 1 else ''}：")
+                print(candidate_outline)
+
+        # 2. 执行评审逻辑（枚举评分 + 简短建议），第二轮起先查缓存；多个候选并发评审
+        started = time.perf_counter()
+        verdicts = await asyncio.gather(*(judge(candidate_outline, iteration) for candidate_outline, _ in generated))
+        evaluate_ms = (time.perf_counter() - started) * 1000
+        for _, evaluation_usage, _ in verdicts:
+            usage.add(evaluation_usage)
+
+        # 保留评分最好的候选，同分取靠前的
+        chosen = max(range(candidates), key=lambda i: (SCORE_RANK[verdicts[i][0].score], -i))
+        outline, feedback = generated[chosen][0], verdicts[chosen][0]
+
+        iterations.append(IterationStats(
+            iteration=iteration,
+            score=feedback.score,
+            cached=sum(cached for _, _, cached in verdicts),
+            generate_ms=round(generate_ms, 1),
+            evaluate_ms=round(evaluate_ms, 1),
+            input_tokens=usage.input_tokens,
+            output_tokens=usage.output_tokens,
+            candidates=candidates,
+        ))
+        if verbose:
+            if candidates > 1:
+                print(f"各候选评分：{[verdict.score for verdict, _, _ in verdicts]}，保留候选 {chosen + 1}")
+            print(f"评审结果：score={feedback.score}\nfeedback={feedback.feedback}")
+            print(f"[第 {iteration} 轮统计] {iterations[-1]}")
+
+        if best is None or SCORE_RANK[feedback.score] >= SCORE_RANK[best.feedback.score]:
+            best = JudgeResult(outline=outline, feedback=feedback, passed=feedback.score == "pass")
+        if feedback.score == "pass":
             break
+        if verbose and iteration < max_iterations:
+            print("未通过评审，根据反馈重新生成...")
+        if not trim_history:
+            history.append({"content": f"Feedback: {feedback.feedback}", "role": "user"})
+
+    # max_iterations >= 1，循环至少执行一轮，best 一定已经赋值
+    best.iterations = iterations
+    return best
+
 
-        print("未通过评审，根据反馈重新生成...")
-        input_items.append({"content": f"Feedback: {result.feedback}", "role": "user"})
+def _simulated_judge(system_instructions: str | None, input: Any) -> str:
+    """模拟生成器与评审员：每版大纲带一个质量分，根据反馈改进后质量提高；结果由输入决定，相同输入得到相同输出。"""
+    text = input if isinstance(input, str) else json.dumps(input, ensure_ascii=False)
+    qualities = [float(value) for value in re.findall(r"质量 ([0-9.]+)", text)]
+    rng = random.Random(text)
+    if "生成一个非常简短的故事大纲" in (system_instructions or ""):
+        quality = rng.uniform(0.2, 0.6) if not qualities else min(0.99, qualities[-1] + rng.uniform(0.05, 0.3))
+        return f"大纲（质量 {quality:.2f}）：" + "主角踏上旅程，遇到阻碍，最终成长。" * 12
+    quality = qualities[-1] if qualities else 0.0
+    first = "第 1 次评审" in text or ("次评审" not in text and text.count("大纲（质量") == 1)
+    score = "pass" if quality >= 0.8 and not first else "needs_improvement" if quality >= 0.4 else "fail"
+    return json.dumps({"score": score, "feedback": f"当前质量 {quality:.2f}，请加强冲突并补充结局。"}, ensure_ascii=False)
 
-    print(f"\n最终故事大纲：\n{latest_outline}")
+
+async def bench(stories: int = 50, max_iterations: int = 6) -> None:
+    """对 stories 个不同的需求各运行一次评审循环，对比发送完整历史与只发送最新大纲，再重复运行一遍展示缓存；
+    最后对前 20 个需求逐个运行，对比每轮生成 1、3、5 个候选时到通过评审的耗时。"""
+    set_tracing_disabled(disabled=True)
+    backend = SimulatedBackend(latency=0.05, capacity=1000, rps=1_000_000, responder=_simulated_judge, token_interval=0.0005)
+    run_config = RunConfig(model_provider=SimulatedProvider(backend))
+    requests = [f"一个关于第 {i} 号殖民星球的科幻故事" for i in range(stories)]
+    cache = VerdictCache()
+
+    for label, trim_history, use_cache in (
+        ("完整历史（原来的循环）", False, False),
+        ("只发送最新大纲 + 评审缓存", True, True),
+        ("重复运行相同需求", True, True),
+    ):
+        results = await asyncio.gather(*(
+            judge_loop(request, max_iterations, trim_history, cache if use_cache else None, run_config) for request in requests
+        ))
+        per_iteration: dict[int, list[int]] = {}
+        for result in results:
+            for stats in result.iterations:
+                per_iteration.setdefault(stats.iteration, []).append(stats.input_tokens)
+        average = lambda values: sum(values) / len(values)
+        print(
+            f"[{label}] 通过 {sum(r.passed for r in results)}/{stories}，平均 {average([len(r.iterations) for r in results]):.1f} 轮，"
+            f"每个需求平均输入 {average([r.summary()['input_tokens'] for r in results]):.0f} / 输出 "
+            f"{average([r.summary()['output_tokens'] for r in results]):.0f} token，"
+            f"评审缓存命中 {sum(r.summary()['cached_evaluations'] for r in results)} 次"
+        )
+        print("  每轮平均输入 token：" + "，".join(
+            f"第 {i} 轮 {average(values):.0f}" for i, values in sorted(per_iteration.items())
+        ))
+
+    # 每轮并发生成多个候选：用更多 token 换更少的串行轮数。需求逐个运行，耗时不受其他需求影响
+    for candidates in (1, 3, 5):
+        results = [
+            await judge_loop(request, max_iterations, cache=None, run_config=run_config, candidates=candidates)
+            for request in requests[:20]
+        ]
+        walls = sorted(r.summary()["elapsed_ms"] for r in results if r.passed)
+        rounds = [len(r.iterations) for r in results if r.passed]
+        tokens = [r.summary()["input_tokens"] + r.summary()["output_tokens"] for r in results]
+        label = "串行，每轮 1 个大纲" if candidates == 1 else f"每轮并发 {candidates} 个候选"
+        passed = (
+            f"通过时平均 {sum(rounds) / len(rounds):.1f} 轮，"
+            f"到通过的耗时平均 {sum(walls) / len(walls):.0f} ms / p95 {walls[int(len(walls) * 0.95)]:.0f} ms，"
+            if walls
+            else "没有需求通过评审，"
+        )
+        print(f"[{label}] 通过 {len(walls)}/{len(results)}，{passed}每个需求平均 {sum(tokens) / len(tokens):.0f} token")
+
+
+# 主函数
+async def main(max_iterations: int, candidates: int) -> None:
+    if not API_KEY:
+        raise ValueError("请设置 _API_KEY 环境变量")
+
+    msg = input("你想听一个什么样的故事？")
+    result = await judge_loop(msg, max_iterations=max_iterations, verbose=True, candidates=candidates)
+
+    if result.passed:
+        print("大纲已通过评审，流程结束。")
+    else:
+        print(f"{max_iterations} 轮内没有通过评审，使用评分最好的一版（{result.feedback.score}）。")
+    print(f"\n最终故事大纲：\n{result.outline}")
+    print(f"统计：{result.summary()}")
+    print(f"评审输出 token：{evaluation_classifier.stats()}")
 
 
 if __name__ == "__main__":
+    import argparse
+
     # Windows环境下设置事件循环策略
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    asyncio.run(main())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-iterations", type=int, default=5, help="最多生成与评审几轮。")
+    parser.add_argument("--candidates", type=int, default=1, help="每轮并发生成并评审几个大纲，保留评分最好的一个。")
+    parser.add_argument("--bench", action="store_true", help="在模拟模型上对比发送完整历史与只发送最新大纲。")
+    args = parser.parse_args()
+    if args.max_iterations < 1:
+        parser.error("--max-iterations 至少为 1")
+    if args.candidates < 1:
+        parser.error("--candidates 至少为 1")
+    asyncio.run(bench() if args.bench else main(args.max_iterations, args.candidates))
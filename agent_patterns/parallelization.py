@@ -3,7 +3,9 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
-from agents import Agent, ItemHelpers, Runner, set_default_openai_client, set_default_openai_api, set_tracing_disabled
+from agents import Agent, ItemHelpers, RunConfig, Runner, set_default_openai_client, set_default_openai_api, set_tracing_disabled
+
+from request_scheduler import RequestScheduler, ScheduledProvider
 
 # 加载 .env 文件中的环境变量
 env_path = Path(__file__).resolve().parent.parent / ".env"
@@ -21,6 +23,10 @@ set_default_openai_client(client=client, use_for_tracing=False)
 set_default_openai_api("chat_completions")
 set_tracing_disabled(disabled=True)
 
+# 所有模型调用共用的调度器：限制并发请求数和每分钟请求数，多个用户同时使用时也不会触发 429
+scheduler = RequestScheduler(max_in_flight=4, rpm=60)
+run_config = RunConfig(model_provider=ScheduledProvider(scheduler))
+
 # 翻译代理（中文指令）
 spanish_agent = Agent(
     name="西语翻译代理",
@@ -47,9 +53,9 @@ async def main():
 
     # 并行执行三次翻译
     res_1, res_2, res_3 = await asyncio.gather(
-        Runner.run(spanish_agent, msg),
-        Runner.run(spanish_agent, msg),
-        Runner.run(spanish_agent, msg),
+        Runner.run(spanish_agent, msg, run_config=run_config),
+        Runner.run(spanish_agent, msg, run_config=run_config),
+        Runner.run(spanish_agent, msg, run_config=run_config),
     )
 
     outputs = [
@@ -67,10 +73,12 @@ async def main():
     best_translation_result = await Runner.run(
         translation_picker,
         f"用户原始输入：{msg}\n\n三条翻译如下：\n{translations}",
+        run_config=run_config,
     )
 
     print("\n-----")
     print("最佳翻译：", best_translation_result.final_output)
+    print("调度统计：", scheduler.stats()["wait"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from agents import Agent, RunConfig, Runner, set_tracing_disabled
+
+from request_scheduler import (
+    FairQueue,
+    RequestScheduler,
+    ScheduledProvider,
+    SimulatedBackend,
+    SimulatedProvider,
+    Ticket,
+    WaitStats,
+)
+
+"""
+按优先级排队的请求调度器。
+
+routing.py、input_guardrails.py 这类交互式对话循环与离线批量任务共用同一个后端配额。
+批量任务一次排进几百个请求时，用户的每一轮对话都要排在它们后面。
+
+PriorityScheduler 在 RequestScheduler 的基础上把请求分成若干优先级（默认 interactive、batch）：
+- 有名额时先放行高优先级的请求，排队中的批量请求会被后来的交互请求插队（已经发出的请求不受影响）；
+- interactive_reserve 个名额只留给最高优先级，交互请求不必等正在进行的批量请求结束；
+- 防饥饿：低优先级中最早的请求等待超过 starvation_timeout 秒后，下一个名额优先给它；
+- 每个优先级统计排队时间与端到端时间（排队 + 调用模型），并按 slo 给出达标比例。
+
+请求的优先级由 scheduler.priority(name) 决定，未指定时使用 default_class；与 session() 一样通过 contextvars 传递，
+Runner.run 内部（包括输入护栏里再调用的 Runner.run）产生的模型调用都会继承。
+
+shared_scheduler 是进程内共用的实例，同一进程中的对话循环与批量任务都应使用它。
+
+使用方式：
+    run_config = RunConfig(model_provider=ScheduledProvider(shared_scheduler))
+    with shared_scheduler.priority("interactive"), shared_scheduler.session(session_id):
+        result = await Runner.run(agent, msg, run_config=run_config)
+
+python agent_patterns/priority_scheduler.py --bench   # 批量任务占满配额时，对比先来先服务与按优先级调度下交互请求的延迟
+"""
+
+_current_priority: contextvars.ContextVar[str | None] = contextvars.ContextVar("scheduler_priority", default=None)
+
+
+class PriorityScheduler(RequestScheduler):
+    def __init__(
+        self,
+        classes: tuple[str, ...] = ("interactive", "batch"),
+        default_class: str = "batch",
+        slo: dict[str, float] | None = None,
+        starvation_timeout: float = 10.0,
+        interactive_reserve: int = 1,
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+        if default_class not in classes:
+            raise ValueError(f"未知的优先级：{default_class}")
+        self.classes = classes
+        self.default_class = default_class
+        # 端到端时间的目标（秒）
+        self.slo = slo if slo is not None else {"interactive": 3.0, "batch": 60.0}
+        self.starvation_timeout = starvation_timeout
+        self.interactive_reserve = interactive_reserve
+        self.promoted = 0
+        self._class_queues = {name: FairQueue() for name in classes}
+        self.class_waits = {name: WaitStats() for name in classes}
+        self.class_latencies = {name: WaitStats("latency") for name in classes}
+        self._within_slo = {name: 0 for name in classes}
+
+    @contextmanager
+    def priority(self, name: str) -> Iterator[None]:
+        if name not in self._class_queues:
+            raise ValueError(f"未知的优先级：{name}")
+        token = _current_priority.set(name)
+        try:
+            yield
+        finally:
+            _current_priority.reset(token)
+
+    def _enqueue(self, ticket: Ticket) -> None:
+        ticket.priority = _current_priority.get() or self.default_class
+        ticket.queue_key = ticket.session_id if self.fair else ""
+        self._class_queues[ticket.priority].push(ticket)
+
+    def _next(self) -> tuple[FairQueue, Ticket] | None:
+        top = self.classes[0]
+        now = time.monotonic()
+        # 防饥饿：等待太久的低优先级请求先于新来的高优先级请求；放行的是该优先级中最早排队的请求，
+        # 而不是轮到的会话的第一个请求
+        for name in self.classes[1:]:
+            queue = self._class_queues[name]
+            oldest = queue.oldest()
+            if oldest is not None and now - oldest.enqueued >= self.starvation_timeout:
+                if self.in_flight < self.max_in_flight - self.interactive_reserve:
+                    # 令牌桶不足时这个请求会延后再次被选中，只在第一次选中时计数
+                    if not oldest.promoted:
+                        oldest.promoted = True
+                        self.promoted += 1
+                    return queue, oldest
+        for name in self.classes:
+            queue = self._class_queues[name]
+            if not queue:
+                continue
+            if name != top and self.in_flight >= self.max_in_flight - self.interactive_reserve:
+                # 剩下的名额留给最高优先级
+                return None
+            return queue, queue.peek()
+        return None
+
+    def _remove(self, ticket: Ticket) -> None:
+        self._class_queues[ticket.priority].remove(ticket)
+
+    def _queued(self) -> int:
+        return sum(len(queue) for queue in self._class_queues.values())
+
+    async def acquire(self, tokens: int) -> Ticket:
+        ticket = await super().acquire(tokens)
+        self.class_waits[ticket.priority].add(ticket.granted - ticket.enqueued)
+        return ticket
+
+    def release(self, ticket: Ticket, actual_tokens: int | None) -> None:
+        latency = time.monotonic() - ticket.enqueued
+        self.class_latencies[ticket.priority].add(latency)
+        if latency <= self.slo.get(ticket.priority, float("inf")):
+            self._within_slo[ticket.priority] += 1
+        super().release(ticket, actual_tokens)
+
+    def slo_report(self) -> dict[str, dict[str, Any]]:
+        report = {}
+        for name in self.classes:
+            latencies = self.class_latencies[name]
+            report[name] = {
+                **self.class_waits[name].summary(),
+                **{key: value for key, value in latencies.summary().items() if key != "requests"},
+                "queued": len(self._class_queues[name]),
+                "slo_ms": round(self.slo[name] * 1000) if name in self.slo else None,
+                "slo_attainment": round(self._within_slo[name] / latencies.count, 4) if latencies.count else None,
+            }
+        return report
+
+    def stats(self) -> dict[str, Any]:
+        return {**super().stats(), "promoted": self.promoted, "classes": self.slo_report()}
+
+
+shared_scheduler = PriorityScheduler(max_in_flight=8)
+
+
+async def bench(batch_requests: int = 400, interactive_turns: int = 40) -> None:
+    """批量任务一开始就排进 batch_requests 个请求；同时 4 个用户每隔约 100ms 发起一轮对话。"""
+    set_tracing_disabled(disabled=True)
+    agent = Agent(name="助手", instructions="你是一个有帮助的助手。")
+
+    for label, classes in (("先来先服务", ("batch",)), ("按优先级调度", ("interactive", "batch"))):
+        backend = SimulatedBackend(latency=0.05, capacity=8, rps=1000)
+        scheduler = PriorityScheduler(
+            classes=classes,
+            slo={"interactive": 0.3, "batch": 5.0},
+            starvation_timeout=1.0,
+            interactive_reserve=1 if len(classes) > 1 else 0,
+            max_in_flight=8,
+            fair=False,
+        )
+        run_config = RunConfig(model_provider=ScheduledProvider(scheduler, SimulatedProvider(backend)))
+        turn_latencies: list[float] = []
+
+        async def batch_job() -> None:
+            with scheduler.priority("batch"), scheduler.session("batch-job"):
+                await asyncio.gather(*(Runner.run(agent, f"批量 {i}", run_config=run_config) for i in range(batch_requests)))
+
+        async def chat_user(user: int) -> None:
+            priority = "interactive" if "interactive" in classes else "batch"
+            with scheduler.priority(priority), scheduler.session(f"user-{user}"):
+                for turn in range(interactive_turns // 4):
+                    await asyncio.sleep(random.uniform(0.05, 0.15))
+                    turn_started = time.perf_counter()
+                    await Runner.run(agent, f"第 {turn} 轮", run_config=run_config)
+                    turn_latencies.append(time.perf_counter() - turn_started)
+
+        started = time.perf_counter()
+        await asyncio.gather(batch_job(), *(chat_user(i) for i in range(4)))
+        turn_latencies.sort()
+        print(
+            f"[{label}] 总耗时 {time.perf_counter() - started:.2f} s，对话每轮 p50 "
+            f"{turn_latencies[len(turn_latencies) // 2] * 1000:.0f} ms / p95 {turn_latencies[int(len(turn_latencies) * 0.95)] * 1000:.0f} ms，"
+            f"防饥饿提升 {scheduler.promoted} 次"
+        )
+        for name, report in scheduler.slo_report().items():
+            print(
+                f"  {name}: {report['requests']} 次，排队 p50 {report['p50_wait_ms']} ms / p95 {report['p95_wait_ms']} ms，"
+                f"端到端 p95 {report['p95_latency_ms']} ms，SLO {report['slo_ms']} ms 达标率 {report['slo_attainment']}"
+            )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="对比先来先服务与按优先级调度。")
+    args = parser.parse_args()
+    if args.bench:
+        asyncio.run(bench())
+    else:
+        parser.print_help()
@@ -0,0 +1,550 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import json
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Iterator
+
+from agents import (
+    Agent,
+    Model,
+    ModelProvider,
+    ModelResponse,
+    OpenAIProvider,
+    RunConfig,
+    Runner,
+    Usage,
+    set_tracing_disabled,
+)
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseCreatedEvent,
+    ResponseOutputMessage,
+    ResponseOutputText,
+    ResponseTextDeltaEvent,
+)
+from openai.types.responses.response_usage import InputTokensDetails, OutputTokensDetails, ResponseUsage
+
+"""
+所有模型调用共用的请求调度器。
+
+parallelization.py 用 asyncio.gather 同时发起多次 Runner.run，没有任何上限；线上很多用户同时这样做，
+请求会一起打到服务商，触发 429。
+
+RequestScheduler 在每次模型调用之前排队，满足以下条件才放行：
+- 正在进行的请求数不超过 max_in_flight；
+- 每分钟请求数（rpm）与每分钟 token 数（tpm）两个令牌桶都有余量。
+  调用前按输入长度和 max_tokens 估算 token 数并预扣，调用结束后按 usage 中的实际用量多退少补；
+- 不同会话之间轮流放行（round robin）：一个会话一次提交很多请求，也不会让其他会话一直排在后面。
+
+ScheduledProvider 包装另一个 ModelProvider（默认是使用 set_default_openai_client 客户端的 OpenAIProvider），
+通过 RunConfig(model_provider=...) 让 Runner 的所有模型调用都经过调度器。请求属于哪个会话由
+scheduler.session(session_id) 决定，它通过 contextvars 传递，asyncio.gather 创建的任务也会继承。
+
+stats() 返回排队等待时间（整体与按会话）、当前排队数与正在进行的请求数。
+按会话的统计只保留最近活跃的 max_tracked_sessions 个会话，更早的会话被淘汰，只计入整体统计。
+
+使用方式：
+    scheduler = RequestScheduler(max_in_flight=8, rpm=500, tpm=200_000)
+    run_config = RunConfig(model_provider=ScheduledProvider(scheduler))
+    with scheduler.session("user-42"):
+        results = await asyncio.gather(*(Runner.run(agent, msg, run_config=run_config) for _ in range(3)))
+
+python agent_patterns/request_scheduler.py --bench   # 在模拟的限流后端上对比不加限制、先来先服务与公平调度
+"""
+
+_current_session: contextvars.ContextVar[str] = contextvars.ContextVar("scheduler_session", default="default")
+
+
+def current_session() -> str:
+    """当前上下文所属的会话，由 scheduler.session(session_id) 设置。"""
+    return _current_session.get()
+
+
+class TokenBucket:
+    """每分钟补充 per_minute 个令牌、最多存 per_minute 个的令牌桶；余额可以被补扣成负数。"""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """还需要等待多少秒才有 amount 个令牌；超过桶容量的请求只要求桶是满的。"""
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def adjust(self, amount: float) -> None:
+        """退还（正数）或补扣（负数）令牌。"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+@dataclass
+class Ticket:
+    """一次排队中（或已放行）的模型调用；acquire 返回它，release 时交回。"""
+
+    tokens: int
+    session_id: str
+    future: asyncio.Future
+    enqueued: float
+    queue_key: str = ""
+    priority: str = ""
+    granted: float = 0.0
+    # 因为等待太久被提前放行（见 priority_scheduler.py），每个请求只计一次
+    promoted: bool = False
+
+
+class WaitStats:
+    def __init__(self, name: str = "wait"):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: deque[float] = deque(maxlen=1024)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def summary(self) -> dict[str, Any]:
+        ordered = sorted(self.recent)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 1) if ordered else 0.0
+        return {
+            "requests": self.count,
+            f"avg_{self.name}_ms": round(self.total / self.count * 1000, 1) if self.count else 0.0,
+            f"p50_{self.name}_ms": pick(0.5),
+            f"p95_{self.name}_ms": pick(0.95),
+            f"max_{self.name}_ms": round(self.max * 1000, 1),
+        }
+
+
+class FairQueue:
+    """按 queue_key 分组的排队请求，各组之间轮流出队（round robin）。"""
+
+    def __init__(self):
+        # 轮到的组排在 OrderedDict 最前面；出队一个请求后把它移到末尾
+        self._groups: OrderedDict[str, deque[Ticket]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return sum(len(group) for group in self._groups.values())
+
+    def __bool__(self) -> bool:
+        return bool(self._groups)
+
+    def push(self, ticket: Ticket) -> None:
+        self._groups.setdefault(ticket.queue_key, deque()).append(ticket)
+
+    def peek(self) -> Ticket | None:
+        for group in self._groups.values():
+            return group[0]
+        return None
+
+    def pop(self, ticket: Ticket | None = None) -> Ticket:
+        """出队 ticket（必须是某一组的第一个，例如 peek() 或 oldest() 的返回值）；省略时出队轮到的组的第一个。"""
+        key = ticket.queue_key if ticket is not None else next(iter(self._groups))
+        group = self._groups[key]
+        popped = group.popleft()
+        if ticket is not None and popped is not ticket:
+            group.appendleft(popped)
+            raise ValueError("只能出队某一组的第一个请求")
+        if group:
+            self._groups.move_to_end(key)
+        else:
+            del self._groups[key]
+        return popped
+
+    def remove(self, ticket: Ticket) -> None:
+        group = self._groups.get(ticket.queue_key)
+        if group is not None and ticket in group:
+            group.remove(ticket)
+            if not group:
+                del self._groups[ticket.queue_key]
+
+    def oldest(self) -> Ticket | None:
+        heads = [group[0] for group in self._groups.values()]
+        return min(heads, key=lambda ticket: ticket.enqueued) if heads else None
+
+
+class RequestScheduler:
+    def __init__(
+        self,
+        max_in_flight: int = 8,
+        rpm: float | None = None,
+        tpm: float | None = None,
+        fair: bool = True,
+        default_output_tokens: int = 512,
+        chars_per_token: float = 2.0,
+        max_tracked_sessions: int = 256,
+    ):
+        self.max_in_flight = max_in_flight
+        self.requests_bucket = TokenBucket(rpm) if rpm else None
+        self.tokens_bucket = TokenBucket(tpm) if tpm else None
+        self.fair = fair
+        self.default_output_tokens = default_output_tokens
+        self.chars_per_token = chars_per_token
+        self.in_flight = 0
+        # fair=False 时所有请求都放在同一组里，即先来先服务
+        self._queue = FairQueue()
+        self._timer: asyncio.TimerHandle | None = None
+        self.waits = WaitStats()
+        # 按会话的等待时间只保留最近活跃的 max_tracked_sessions 个会话（LRU），在线用户再多内存也有上限
+        self.max_tracked_sessions = max_tracked_sessions
+        self.session_waits: OrderedDict[str, WaitStats] = OrderedDict()
+        self.evicted_sessions = 0
+
+    @contextmanager
+    def session(self, session_id: str) -> Iterator[None]:
+        token = _current_session.set(session_id)
+        try:
+            yield
+        finally:
+            _current_session.reset(token)
+
+    def estimate_tokens(self, system_instructions: str | None, input: Any, model_settings: Any) -> int:
+        text = input if isinstance(input, str) else json.dumps(input, ensure_ascii=False, default=str)
+        chars = len(system_instructions or "") + len(text)
+        max_tokens = getattr(model_settings, "max_tokens", None) or self.default_output_tokens
+        return int(chars / self.chars_per_token) + max_tokens
+
+    # 以下三个方法决定排队的方式，子类可以替换（例如按优先级分成多个队列）
+    def _enqueue(self, ticket: Ticket) -> None:
+        ticket.queue_key = ticket.session_id if self.fair else ""
+        self._queue.push(ticket)
+
+    def _next(self) -> tuple[FairQueue, Ticket] | None:
+        """返回下一个应该放行的请求及其所在的队列；返回 None 表示现在不放行任何请求。"""
+        return (self._queue, self._queue.peek()) if self._queue else None
+
+    def _remove(self, ticket: Ticket) -> None:
+        self._queue.remove(ticket)
+
+    def _queued(self) -> int:
+        return len(self._queue)
+
+    def _new_ticket(self, tokens: int) -> Ticket:
+        return Ticket(tokens, current_session(), asyncio.get_running_loop().create_future(), time.monotonic())
+
+    async def acquire(self, tokens: int) -> Ticket:
+        ticket = self._new_ticket(tokens)
+        self._enqueue(ticket)
+        self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # 已经放行但调用方被取消：归还名额
+                self.release(ticket, ticket.tokens)
+            else:
+                self._remove(ticket)
+            raise
+        wait = ticket.granted - ticket.enqueued
+        self.waits.add(wait)
+        self._session_stats(ticket.session_id).add(wait)
+        return ticket
+
+    def _session_stats(self, session_id: str) -> WaitStats:
+        stats = self.session_waits.get(session_id)
+        if stats is not None:
+            self.session_waits.move_to_end(session_id)
+            return stats
+        stats = self.session_waits[session_id] = WaitStats()
+        if len(self.session_waits) > self.max_tracked_sessions:
+            self.session_waits.popitem(last=False)
+            self.evicted_sessions += 1
+        return stats
+
+    def release(self, ticket: Ticket, actual_tokens: int | None) -> None:
+        self.in_flight -= 1
+        if self.tokens_bucket is not None and actual_tokens is not None:
+            self.tokens_bucket.adjust(ticket.tokens - actual_tokens)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self.in_flight < self.max_in_flight:
+            selected = self._next()
+            if selected is None:
+                return
+            queue, ticket = selected
+            delay = 0.0
+            if self.requests_bucket is not None:
+                delay = self.requests_bucket.wait_time(1)
+            if self.tokens_bucket is not None:
+                delay = max(delay, self.tokens_bucket.wait_time(ticket.tokens))
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            queue.pop(ticket)
+            if ticket.future.cancelled():
+                continue
+            if self.requests_bucket is not None:
+                self.requests_bucket.take(1)
+            if self.tokens_bucket is not None:
+                self.tokens_bucket.take(ticket.tokens)
+            self.in_flight += 1
+            ticket.granted = time.monotonic()
+            ticket.future.set_result(None)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self._queued(),
+            "wait": self.waits.summary(),
+            "sessions": {session_id: waits.summary() for session_id, waits in self.session_waits.items()},
+            "evicted_sessions": self.evicted_sessions,
+        }
+
+
+def _request_arguments(args: tuple, kwargs: dict) -> tuple[Any, Any, Any]:
+    """从 Model.get_response / stream_response 的参数中取出 system_instructions、input、model_settings。"""
+    names = ("system_instructions", "input", "model_settings")
+    values = list(args[:3]) + [None] * (3 - min(len(args), 3))
+    for i, name in enumerate(names):
+        if name in kwargs:
+            values[i] = kwargs[name]
+    return values[0], values[1], values[2]
+
+
+class ScheduledModel(Model):
+    def __init__(self, inner: Model, scheduler: RequestScheduler):
+        self.inner = inner
+        self.scheduler = scheduler
+
+    async def get_response(self, *args: Any, **kwargs: Any) -> ModelResponse:
+        ticket = await self.scheduler.acquire(self.scheduler.estimate_tokens(*_request_arguments(args, kwargs)))
+        actual = None
+        try:
+            response = await self.inner.get_response(*args, **kwargs)
+            actual = response.usage.total_tokens or None
+            return response
+        finally:
+            self.scheduler.release(ticket, actual)
+
+    async def stream_response(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        ticket = await self.scheduler.acquire(self.scheduler.estimate_tokens(*_request_arguments(args, kwargs)))
+        actual = None
+        try:
+            async for event in self.inner.stream_response(*args, **kwargs):
+                if event.type == "response.completed" and event.response.usage is not None:
+                    actual = event.response.usage.total_tokens or None
+                yield event
+        finally:
+            self.scheduler.release(ticket, actual)
+
+
+class ScheduledProvider(ModelProvider):
+    def __init__(self, scheduler: RequestScheduler, inner: ModelProvider | None = None):
+        self.scheduler = scheduler
+        # 默认使用 set_default_openai_client / set_default_openai_api 设置的客户端与接口
+        self.inner = inner or OpenAIProvider()
+
+    def get_model(self, model_name: str | None) -> Model:
+        return ScheduledModel(self.inner.get_model(model_name), self.scheduler)
+
+
+class SimulatedRateLimit(Exception):
+    """模拟后端返回的 429。"""
+
+
+def _echo_responder(system_instructions: str | None, input: Any) -> str:
+    return "hola"
+
+
+class SimulatedBackend(Model):
+    """用于 --bench 的模拟后端：同时处理的请求超过 capacity 或每秒请求超过 rps 时返回 429。
+
+    responder(system_instructions, input) 决定回复的文本；calls 统计真正处理（未被限流）的请求数。
+    每生成一个字符需要 token_interval 秒（流式请求逐个字符返回）。
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        capacity: int = 8,
+        rps: float = 100.0,
+        responder: Callable[[str | None, Any], str] = _echo_responder,
+        token_interval: float = 0.0,
+    ):
+        self.latency = latency
+        self.capacity = capacity
+        self.rps = rps
+        self.responder = responder
+        self.token_interval = token_interval
+        self.in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+        self._recent: deque[float] = deque()
+
+    def _rate_limited(self) -> bool:
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 1.0:
+            self._recent.popleft()
+        self._recent.append(now)
+        return len(self._recent) > self.rps or self.in_flight >= self.capacity
+
+    async def _call(self, args: tuple, kwargs: dict) -> ResponseOutputMessage:
+        if self._rate_limited():
+            self.throttled += 1
+            raise SimulatedRateLimit("429 Too Many Requests")
+        self.calls += 1
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.latency * random.uniform(0.8, 1.2))
+        finally:
+            self.in_flight -= 1
+        system_instructions, input, _ = _request_arguments(args, kwargs)
+        return ResponseOutputMessage(
+            id="msg",
+            type="message",
+            role="assistant",
+            status="completed",
+            content=[ResponseOutputText(type="output_text", text=self.responder(system_instructions, input), annotations=[])],
+        )
+
+    @staticmethod
+    def _token_counts(args: tuple, kwargs: dict, message: ResponseOutputMessage) -> tuple[int, int]:
+        # 与 RequestScheduler 的估算一致，按约 2 个字符 1 个 token 计算用量
+        system_instructions, input, _ = _request_arguments(args, kwargs)
+        input_tokens = len(system_instructions or "") // 2 + len(input if isinstance(input, str) else json.dumps(input, ensure_ascii=False)) // 2
+        return input_tokens, max(1, len(message.content[0].text) // 2)
+
+    async def get_response(self, *args: Any, **kwargs: Any) -> ModelResponse:
+        message = await self._call(args, kwargs)
+        if self.token_interval:
+            await asyncio.sleep(self.token_interval * len(message.content[0].text))
+        input_tokens, output_tokens = self._token_counts(args, kwargs, message)
+        usage = Usage(requests=1, input_tokens=input_tokens, output_tokens=output_tokens, total_tokens=input_tokens + output_tokens)
+        return ModelResponse(output=[message], usage=usage, response_id=None)
+
+    async def stream_response(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        message = await self._call(args, kwargs)
+        response = Response(
+            id="resp",
+            created_at=time.time(),
+            model="simulated",
+            object="response",
+            output=[],
+            tool_choice="auto",
+            parallel_tool_calls=False,
+            tools=[],
+        )
+        yield ResponseCreatedEvent(type="response.created", response=response, sequence_number=0)
+        text = message.content[0].text
+        for i, char in enumerate(text):
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval)
+            yield ResponseTextDeltaEvent(
+                type="response.output_text.delta",
+                item_id=message.id,
+                output_index=0,
+                content_index=0,
+                delta=char,
+                logprobs=[],
+                sequence_number=i + 1,
+            )
+        input_tokens, output_tokens = self._token_counts(args, kwargs, message)
+        usage = ResponseUsage(
+            input_tokens=input_tokens,
+            input_tokens_details=InputTokensDetails(cached_tokens=0, cache_write_tokens=0),
+            output_tokens=output_tokens,
+            output_tokens_details=OutputTokensDetails(reasoning_tokens=0),
+            total_tokens=input_tokens + output_tokens,
+        )
+        completed = response.model_copy(update={"output": [message], "status": "completed", "usage": usage})
+        yield ResponseCompletedEvent(type="response.completed", response=completed, sequence_number=len(text) + 1)
+
+
+class SimulatedProvider(ModelProvider):
+    def __init__(self, backend: SimulatedBackend):
+        self.backend = backend
+
+    def get_model(self, model_name: str | None) -> Model:
+        return self.backend
+
+
+async def bench(heavy_requests: int = 120, light_sessions: int = 20) -> None:
+    """一个会话一次提交 heavy_requests 个请求，随后 light_sessions 个会话各提交 3 个（与 parallelization.py 相同）。"""
+    set_tracing_disabled(disabled=True)
+    agent = Agent(name="西语翻译代理", instructions="请将用户输入的内容翻译成西班牙语。")
+
+    for label, scheduler in (
+        ("不加限制", None),
+        ("先来先服务", RequestScheduler(max_in_flight=4, rpm=6000, fair=False)),
+        ("公平调度", RequestScheduler(max_in_flight=4, rpm=6000)),
+    ):
+        backend = SimulatedBackend(latency=0.05, capacity=8, rps=100)
+        provider: ModelProvider = SimulatedProvider(backend)
+        if scheduler is not None:
+            provider = ScheduledProvider(scheduler, provider)
+        run_config = RunConfig(model_provider=provider)
+        latencies: dict[str, list[float]] = {"heavy": [], "light": []}
+        failures = 0
+
+        async def run(kind: str) -> None:
+            nonlocal failures
+            started = time.perf_counter()
+            try:
+                await Runner.run(agent, "你好", run_config=run_config)
+            except SimulatedRateLimit:
+                failures += 1
+                return
+            latencies[kind].append(time.perf_counter() - started)
+
+        async def user(session_id: str, kind: str, count: int, delay: float) -> None:
+            await asyncio.sleep(delay)
+            if scheduler is None:
+                await asyncio.gather(*(run(kind) for _ in range(count)))
+                return
+            with scheduler.session(session_id):
+                await asyncio.gather(*(run(kind) for _ in range(count)))
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            user("heavy", "heavy", heavy_requests, 0.0),
+            *(user(f"light-{i}", "light", 3, 0.01) for i in range(light_sessions)),
+        )
+        elapsed = time.perf_counter() - started
+
+        def p50(values: list[float]) -> str:
+            return f"{sorted(values)[len(values) // 2] * 1000:.0f} ms" if values else "-"
+
+        print(
+            f"[{label}] 耗时 {elapsed:.2f} s，429 失败 {failures}，"
+            f"大批量会话 p50 {p50(latencies['heavy'])}，其他会话 p50 {p50(latencies['light'])}"
+        )
+        if scheduler is not None:
+            print(f"  排队等待：{scheduler.stats()['wait']}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="在模拟的限流后端上对比不同的调度方式。")
+    args = parser.parse_args()
+    if args.bench:
+        asyncio.run(bench())
+    else:
+        parser.print_help()
@@ -6,12 +6,17 @@ from dotenv import load_dotenv
 from openai import AsyncOpenAI
 from agents import (
     Agent,
+    RunConfig,
     Runner,
-    TResponseInputItem,
     set_default_openai_client,
     set_default_openai_api,
     set_tracing_disabled,
 )
+from micro_batch_classifier import MicroBatchClassifier
+from priority_scheduler import shared_scheduler
+from request_scheduler import ScheduledProvider
+from session_store import SQLiteSessionStore
+from single_flight import CoalescingProvider
 
 # ========== 加载环境变量 ==========
 env_path = Path(__file__).resolve().parent.parent / ".env"
@@ -29,6 +34,11 @@ set_default_openai_client(client=client, use_for_tracing=False)
 set_default_openai_api("chat_completions")
 set_tracing_disabled(disabled=True)
 
+# 所有模型调用经过进程内共用的优先级调度器，与同一进程中的批量任务共享配额
+run_config = RunConfig(model_provider=ScheduledProvider(shared_scheduler))
+# 只有语言判断使用合并：多个用户同时发出的相同判断请求只调用一次后端；普通对话轮次不合并
+classifier_run_config = RunConfig(model_provider=CoalescingProvider(ScheduledProvider(shared_scheduler)))
+
 # ========== 子代理：支持多语言 ==========
 french_agent = Agent(
     name="french_agent",
@@ -70,58 +80,87 @@ AGENT_MAP = {
     "english_agent": english_agent,
 }
 
+# 多个用户同时发来的消息合并成一次语言判断，判断不出时交给 english_agent。
+# 这里允许不同用户的消息进入同一批：判断结果只决定用哪种语言回答，即使被其他消息中的注入影响也不会放行任何请求
+language_classifier = MicroBatchClassifier(
+    language_detector,
+    labels=tuple(AGENT_MAP),
+    task="你将接收多位用户各自的一句话，判断每句话应该由哪个代理来处理（法语、西班牙语或英语）。",
+    default="english_agent",
+    run_config=classifier_run_config,
+)
+
+# 会话数据库与每次请求读取的最近条目数
+SESSION_DB = Path(__file__).resolve().parent / "sessions.db"
+HISTORY_WINDOW = 40
+
 # ========== 主逻辑 ==========
-async def main():
-    msg = input("你好！我们支持法语、西班牙语和英语。请问有什么可以帮您？\n")
-    
-    # 首轮使用 triage_agent 做初始判断
-    result = await Runner.run(
-        Agent(
-            name="triage_agent",
-            instructions="请根据语言把问题交给适合的代理。",
-            handoffs=[french_agent, spanish_agent, english_agent],
-            model=MODEL_NAME,
-            output_type=str,
-        ),
-        [{"content": msg, "role": "user"}],
-    )
-
-    # 初始化对话上下文和代理
-    agent = result._last_agent
-    inputs: list[TResponseInputItem] = result.to_input_list()
-
-    print("\n🤖 AI 回复：\n")
-    print(result.final_output)
-    print(f"[当前代理: {agent.name}]")
-
-    print("\n-----------------------------------------\n")
-
-    while True:
-        user_msg = input("你：")
-        if not user_msg.strip():
-            continue
-
-        # 👇 用语言判断代理判断这句话该给谁处理
-        lang_result = await Runner.run(language_detector, user_msg)
-        target_name = lang_result.final_output.strip()
-        print(f"[判断目标代理: {target_name}]")
-
-        if target_name != agent.name:
-            print(f"🔄 检测到语言变更，切换到 {target_name}")
-            agent = AGENT_MAP.get(target_name, english_agent)
-            inputs = []  # 清除上下文
-        inputs.append({"role": "user", "content": user_msg})
-
-        result = await Runner.run(agent, inputs)
-        print("\n🤖 AI 回复：\n")
-        print(result.final_output)
-        print(f"[当前代理: {agent.name}]")
-        inputs = result.to_input_list()
-
-        print("\n-----------------------------------------\n")
+async def main(session_id: str):
+    # 对话历史保存在 SQLite 中：每轮只追加新增的条目，进程重启后可以继续同一个会话
+    store = SQLiteSessionStore(SESSION_DB)
+    session = store.session(session_id, window=HISTORY_WINDOW)
+
+    try:
+        # 对话循环属于交互优先级：排队时插在批量任务前面
+        with shared_scheduler.priority("interactive"), shared_scheduler.session(session_id):
+            msg = input("你好！我们支持法语、西班牙语和英语。请问有什么可以帮您？\n")
+
+            # 首轮使用 triage_agent 做初始判断
+            result = await Runner.run(
+                Agent(
+                    name="triage_agent",
+                    instructions="请根据语言把问题交给适合的代理。",
+                    handoffs=[french_agent, spanish_agent, english_agent],
+                    model=MODEL_NAME,
+                    output_type=str,
+                ),
+                msg,
+                session=session,
+                run_config=run_config,
+            )
+
+            # 初始化当前代理
+            agent = result._last_agent
+
+            print("\n🤖 AI 回复：\n")
+            print(result.final_output)
+            print(f"[当前代理: {agent.name}]")
+
+            print("\n-----------------------------------------\n")
+
+            while True:
+                # input() 会阻塞事件循环，定时写入无法执行：等待输入前先把本轮的条目写入数据库
+                await store.flush()
+                user_msg = input("你：")
+                if not user_msg.strip():
+                    continue
+
+                # 👇 用语言判断代理判断这句话该给谁处理
+                target_name = await language_classifier.classify(user_msg)
+                print(f"[判断目标代理: {target_name}]")
+
+                if target_name != agent.name:
+                    print(f"🔄 检测到语言变更，切换到 {target_name}")
+                    agent = AGENT_MAP.get(target_name, english_agent)
+                    await session.clear_session()  # 清除上下文
+
+                result = await Runner.run(agent, user_msg, session=session, run_config=run_config)
+                print("\n🤖 AI 回复：\n")
+                print(result.final_output)
+                print(f"[当前代理: {agent.name}]")
+
+                print("\n-----------------------------------------\n")
+    finally:
+        await store.close()
 
 
 if __name__ == "__main__":
+    import argparse
+
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    asyncio.run(main())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--session", default="routing", help="会话 ID，使用相同的 ID 可以在重启后继续对话。")
+    args = parser.parse_args()
+    asyncio.run(main(args.session))
@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from agents import TResponseInputItem
+
+"""
+基于 SQLite 的会话存储。
+
+input_guardrails.py 和 routing.py 的对话循环把整段对话保存在一个 Python 列表里：进程重启后
+对话就丢了，同时在线的用户一多，内存也会随之增长。
+
+SQLiteSessionStore 把所有会话保存在同一个 SQLite 数据库中：
+- 使用 WAL 模式，写入不阻塞其他进程读取；
+- 新条目先放进内存中的待写缓冲区，攒够 batch_size 条或等待 flush_interval 秒后，一次事务批量写入；
+  进程异常退出时，最多丢失最近 flush_interval 秒内尚未写入的条目。
+  定时写入依赖事件循环继续运行，调用 input() 等阻塞操作之前应先 await store.flush()；
+- store.session(session_id) 返回实现了 SDK Session 协议的轻量对象，可直接传给
+  Runner.run(..., session=...)，每轮只追加本轮新增的条目；
+- window 限制每次请求读取的条目数，只按需加载最近的一段历史；窗口的起点会向前移到最近的一条用户消息，
+  不会从一轮对话的中间开始，工具调用（function_call）与它的输出不会被拆开；
+- 存储本身不缓存任何会话的历史，内存只与待写缓冲区大小有关，与会话数量无关。
+
+使用方式：
+    store = SQLiteSessionStore("sessions.db")
+    result = await Runner.run(agent, "你好", session=store.session("user-42", window=40))
+    ...
+    await store.close()
+
+python agent_patterns/session_store.py --bench            # 模拟数千个会话交替写入，统计吞吐与读取延迟
+python agent_patterns/session_store.py --bench --memory   # 同时统计内存分配峰值
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    message_data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_session_items_session ON session_items (session_id, id);
+"""
+
+
+def _is_user_message(item: TResponseInputItem) -> bool:
+    return isinstance(item, dict) and item.get("role") == "user" and item.get("type", "message") == "message"
+
+
+class StoreSession:
+    """某个 session_id 在 SQLiteSessionStore 中的句柄，实现 SDK 的 Session 协议。"""
+
+    session_settings = None
+
+    def __init__(self, store: SQLiteSessionStore, session_id: str, window: int | None = None):
+        self.store = store
+        self.session_id = session_id
+        self.window = window
+
+    async def get_items(self, limit: int | None = None) -> list[TResponseInputItem]:
+        return await self.store.get_items(self.session_id, limit if limit is not None else self.window)
+
+    async def add_items(self, items: list[TResponseInputItem]) -> None:
+        await self.store.add_items(self.session_id, items)
+
+    async def pop_item(self) -> TResponseInputItem | None:
+        return await self.store.pop_item(self.session_id)
+
+    async def clear_session(self) -> None:
+        await self.store.clear_session(self.session_id)
+
+
+class _PendingItems:
+    """某个会话尚未写入数据库的条目；前 in_flight 条已经提交给写线程，正在写入。"""
+
+    __slots__ = ("items", "in_flight")
+
+    def __init__(self):
+        self.items: list[TResponseInputItem] = []
+        self.in_flight = 0
+
+
+class SQLiteSessionStore:
+    def __init__(
+        self,
+        path: str | Path = "sessions.db",
+        batch_size: int = 64,
+        flush_interval: float = 0.05,
+    ):
+        self.path = str(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flushes = 0
+        self.rows_written = 0
+
+        # 所有数据库操作都交给同一个工作线程按提交顺序执行：
+        # 在某次批量写入之后提交的读取，一定能看到这次写入的结果
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 模式下 NORMAL 只在检查点时 fsync，已提交的事务在进程崩溃时不会丢失
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+        self._pending: dict[str, _PendingItems] = {}
+        # 还没有提交给写线程的条目数
+        self._unsubmitted = 0
+        self._flush_task: asyncio.Task | None = None
+        # 同一轮事件循环中发起的读取合并为一次工作线程调用
+        self._read_batch: list[tuple[str, int | None, asyncio.Future]] | None = None
+
+    def session(self, session_id: str, window: int | None = None) -> StoreSession:
+        return StoreSession(self, session_id, window)
+
+    async def _run(self, func: Any, *args: Any) -> Any:
+        # 先提交已经排队的读取，保持"先发起的操作先执行"
+        self._submit_reads()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def add_items(self, session_id: str, items: list[TResponseInputItem]) -> None:
+        if not items:
+            return
+        pending = self._pending.get(session_id)
+        if pending is None:
+            pending = self._pending[session_id] = _PendingItems()
+        pending.items.extend(items)
+        self._unsubmitted += len(items)
+        if self._unsubmitted >= self.batch_size:
+            # 缓冲区满时由写入方等待本次写入完成，形成背压
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        await self.flush()
+
+    def _write_rows(self, rows: list[tuple[str, TResponseInputItem]]) -> None:
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "INSERT INTO session_items (session_id, message_data) VALUES (?, ?)",
+                [(session_id, json.dumps(item, ensure_ascii=False)) for session_id, item in rows],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    async def flush(self) -> None:
+        """把尚未提交的条目在一个事务中写入数据库，并等待之前提交的写入全部完成。"""
+        if not self._unsubmitted:
+            await self._run(lambda: None)
+            return
+        rows: list[tuple[str, TResponseInputItem]] = []
+        batch: list[tuple[str, _PendingItems, int]] = []
+        for session_id, pending in self._pending.items():
+            fresh = pending.items[pending.in_flight :]
+            if fresh:
+                rows.extend((session_id, item) for item in fresh)
+                batch.append((session_id, pending, len(fresh)))
+                pending.in_flight += len(fresh)
+        self._unsubmitted = 0
+
+        await self._run(self._write_rows, rows)
+
+        # 写线程按顺序执行，先提交的批次先完成，已写入的总是列表最前面的条目
+        for session_id, pending, count in batch:
+            del pending.items[:count]
+            pending.in_flight -= count
+            if not pending.items and self._pending.get(session_id) is pending:
+                del self._pending[session_id]
+        self.flushes += 1
+        self.rows_written += len(rows)
+
+    def _read_rows(self, session_id: str, limit: int | None) -> list[TResponseInputItem]:
+        if limit is None:
+            cursor = self._conn.execute(
+                "SELECT message_data FROM session_items WHERE session_id = ? ORDER BY id",
+                (session_id,),
+            )
+            return [json.loads(row[0]) for row in cursor.fetchall()]
+        # 从最新的条目往前读，读够 limit 条后继续读到一条用户消息为止
+        cursor = self._conn.execute(
+            "SELECT message_data FROM session_items WHERE session_id = ? ORDER BY id DESC",
+            (session_id,),
+        )
+        rows: list[TResponseInputItem] = []
+        for (data,) in cursor:
+            item = json.loads(data)
+            rows.append(item)
+            if len(rows) >= limit and _is_user_message(item):
+                break
+        rows.reverse()
+        return rows
+
+    def _read_many(self, requests: list[tuple[str, int | None]]) -> list[list[TResponseInputItem]]:
+        return [self._read_rows(session_id, limit) for session_id, limit in requests]
+
+    def _submit_reads(self) -> None:
+        batch, self._read_batch = self._read_batch, None
+        if not batch:
+            return
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, self._read_many, [(session_id, limit) for session_id, limit, _ in batch]
+        )
+
+        def _deliver(done: asyncio.Future) -> None:
+            error = done.exception()
+            results = [None] * len(batch) if error is not None else done.result()
+            for (_, _, waiter), rows in zip(batch, results):
+                if waiter.done():
+                    continue
+                if error is not None:
+                    waiter.set_exception(error)
+                else:
+                    waiter.set_result(rows)
+
+        future.add_done_callback(_deliver)
+
+    async def get_items(self, session_id: str, limit: int | None = None) -> list[TResponseInputItem]:
+        """按时间顺序返回会话历史；指定 limit 时读取最近的 limit 条，并向前补到一轮对话的开头。"""
+        if limit == 0:
+            return []
+        pending = self._pending.get(session_id)
+        # 已提交给写线程的条目会在这次读取之前写入，只需要补上还没提交的部分
+        fresh = pending.items[pending.in_flight :] if pending is not None else []
+        if limit is not None and len(fresh) >= limit:
+            start = len(fresh) - limit
+            while start >= 0 and not _is_user_message(fresh[start]):
+                start -= 1
+            if start >= 0:
+                return fresh[start:]
+            # 待写条目中没有用户消息，继续从数据库中往前读
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        if self._read_batch is None:
+            self._read_batch = []
+            loop.call_soon(self._submit_reads)
+        self._read_batch.append((session_id, None if limit is None else max(limit - len(fresh), 0), waiter))
+        stored = await waiter
+        return stored + fresh
+
+    def _pop_row(self, session_id: str) -> TResponseInputItem | None:
+        row = self._conn.execute(
+            "SELECT id, message_data FROM session_items WHERE session_id = ? ORDER BY id DESC LIMIT 1",
+            (session_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("DELETE FROM session_items WHERE id = ?", (row[0],))
+        return json.loads(row[1])
+
+    async def pop_item(self, session_id: str) -> TResponseInputItem | None:
+        pending = self._pending.get(session_id)
+        if pending is not None and len(pending.items) > pending.in_flight:
+            self._unsubmitted -= 1
+            item = pending.items.pop()
+            if not pending.items:
+                del self._pending[session_id]
+            return item
+        return await self._run(self._pop_row, session_id)
+
+    async def clear_session(self, session_id: str) -> None:
+        pending = self._pending.pop(session_id, None)
+        if pending is not None:
+            self._unsubmitted -= len(pending.items) - pending.in_flight
+        await self._run(
+            self._conn.execute, "DELETE FROM session_items WHERE session_id = ?", (session_id,)
+        )
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending_items": sum(len(pending.items) for pending in self._pending.values()),
+            "pending_sessions": len(self._pending),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown()
+
+
+async def bench(
+    sessions: int = 5000, turns: int = 10, window: int = 8, memory: bool = False, path: str = "bench_sessions.db"
+) -> None:
+    """模拟大量会话交替进行多轮对话：每轮读取窗口历史，再追加用户消息与回复。"""
+    db_path = Path(path)
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+
+    store = SQLiteSessionStore(db_path, batch_size=256)
+    handles = [store.session(f"user-{i}", window=window) for i in range(sessions)]
+    read_latencies: list[float] = []
+
+    async def one_turn(session: StoreSession, turn: int) -> None:
+        started = time.perf_counter()
+        await session.get_items()
+        read_latencies.append(time.perf_counter() - started)
+        await session.add_items([
+            {"role": "user", "content": f"第 {turn} 轮的问题"},
+            {"role": "assistant", "content": f"第 {turn} 轮的回答。" * 8},
+        ])
+
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    for turn in range(turns):
+        # 每轮所有会话并发推进，模拟同时在线的用户
+        await asyncio.gather(*(one_turn(session, turn) for session in handles))
+    await store.flush()
+    elapsed = time.perf_counter() - started
+
+    read_latencies.sort()
+    stats = store.stats()
+    print(
+        f"{sessions} 个会话 × {turns} 轮：写入 {stats['rows_written']} 条，{stats['flushes']} 次批量提交，"
+        f"耗时 {elapsed:.2f} s，{stats['rows_written'] / elapsed:.0f} 条/s"
+    )
+    print(
+        f"窗口读取（最近 {window} 条）：p50 {read_latencies[len(read_latencies) // 2] * 1000:.2f} ms，"
+        f"p99 {read_latencies[int(len(read_latencies) * 0.99)] * 1000:.2f} ms"
+    )
+    if memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"内存分配峰值 {peak / 1024 / 1024:.1f} MiB（包含 {sessions} 个会话句柄与并发任务本身）")
+    await store.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="模拟大量会话交替写入。")
+    parser.add_argument("--sessions", type=int, default=5000, help="--bench 模拟的会话数。")
+    parser.add_argument("--turns", type=int, default=10, help="--bench 每个会话的轮数。")
+    parser.add_argument("--memory", action="store_true", help="--bench 时用 tracemalloc 统计内存分配峰值（会明显变慢）。")
+    args = parser.parse_args()
+    if args.bench:
+        asyncio.run(bench(args.sessions, args.turns, memory=args.memory))
+    else:
+        parser.print_help()
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import hashlib
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+from agents import (
+    Agent,
+    Model,
+    ModelProvider,
+    ModelResponse,
+    RunConfig,
+    Runner,
+    Usage,
+    set_tracing_disabled,
+)
+from openai.types.responses import ResponseCompletedEvent
+
+from request_scheduler import SimulatedBackend, SimulatedProvider
+
+"""
+合并同时发出的相同模型请求（single flight）。
+
+很多用户同时在线时，相同的请求（同一条护栏提示词、同一句话的语言判断）会在任何缓存生效之前同时打到后端。
+
+CoalescingModel 包装任意 Model：
+- 按请求内容（系统提示、输入、模型设置、工具与输出结构、previous_response_id 等）计算一个键；
+- 同一个键已经有请求在进行时，后来的请求不再调用后端，而是等待同一个结果；
+- 流式请求同样合并：后端的流由一个后台任务读取，每个事件都记录下来，
+  后加入的调用方先重放已经收到的事件，再和其他调用方一起接收后续事件；
+- 请求结束后立即移除，之后的相同请求会重新调用后端——这里只合并"同时"的请求，不是结果缓存；
+- 某个调用方取消不影响其他调用方；所有调用方都取消时才取消后端请求。
+- provider.stats.summary() 返回请求数、实际调用后端的次数、合并的次数与合并率。
+
+- 用量只记一次：第一个拿到结果的调用方得到带 usage 的响应，其余调用方得到 usage 为 0 的副本
+  （流式请求则是 response.completed 事件中去掉了 usage），各个 run 的用量加起来等于后端的实际用量。
+
+注意：合并后的调用方共享同一份输出条目，不应原地修改它们。
+只应把合并用在分类、护栏这类输入经常完全相同的短调用上，不要用在普通的对话轮次上。
+
+CoalescingProvider 包装另一个 ModelProvider，同一个提供方内所有模型共享合并状态。
+
+使用方式：
+    provider = CoalescingProvider(ScheduledProvider(shared_scheduler))
+    result = await Runner.run(agent, msg, run_config=RunConfig(model_provider=provider))
+
+python agent_patterns/single_flight.py --bench   # 大量用户同时发送少数几种相同的请求，对比后端调用次数与耗时
+"""
+
+_ARGUMENT_NAMES = ("system_instructions", "input", "model_settings", "tools", "output_schema", "handoffs", "tracing")
+
+
+def _describe_tool(tool: Any) -> Any:
+    return [getattr(tool, "name", type(tool).__name__), getattr(tool, "params_json_schema", None)]
+
+
+def request_key(model_name: str, streamed: bool, args: tuple, kwargs: dict) -> str:
+    """根据模型调用的参数计算合并用的键；tracing 不影响结果，不参与计算。"""
+    values = dict(zip(_ARGUMENT_NAMES, args))
+    values.update(kwargs)
+    model_settings = values.get("model_settings")
+    output_schema = values.get("output_schema")
+    described = {
+        "model": model_name,
+        "streamed": streamed,
+        "system_instructions": values.get("system_instructions"),
+        "input": values.get("input"),
+        "model_settings": model_settings.to_json_dict() if model_settings is not None else None,
+        "tools": [_describe_tool(tool) for tool in values.get("tools") or []],
+        "output_schema": output_schema.json_schema() if output_schema is not None and not output_schema.is_plain_text() else None,
+        "handoffs": [getattr(handoff, "tool_name", None) for handoff in values.get("handoffs") or []],
+        "previous_response_id": values.get("previous_response_id"),
+        "conversation_id": values.get("conversation_id"),
+        "prompt": values.get("prompt"),
+    }
+    encoded = json.dumps(described, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CoalescingStats:
+    requests: int = 0
+    backend_calls: int = 0
+    coalesced: int = 0
+    stream_replays: int = 0
+    max_fan_out: int = 1
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "backend_calls": self.backend_calls,
+            "coalesced": self.coalesced,
+            "stream_replays": self.stream_replays,
+            "coalescing_rate": round(self.coalesced / self.requests, 4) if self.requests else 0.0,
+            "max_fan_out": self.max_fan_out,
+        }
+
+
+class _Flight:
+    """一次正在进行的非流式请求。"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.usage_claimed = False
+
+
+class _StreamFlight:
+    """一次正在进行的流式请求：events 保存已经收到的全部事件，供后加入的调用方重放。"""
+
+    def __init__(self):
+        self.events: list[Any] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.usage_claimed = False
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    def publish(self, event: Any) -> None:
+        self.events.append(event)
+        self._notify()
+
+    def finish(self, error: BaseException | None = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self) -> None:
+        await self._changed.wait()
+
+
+class CoalescingModel(Model):
+    def __init__(self, inner: Model, model_name: str, provider: CoalescingProvider):
+        self.inner = inner
+        self.model_name = model_name
+        self.provider = provider
+
+    async def get_response(self, *args: Any, **kwargs: Any) -> ModelResponse:
+        stats = self.provider.stats
+        stats.requests += 1
+        key = request_key(self.model_name, False, args, kwargs)
+        flights = self.provider._flights
+        flight = flights.get(key)
+        if flight is None:
+            stats.backend_calls += 1
+            flight = flights[key] = _Flight(asyncio.ensure_future(self.inner.get_response(*args, **kwargs)))
+            flight.task.add_done_callback(lambda _: self._forget(flights, key, flight))
+        else:
+            stats.coalesced += 1
+        flight.waiters += 1
+        stats.max_fan_out = max(stats.max_fan_out, flight.waiters)
+        try:
+            response = await asyncio.shield(flight.task)
+            if flight.usage_claimed:
+                # 用量已经记在第一个拿到结果的调用方的 run 上
+                return dataclasses.replace(response, usage=Usage(), raw_usage=None)
+            flight.usage_claimed = True
+            return response
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # 最后一个调用方也取消了，后端请求的结果已经没人要；先从表中移除，
+                # 之后的相同请求不会加入这次已经取消的请求
+                self._forget(flights, key, flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, table: dict[str, Any], key: str, flight: Any) -> None:
+        # 只删除自己这一次请求：同一个键可能已经换成了新的请求
+        if table.get(key) is flight:
+            del table[key]
+
+    async def _pump(self, key: str, flight: _StreamFlight, args: tuple, kwargs: dict) -> None:
+        try:
+            async for event in self.inner.stream_response(*args, **kwargs):
+                flight.publish(event)
+        except BaseException as error:
+            # 先从表中移除再通知订阅者，之后的相同请求会发起新的后端调用，而不是拿到这次的错误
+            self._forget(self.provider._streams, key, flight)
+            flight.finish(error)
+            if not isinstance(error, Exception):
+                raise
+        else:
+            self._forget(self.provider._streams, key, flight)
+            flight.finish()
+
+    async def stream_response(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        stats = self.provider.stats
+        stats.requests += 1
+        key = request_key(self.model_name, True, args, kwargs)
+        streams = self.provider._streams
+        flight = streams.get(key)
+        if flight is None:
+            stats.backend_calls += 1
+            flight = streams[key] = _StreamFlight()
+            # 流由后台任务读取：SDK 的流式生成器依赖 contextvars，不能在多个任务之间交替迭代
+            flight.task = asyncio.ensure_future(self._pump(key, flight, args, kwargs))
+        else:
+            stats.coalesced += 1
+            if flight.events:
+                stats.stream_replays += 1
+        flight.subscribers += 1
+        stats.max_fan_out = max(stats.max_fan_out, flight.subscribers)
+        position = 0
+        try:
+            while True:
+                while position < len(flight.events):
+                    event = flight.events[position]
+                    position += 1
+                    if isinstance(event, ResponseCompletedEvent):
+                        if flight.usage_claimed:
+                            event = event.model_copy(update={"response": event.response.model_copy(update={"usage": None})})
+                        else:
+                            flight.usage_claimed = True
+                    yield event
+                if flight.done:
+                    break
+                await flight.wait()
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # 取消之前就从表中移除：_pump 处理 CancelledError 之前到达的相同请求会发起新的调用，
+                # 不会加入这次已经取消的请求、收到不是自己造成的 CancelledError
+                self._forget(streams, key, flight)
+                flight.task.cancel()
+
+
+class CoalescingProvider(ModelProvider):
+    def __init__(self, inner: ModelProvider):
+        self.inner = inner
+        self.stats = CoalescingStats()
+        self._flights: dict[str, _Flight] = {}
+        self._streams: dict[str, _StreamFlight] = {}
+
+    def get_model(self, model_name: str | None) -> Model:
+        return CoalescingModel(self.inner.get_model(model_name), model_name or "", self)
+
+
+async def bench(users: int = 500, distinct: int = 10) -> None:
+    """users 个用户几乎同时发送请求，内容只有 distinct 种（例如同样的护栏检查）。"""
+    set_tracing_disabled(disabled=True)
+    agent = Agent(name="护栏检查代理", instructions="判断用户是否请求解答数学题，只返回 is_math_question=true 或 false。")
+    messages = [f"第 {i} 种常见问题" for i in range(distinct)]
+
+    def responder(system_instructions: str | None, input: Any) -> str:
+        return f"is_math_question=false（{input}）"
+
+    for label, coalesce in (("不合并", False), ("合并相同请求", True)):
+        for streamed in (False, True):
+            backend = SimulatedBackend(latency=0.2, capacity=10_000, rps=1_000_000, responder=responder, token_interval=0.005)
+            provider: ModelProvider = SimulatedProvider(backend)
+            if coalesce:
+                provider = CoalescingProvider(provider)
+            run_config = RunConfig(model_provider=provider)
+            wrong = 0
+            recorded = Usage()
+
+            async def user(i: int) -> None:
+                nonlocal wrong
+                message = messages[i % distinct]
+                await asyncio.sleep(random.uniform(0, 0.4))
+                if streamed:
+                    result = Runner.run_streamed(agent, message, run_config=run_config)
+                    async for _ in result.stream_events():
+                        pass
+                else:
+                    result = await Runner.run(agent, message, run_config=run_config)
+                if message not in result.final_output:
+                    wrong += 1
+                recorded.add(result.context_wrapper.usage)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(user(i) for i in range(users)))
+            elapsed = time.perf_counter() - started
+            extra = f"，{provider.stats.summary()}" if isinstance(provider, CoalescingProvider) else ""
+            print(
+                f"[{label}{'，流式' if streamed else ''}] {users} 个请求，后端调用 {backend.calls} 次，"
+                f"耗时 {elapsed:.2f} s，结果错误 {wrong}，各 run 记录的用量 {recorded.requests} 次请求 / {recorded.total_tokens} token{extra}"
+            )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="对比合并与不合并相同请求时的后端调用次数。")
+    args = parser.parse_args()
+    if args.bench:
+        asyncio.run(bench())
+    else:
+        parser.print_help()
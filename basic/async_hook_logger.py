@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import IO, Any
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# 从 agents 包中导入所需的类和函数
+from agents import (
+    Agent,
+    AgentHooks,
+    RunContextWrapper,
+    RunHooks,
+    Runner,
+    Tool,
+    function_tool,
+    set_default_openai_client,
+    set_default_openai_api,
+    set_tracing_disabled,
+)
+
+# 加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+agent_hook.py 和 runner_hook.py 在每个 hook 里同步调用 print()，并发高时 stdout 写入会阻塞事件循环。
+
+本示例提供一个非阻塞的日志接收端 HookEventSink：
+- hook 只把事件（一个元组）放入有界环形缓冲区，不做序列化也不做 I/O；
+- 后台线程按批取出事件，序列化为 NDJSON（每行一个 JSON）后一次性写出；
+- 缓冲区满时覆盖最旧的事件并累加丢弃计数，保证 hook 永远不会阻塞 run。
+  默认容量 65536 条、每批 1024 条；只有事件持续以远高于写线程处理速度的频率产生、
+  积压超过容量时才会丢弃（--bench 的 20000 条突发不会丢弃，stats() 中的 dropped 记录丢弃数）。
+- LoggingHooks 对应 runner_hook.py 的 RunHooks，LoggingAgentHooks 对应 agent_hook.py 的 AgentHooks。
+
+使用方式：
+python basic/async_hook_logger.py                       # 日志写到 stdout
+python basic/async_hook_logger.py --output hooks.ndjson # 日志写到文件
+python basic/async_hook_logger.py --agent-hooks         # 改为挂在每个 Agent 上的 LoggingAgentHooks
+python basic/async_hook_logger.py --bench               # 对比同步 print 与缓冲写入的开销
+"""
+
+
+class HookEventSink:
+    """
+    有界环形缓冲区 + 后台写线程。
+
+    deque 的 append / popleft 在 CPython 中是原子操作，生产者（事件循环线程）和
+    消费者（写线程）之间不需要额外加锁。
+    """
+
+    def __init__(
+        self,
+        stream: IO[str] | None = None,
+        capacity: int = 65_536,
+        batch_size: int = 1024,
+        flush_interval: float = 0.05,
+    ):
+        self.stream = stream or sys.stdout
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: deque[tuple[float, str, dict[str, Any]]] = deque(maxlen=capacity)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self.emitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._drain_loop, name="hook-event-sink", daemon=True)
+        self._thread.start()
+
+    def emit(self, event: str, **fields: Any) -> None:
+        """在事件循环线程中调用，只做一次 append，不会阻塞。"""
+        if len(self._buffer) >= self.capacity:
+            # deque 设置了 maxlen，append 时会自动挤掉最旧的事件
+            self.dropped += 1
+        self._buffer.append((time.time(), event, fields))
+        self.emitted += 1
+        # 缓冲区可能在写线程醒来之前就越过 batch_size，用 >= 判断，已唤醒时不再重复 set
+        if len(self._buffer) >= self.batch_size and not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def _write_batch(self) -> int:
+        lines: list[str] = []
+        while self._buffer and len(lines) < self.batch_size:
+            ts, event, fields = self._buffer.popleft()
+            lines.append(json.dumps({"ts": ts, "event": event, **fields}, ensure_ascii=False, default=str))
+        if lines:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+            self.written += len(lines)
+            self.batches += 1
+        return len(lines)
+
+    def _drain_loop(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            while self._write_batch() == self.batch_size:
+                pass
+        # 退出前把剩余事件全部写出
+        while self._write_batch():
+            pass
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "emitted": self.emitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "buffered": len(self._buffer),
+        }
+
+
+def _usage_fields(context: RunContextWrapper) -> dict[str, int]:
+    usage = context.usage
+    return {
+        "requests": usage.requests,
+        "input_tokens": usage.input_tokens,
+        "output_tokens": usage.output_tokens,
+        "total_tokens": usage.total_tokens,
+    }
+
+
+# 与 runner_hook.py 中的 ExampleHooks 记录相同的信息，但以结构化事件的形式交给 sink
+class LoggingHooks(RunHooks):
+    def __init__(self, sink: HookEventSink):
+        self.sink = sink
+
+    async def on_agent_start(self, context: RunContextWrapper, agent: Agent) -> None:
+        self.sink.emit("agent_start", agent=agent.name, **_usage_fields(context))
+
+    async def on_agent_end(self, context: RunContextWrapper, agent: Agent, output: Any) -> None:
+        self.sink.emit("agent_end", agent=agent.name, output=output, **_usage_fields(context))
+
+    async def on_tool_start(self, context: RunContextWrapper, agent: Agent, tool: Tool) -> None:
+        self.sink.emit("tool_start", agent=agent.name, tool=tool.name, **_usage_fields(context))
+
+    async def on_tool_end(
+        self, context: RunContextWrapper, agent: Agent, tool: Tool, result: str
+    ) -> None:
+        self.sink.emit(
+            "tool_end", agent=agent.name, tool=tool.name, result=result, **_usage_fields(context)
+        )
+
+    async def on_handoff(
+        self, context: RunContextWrapper, from_agent: Agent, to_agent: Agent
+    ) -> None:
+        self.sink.emit(
+            "handoff", from_agent=from_agent.name, to_agent=to_agent.name, **_usage_fields(context)
+        )
+
+
+# 与 agent_hook.py 中的 CustomAgentHooks 对应的 AgentHooks 版本
+class LoggingAgentHooks(AgentHooks):
+    def __init__(self, sink: HookEventSink, display_name: str):
+        self.sink = sink
+        self.display_name = display_name
+
+    async def on_start(self, context: RunContextWrapper, agent: Agent) -> None:
+        self.sink.emit("agent_start", hooks=self.display_name, agent=agent.name)
+
+    async def on_end(self, context: RunContextWrapper, agent: Agent, output: Any) -> None:
+        self.sink.emit("agent_end", hooks=self.display_name, agent=agent.name, output=output)
+
+    async def on_handoff(self, context: RunContextWrapper, agent: Agent, source: Agent) -> None:
+        self.sink.emit("handoff", hooks=self.display_name, from_agent=source.name, to_agent=agent.name)
+
+    async def on_tool_start(self, context: RunContextWrapper, agent: Agent, tool: Tool) -> None:
+        self.sink.emit("tool_start", hooks=self.display_name, agent=agent.name, tool=tool.name)
+
+    async def on_tool_end(
+        self, context: RunContextWrapper, agent: Agent, tool: Tool, result: str
+    ) -> None:
+        self.sink.emit(
+            "tool_end", hooks=self.display_name, agent=agent.name, tool=tool.name, result=result
+        )
+
+
+@function_tool
+def random_number(max: int) -> int:
+    """
+    生成一个随机数，范围在 0 到 max 之间。
+    """
+    return random.randint(0, max)
+
+
+@function_tool
+def multiply_by_two(x: int) -> int:
+    """
+    返回 x 乘以 2 的结果。
+    """
+    return x * 2
+
+
+multiply_agent = Agent(
+    name="Multiply Agent",
+    instructions="将数字乘以 2，然后返回最终结果。",
+    tools=[multiply_by_two],
+    output_type=str,
+    model=MODEL_NAME,
+)
+
+start_agent = Agent(
+    name="Start Agent",
+    instructions=(
+        "调用 random_number 生成一个随机数。"
+        "如果这个数字是偶数，则直接输出并结束；"
+        "如果是奇数，则移交给 Multiply Agent。"
+    ),
+    tools=[random_number],
+    output_type=str,
+    handoffs=[multiply_agent],
+    model=MODEL_NAME,
+)
+
+
+class _SlowStream:
+    """模拟终端或管道处理不过来时的慢速输出：每次 write 都要等待一段时间。"""
+
+    def __init__(self, stream: IO[str], delay: float):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+
+async def bench(events: int = 20_000, write_delay: float = 0.00005) -> None:
+    """对比在事件循环线程里同步写日志与放入 sink 的耗时，输出写到一个慢速的 os.devnull。"""
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        slow = _SlowStream(devnull, write_delay)
+
+        started = time.perf_counter()
+        for i in range(events):
+            print(f"### {i}: Tool random_number ended with result 42. Usage: 1 requests", file=slow, flush=True)
+        sync_seconds = time.perf_counter() - started
+
+        sink = HookEventSink(stream=slow)
+        started = time.perf_counter()
+        for i in range(events):
+            sink.emit("tool_end", tool="random_number", result=42, requests=1)
+            if i % 100 == 0:
+                # 模拟 run 中其他协程占用事件循环的时间
+                await asyncio.sleep(0)
+        emit_seconds = time.perf_counter() - started
+        sink.close()
+
+    print(f"同步 print：每个事件 {sync_seconds / events * 1e6:.2f} µs（阻塞事件循环）")
+    print(f"HookEventSink：每个事件 {emit_seconds / events * 1e6:.2f} µs（阻塞事件循环）")
+    stats = sink.stats()
+    print(f"sink 统计：{stats}，丢弃率 {stats['dropped'] / events:.1%}")
+
+
+def _agents_with_hooks(sink: HookEventSink) -> Agent:
+    """与 agent_hook.py 相同，把 LoggingAgentHooks 挂在每个 Agent 上，返回起始 Agent。"""
+    multiply = multiply_agent.clone(hooks=LoggingAgentHooks(sink, display_name="Multiply Agent"))
+    return start_agent.clone(hooks=LoggingAgentHooks(sink, display_name="Start Agent"), handoffs=[multiply])
+
+
+async def main(output: str | None, agent_hooks: bool = False) -> None:
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
+    set_tracing_disabled(disabled=True)
+
+    stream = open(output, "a", encoding="utf-8") if output else None
+    sink = HookEventSink(stream=stream)
+    try:
+        user_input = input("请输入一个最大数字: ")
+        agent = _agents_with_hooks(sink) if agent_hooks else start_agent
+        run_hooks = None if agent_hooks else LoggingHooks(sink)
+        await asyncio.gather(
+            *(
+                Runner.run(
+                    agent,
+                    hooks=run_hooks,
+                    input=f"生成 0 到 {user_input} 之间的随机数。",
+                )
+                for _ in range(5)
+            )
+        )
+    finally:
+        sink.close()
+        if stream is not None:
+            stream.close()
+
+    print(f"Done! {sink.stats()}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="NDJSON 日志文件路径，默认写到 stdout。")
+    parser.add_argument("--agent-hooks", action="store_true", help="使用挂在 Agent 上的 LoggingAgentHooks，而不是 RunHooks。")
+    parser.add_argument("--bench", action="store_true", help="对比同步 print 与缓冲写入的开销。")
+    args = parser.parse_args()
+    asyncio.run(bench() if args.bench else main(args.output, args.agent_hooks))
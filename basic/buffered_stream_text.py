@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+from typing import BinaryIO
+
+# ResponseTextDeltaEvent 代表的是流式返回的文本增量事件
+from openai.types.responses import ResponseTextDeltaEvent
+
+# 从 agents 包中导入 Agent 和 Runner
+from agents import Agent, Runner, set_default_openai_client, set_default_openai_api, set_tracing_disabled
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# 加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+stream_text.py 对每个增量都执行一次 print(..., flush=True)，也就是每个 token 一次系统调用。
+
+本示例的 DeltaRenderer 把增量合并成"帧"后再输出：
+- 缓冲的字符数达到 max_chars，或距离第一个未输出的增量超过 max_delay 秒时输出一帧；
+- 所有帧都经由同一个二进制 writer 写出，每帧只有一次 write + flush；
+- 写操作放在线程里执行。输出端变慢时，新的增量继续合并到下一帧里，
+  只有积压超过 high_watermark 时才等待上一帧写完，从而把背压传回流式消费循环。
+
+使用方式：
+python basic/buffered_stream_text.py           # 调用真实模型
+python basic/buffered_stream_text.py --bench   # 对比 10 万个 token 的 CPU 时间
+"""
+
+
+class DeltaRenderer:
+    def __init__(
+        self,
+        writer: BinaryIO | None = None,
+        max_chars: int = 256,
+        max_delay: float = 0.05,
+        high_watermark: int = 64 * 1024,
+    ):
+        self.writer = writer or sys.stdout.buffer
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        self.high_watermark = high_watermark
+        self.frames = 0
+        self.backpressure_waits = 0
+        self._pending: list[str] = []
+        self._pending_chars = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._deadline = 0.0
+        self._inflight: asyncio.Task | None = None
+
+    def _write_frame(self, data: bytes) -> None:
+        self.writer.write(data)
+        self.writer.flush()
+
+    def _take_frame(self) -> bytes:
+        data = "".join(self._pending).encode("utf-8")
+        self._pending.clear()
+        self._pending_chars = 0
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return data
+
+    def _start_flush(self) -> None:
+        if not self._pending or (self._inflight is not None and not self._inflight.done()):
+            return
+        self.frames += 1
+        self._inflight = asyncio.ensure_future(asyncio.to_thread(self._write_frame, self._take_frame()))
+        self._inflight.add_done_callback(self._after_flush)
+
+    def _after_flush(self, task: asyncio.Task) -> None:
+        # 上一帧写完时，如果积压已经满足大小或时间条件就立即输出下一帧
+        if task.cancelled() or task.exception() is not None or not self._pending:
+            return
+        if self._pending_chars >= self.max_chars or asyncio.get_running_loop().time() >= self._deadline:
+            self._start_flush()
+
+    async def write(self, delta: str) -> None:
+        if not delta:
+            return
+        if not self._pending:
+            # 按时间合并：第一个增量进入缓冲区后最多等待 max_delay 秒
+            loop = asyncio.get_running_loop()
+            self._deadline = loop.time() + self.max_delay
+            self._timer = loop.call_at(self._deadline, self._start_flush)
+        self._pending.append(delta)
+        self._pending_chars += len(delta)
+
+        if self._pending_chars >= self.max_chars:
+            self._start_flush()
+        if self._pending_chars >= self.high_watermark and self._inflight is not None:
+            # 输出端跟不上：等待当前帧写完，再把积压的内容写出去
+            self.backpressure_waits += 1
+            await self._inflight
+            self._start_flush()
+
+    async def close(self) -> None:
+        """把剩余内容全部写出。"""
+        if self._inflight is not None:
+            await self._inflight
+        self._start_flush()
+        if self._inflight is not None:
+            await self._inflight
+
+
+def _synthetic_deltas(tokens: int) -> list[str]:
+    words = ["Why ", "did ", "the ", "robot ", "cross ", "the ", "road", "?\n"]
+    return [words[i % len(words)] for i in range(tokens)]
+
+
+async def bench(tokens: int = 100_000, repeat: int = 3) -> None:
+    """对比逐 token print 与 DeltaRenderer 输出 10 万个 token 所用的 CPU 时间（各取 repeat 次中的最小值）。
+
+    真实的流式循环在每个事件之间都会回到事件循环（等待下一个网络数据块），
+    这里每个增量后 await asyncio.sleep(0) 模拟这一点，写线程与 max_delay 定时器才有机会运行，
+    帧数反映的是按 max_chars / max_delay 合并的结果，而不是只靠 high_watermark 触发。
+    """
+    deltas = _synthetic_deltas(tokens)
+    renderer: DeltaRenderer | None = None
+
+    async def loop_only() -> None:
+        # 只回到事件循环、不输出任何内容，作为两种输出方式共有开销的参考
+        for _ in deltas:
+            await asyncio.sleep(0)
+
+    async def per_token_print() -> None:
+        with open(os.devnull, "w", encoding="utf-8") as devnull:
+            for delta in deltas:
+                print(delta, end="", file=devnull, flush=True)
+                await asyncio.sleep(0)
+
+    async def coalesced() -> None:
+        nonlocal renderer
+        with open(os.devnull, "wb") as devnull:
+            renderer = DeltaRenderer(writer=devnull)
+            for delta in deltas:
+                await renderer.write(delta)
+                await asyncio.sleep(0)
+            await renderer.close()
+
+    async def cpu_time(func) -> float:
+        timings = []
+        for _ in range(repeat):
+            started = time.process_time()
+            await func()
+            timings.append(time.process_time() - started)
+        return min(timings)
+
+    loop_cpu = await cpu_time(loop_only)
+    print_cpu = await cpu_time(per_token_print)
+    renderer_cpu = await cpu_time(coalesced)
+
+    print(f"只回到事件循环：{loop_cpu * 1000:.1f} ms CPU / {tokens} 次 sleep(0)（两种方式共有的部分）")
+    print(f"逐 token print：{print_cpu * 1000:.1f} ms CPU / {tokens} tokens，{tokens} 次 write + flush")
+    print(
+        f"DeltaRenderer：{renderer_cpu * 1000:.1f} ms CPU / {tokens} tokens，共 {renderer.frames} 帧，"
+        f"平均每帧 {sum(map(len, deltas)) / max(renderer.frames, 1):.0f} 个字符，背压等待 {renderer.backpressure_waits} 次"
+    )
+
+
+async def main():
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
+    set_tracing_disabled(disabled=True)
+
+    agent = Agent(
+        name="Joker",
+        instructions="You are a helpful assistant.",
+        model=MODEL_NAME,
+    )
+
+    result = Runner.run_streamed(
+        agent,
+        input="Please tell me 5 jokes."
+    )
+
+    renderer = DeltaRenderer()
+    async for event in result.stream_events():
+        if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+            # 不再每个增量都 flush，而是交给 renderer 合并成帧
+            await renderer.write(event.data.delta)
+    await renderer.close()
+
+    print(f"\n\n共输出 {renderer.frames} 帧，背压等待 {renderer.backpressure_waits} 次")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="对比逐 token print 与合并输出的 CPU 时间。")
+    args = parser.parse_args()
+    asyncio.run(bench() if args.bench else main())
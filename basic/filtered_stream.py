@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Iterable
+
+# 从 agents 包中导入所需的类和函数
+from agents import (
+    Agent,
+    AgentUpdatedStreamEvent,
+    ItemHelpers,
+    RawResponsesStreamEvent,
+    RunItemStreamEvent,
+    RunResultStreaming,
+    Runner,
+    function_tool,
+    set_default_openai_client,
+    set_default_openai_api,
+    set_tracing_disabled,
+)
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# 加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+stream_items.py 对每个 raw_response_event 都直接 continue，但 runner 仍然会把它们放进队列，
+消费循环也要为每个事件唤醒一次。
+
+本示例提供 run_streamed_filtered()：在 run 真正开始之前，把结果对象内部的事件队列替换为
+只接收订阅类型的 FilteredEventQueue。未订阅的事件在入队时就被丢弃，不会进入队列、
+不会被保留，也不会唤醒消费循环。
+
+注意：SDK 在入队前会先创建 RawResponsesStreamEvent 这个很小的包装对象，底层的模型事件
+本身也要用于拼装最终响应，这两部分无法在外部省掉；过滤节省的是排队、保留和每个事件
+一次的消费端调度。
+
+使用方式：
+python basic/filtered_stream.py           # 调用真实模型，只订阅 item / agent 事件
+python basic/filtered_stream.py --bench   # 模拟长时间、多工具调用的 run，对比 CPU 与内存分配
+"""
+
+DEFAULT_EVENT_TYPES = ("run_item_stream_event", "agent_updated_stream_event")
+
+
+class FilteredEventQueue(asyncio.Queue):
+    """只接收指定类型事件的队列；结束标记等非事件对象总是放行。"""
+
+    def __init__(self, event_types: Iterable[str]):
+        super().__init__()
+        self.event_types = frozenset(event_types)
+        self.dropped = 0
+
+    def put_nowait(self, item: Any) -> None:
+        event_type = getattr(item, "type", None)
+        if event_type is not None and event_type not in self.event_types:
+            self.dropped += 1
+            return
+        super().put_nowait(item)
+
+
+def subscribe(result: RunResultStreaming, event_types: Iterable[str] = DEFAULT_EVENT_TYPES) -> FilteredEventQueue:
+    """
+    给刚创建的 RunResultStreaming 换上过滤队列。
+
+    必须在第一次 await 之前调用：run_streamed 创建的后台任务此时还没有机会运行，队列里也还没有事件。
+    """
+    if not result._event_queue.empty():
+        raise RuntimeError("subscribe() 必须在 run 开始产生事件之前调用")
+    queue = FilteredEventQueue(event_types)
+    result._event_queue = queue
+    return queue
+
+
+def run_streamed_filtered(
+    agent: Agent, input: Any, event_types: Iterable[str] = DEFAULT_EVENT_TYPES, **kwargs: Any
+) -> RunResultStreaming:
+    """与 Runner.run_streamed 参数相同，但只把 event_types 中的事件交给 stream_events()。"""
+    result = Runner.run_streamed(agent, input, **kwargs)
+    subscribe(result, event_types)
+    return result
+
+
+@function_tool
+def how_many_jokes() -> int:
+    """
+    返回一个随机整数，表示要讲多少个笑话。
+    """
+    return random.randint(1, 10)
+
+
+async def _simulate_run(queue: asyncio.Queue, turns: int, deltas_per_turn: int) -> None:
+    """模拟 runner：每一轮先产生大量文本增量事件，再产生工具调用和工具输出两个 item 事件。"""
+
+    class _Item:
+        def __init__(self, type: str):
+            self.type = type
+
+    agent = Agent(name="Bench")
+    queue.put_nowait(AgentUpdatedStreamEvent(new_agent=agent))
+    for turn in range(turns):
+        for i in range(deltas_per_turn):
+            queue.put_nowait(RawResponsesStreamEvent(data={"type": "response.output_text.delta", "delta": "x"}))
+            if i % 16 == 0:
+                # 模型流式返回时，runner 会不时让出事件循环
+                await asyncio.sleep(0)
+        queue.put_nowait(RunItemStreamEvent(name="tool_called", item=_Item("tool_call_item")))
+        queue.put_nowait(RunItemStreamEvent(name="tool_output", item=_Item("tool_call_output_item")))
+        await asyncio.sleep(0)
+    queue.put_nowait(None)
+
+
+async def _consume(queue: asyncio.Queue) -> int:
+    handled = 0
+    while True:
+        event = await queue.get()
+        if event is None:
+            return handled
+        if event.type == "raw_response_event":
+            continue
+        handled += 1
+
+
+async def bench(turns: int = 200, deltas_per_turn: int = 300) -> None:
+    """分别用普通队列与过滤队列跑同一段模拟事件流，统计 CPU 时间与内存分配峰值。"""
+    for label, queue_factory in (
+        ("不过滤", asyncio.Queue),
+        ("源头过滤", lambda: FilteredEventQueue(DEFAULT_EVENT_TYPES)),
+    ):
+        queue = queue_factory()
+        tracemalloc.start()
+        started = time.process_time()
+        _, handled = await asyncio.gather(_simulate_run(queue, turns, deltas_per_turn), _consume(queue))
+        cpu = time.process_time() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        produced = 1 + turns * (deltas_per_turn + 2)
+        enqueued = produced - getattr(queue, "dropped", 0)
+        print(
+            f"{label}: 产生 {produced} 个事件，入队 {enqueued} 个，处理 {handled} 个，"
+            f"CPU {cpu * 1000:.1f} ms，内存分配峰值 {peak / 1024:.1f} KiB"
+        )
+
+
+async def main():
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
+    set_tracing_disabled(disabled=True)
+
+    agent = Agent(
+        name="Joker",
+        instructions="First call the `how_many_jokes` tool, then tell that many jokes.",
+        tools=[how_many_jokes],
+        model=MODEL_NAME,
+    )
+
+    # 只订阅 item 与 agent 事件，消费循环里不再需要跳过 raw_response_event
+    result = run_streamed_filtered(agent, input="Hello")
+
+    print("=== Run starting ===")
+    async for event in result.stream_events():
+        if event.type == "agent_updated_stream_event":
+            print(f"Agent updated: {event.new_agent.name}")
+        elif event.item.type == "tool_call_item":
+            print("-- Tool was called")
+        elif event.item.type == "tool_call_output_item":
+            print(f"-- Tool output: {event.item.output}")
+        elif event.item.type == "message_output_item":
+            print(f"-- Message output:\n {ItemHelpers.text_message_output(event.item)}")
+    print("=== Run complete ===")
+    print(f"在源头丢弃的事件数: {result._event_queue.dropped}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="模拟多工具调用的长 run，对比 CPU 与内存分配。")
+    args = parser.parse_args()
+    asyncio.run(bench() if args.bench else main())
@@ -0,0 +1,424 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import time
+from array import array
+from pathlib import Path
+from typing import Any, Callable
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# 从 agents 包中导入所需的类和函数
+from agents import (
+    Agent,
+    AgentHooks,
+    ModelResponse,
+    RunContextWrapper,
+    RunHooks,
+    Runner,
+    Tool,
+    function_tool,
+    set_default_openai_client,
+    set_default_openai_api,
+    set_tracing_disabled,
+)
+
+# 加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+本示例展示如何用 hooks 采集延迟数据，而不是像 agent_hook.py / runner_hook.py 那样只打印事件计数。
+
+- LatencyHistogram：HDR 风格的对数-线性直方图，内存固定，相对误差约 1%。
+- LatencyRecorder：用单调时钟记录 Agent / 工具 / LLM 调用 / 移交的开始与结束，
+  按 Agent 名、工具名聚合到直方图中，提供 snapshot() 快照和周期性输出。
+- LatencyHooks / LatencyAgentHooks：分别以 RunHooks、AgentHooks 的形式接入 Runner 或单个 Agent。
+
+每个 hook 自身的耗时也会被统计，快照中给出平均开销，并与 HOOK_BUDGET_NS 预算比较。
+
+使用方式：
+python basic/latency_hooks.py           # 调用真实模型运行示例
+python basic/latency_hooks.py --bench   # 离线测量每个 hook 事件的开销
+"""
+
+# 每个 hook 事件允许的平均开销（纳秒）
+HOOK_BUDGET_NS = 20_000
+
+# 每个二进制数量级内划分的子桶位数：2^8 = 256 个子桶，相对误差 < 1/128
+SUB_BUCKET_BITS = 8
+# 可记录的最大延迟（微秒），超过的值按最大值计，默认 1 小时
+MAX_TRACKABLE_US = 3_600_000_000
+
+
+class LatencyHistogram:
+    """
+    HDR 风格的延迟直方图，单位为微秒。
+
+    小于 2^SUB_BUCKET_BITS 的值逐一计数；更大的值按数量级分桶，每个数量级再线性划分子桶，
+    因此无论记录多少次，内存占用都是固定的。
+    """
+
+    __slots__ = ("_counts", "count", "total_us", "min_us", "max_us")
+
+    _HALF = 1 << (SUB_BUCKET_BITS - 1)
+    _SIZE = (MAX_TRACKABLE_US.bit_length() - SUB_BUCKET_BITS + 2) * (1 << (SUB_BUCKET_BITS - 1))
+
+    def __init__(self):
+        self._counts = array("Q", bytes(8 * self._SIZE))
+        self.count = 0
+        self.total_us = 0
+        self.min_us = 0
+        self.max_us = 0
+
+    @staticmethod
+    def _index(value_us: int) -> int:
+        shift = value_us.bit_length() - SUB_BUCKET_BITS
+        if shift <= 0:
+            return value_us
+        return (shift << (SUB_BUCKET_BITS - 1)) + (value_us >> shift)
+
+    @classmethod
+    def _upper_bound(cls, index: int) -> int:
+        """返回某个桶所覆盖的最大值（微秒）。"""
+        if index < (1 << SUB_BUCKET_BITS):
+            return index
+        shift = (index >> (SUB_BUCKET_BITS - 1)) - 1
+        sub = index - (shift << (SUB_BUCKET_BITS - 1))
+        return ((sub + 1) << shift) - 1
+
+    def record(self, value_us: int) -> None:
+        value_us = min(max(value_us, 0), MAX_TRACKABLE_US)
+        self._counts[self._index(value_us)] += 1
+        if self.count == 0 or value_us < self.min_us:
+            self.min_us = value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+        self.count += 1
+        self.total_us += value_us
+
+    def percentile(self, p: float) -> int:
+        """返回第 p 百分位的延迟（微秒），p 取值 0~100。"""
+        if self.count == 0:
+            return 0
+        rank = max(1, int(self.count * p / 100 + 0.5))
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            if bucket_count:
+                seen += bucket_count
+                if seen >= rank:
+                    return min(self._upper_bound(index), self.max_us)
+        return self.max_us
+
+    def summary(self) -> dict[str, float]:
+        """以毫秒为单位汇总常用统计值。"""
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "min_ms": self.min_us / 1000,
+            "mean_ms": round(self.total_us / self.count / 1000, 3),
+            "p50_ms": self.percentile(50) / 1000,
+            "p90_ms": self.percentile(90) / 1000,
+            "p99_ms": self.percentile(99) / 1000,
+            "max_ms": self.max_us / 1000,
+        }
+
+
+class LatencyRecorder:
+    """
+    延迟记录器：保存进行中事件的开始时间戳，事件结束时把耗时写入对应的直方图。
+
+    同一次 run 中各个 hook 拿到的上下文对象可能不同，但它们共享同一个 Usage 对象，
+    因此用 id(context.usage) 区分并发执行的多个 run。
+    """
+
+    def __init__(self, budget_ns: int = HOOK_BUDGET_NS):
+        self.budget_ns = budget_ns
+        self.agents: dict[str, LatencyHistogram] = {}
+        self.tools: dict[str, LatencyHistogram] = {}
+        self.llm: dict[str, LatencyHistogram] = {}
+        self.handoffs: dict[str, int] = {}
+        self._pending: dict[tuple, int] = {}
+        self._events = 0
+        self._overhead_ns = 0
+        self._over_budget = 0
+        self._dump_task: asyncio.Task | None = None
+
+    @staticmethod
+    def _run_key(context: RunContextWrapper) -> int:
+        return id(getattr(context, "usage", context))
+
+    @staticmethod
+    def _tool_key(context: RunContextWrapper, agent: Agent, tool: Tool) -> tuple:
+        # 新版 SDK 为每次工具调用创建独立的 ToolContext，带有 tool_call_id
+        call_id = getattr(context, "tool_call_id", None) or id(context)
+        return ("tool", id(getattr(context, "usage", context)), agent.name, tool.name, call_id)
+
+    def _account(self, started_ns: int) -> None:
+        cost = time.perf_counter_ns() - started_ns
+        self._events += 1
+        self._overhead_ns += cost
+        if cost > self.budget_ns:
+            self._over_budget += 1
+
+    def _finish(self, key: tuple, table: dict[str, LatencyHistogram], name: str, now: int) -> None:
+        started = self._pending.pop(key, None)
+        if started is None:
+            return
+        histogram = table.get(name)
+        if histogram is None:
+            histogram = table[name] = LatencyHistogram()
+        histogram.record((now - started) // 1000)
+
+    def agent_start(self, context: RunContextWrapper, agent: Agent) -> None:
+        now = time.perf_counter_ns()
+        self._pending[("agent", self._run_key(context), agent.name)] = now
+        self._account(now)
+
+    def agent_end(self, context: RunContextWrapper, agent: Agent) -> None:
+        now = time.perf_counter_ns()
+        self._finish(("agent", self._run_key(context), agent.name), self.agents, agent.name, now)
+        self._account(now)
+
+    def handoff(self, context: RunContextWrapper, from_agent: Agent, to_agent: Agent) -> None:
+        # 移交时源 Agent 不会触发 on_agent_end，因此在这里结束它的计时
+        now = time.perf_counter_ns()
+        self._finish(
+            ("agent", self._run_key(context), from_agent.name), self.agents, from_agent.name, now
+        )
+        edge = f"{from_agent.name} -> {to_agent.name}"
+        self.handoffs[edge] = self.handoffs.get(edge, 0) + 1
+        self._account(now)
+
+    def tool_start(self, context: RunContextWrapper, agent: Agent, tool: Tool) -> None:
+        now = time.perf_counter_ns()
+        self._pending[self._tool_key(context, agent, tool)] = now
+        self._account(now)
+
+    def tool_end(self, context: RunContextWrapper, agent: Agent, tool: Tool) -> None:
+        now = time.perf_counter_ns()
+        self._finish(self._tool_key(context, agent, tool), self.tools, tool.name, now)
+        self._account(now)
+
+    def llm_start(self, context: RunContextWrapper, agent: Agent) -> None:
+        now = time.perf_counter_ns()
+        self._pending[("llm", self._run_key(context), agent.name)] = now
+        self._account(now)
+
+    def llm_end(self, context: RunContextWrapper, agent: Agent) -> None:
+        now = time.perf_counter_ns()
+        self._finish(("llm", self._run_key(context), agent.name), self.llm, agent.name, now)
+        self._account(now)
+
+    def snapshot(self) -> dict[str, Any]:
+        """返回当前所有直方图的汇总，以及 hook 自身的开销统计。"""
+        mean_overhead = self._overhead_ns / self._events if self._events else 0
+        return {
+            "agents": {name: h.summary() for name, h in self.agents.items()},
+            "tools": {name: h.summary() for name, h in self.tools.items()},
+            "llm": {name: h.summary() for name, h in self.llm.items()},
+            "handoffs": dict(self.handoffs),
+            "hook_overhead": {
+                "events": self._events,
+                "mean_ns": round(mean_overhead),
+                "budget_ns": self.budget_ns,
+                "over_budget_events": self._over_budget,
+                "within_budget": mean_overhead <= self.budget_ns,
+            },
+        }
+
+    def start_periodic_dump(
+        self, interval: float = 10.0, writer: Callable[[str], Any] = print
+    ) -> asyncio.Task:
+        """在后台每隔 interval 秒把快照以 JSON 形式交给 writer 输出。"""
+
+        async def _dump_loop() -> None:
+            while True:
+                await asyncio.sleep(interval)
+                writer(json.dumps(self.snapshot(), ensure_ascii=False))
+
+        self._dump_task = asyncio.create_task(_dump_loop())
+        return self._dump_task
+
+    def stop_periodic_dump(self) -> None:
+        if self._dump_task is not None:
+            self._dump_task.cancel()
+            self._dump_task = None
+
+
+# 以 RunHooks 的形式接入，统计一次 run 中所有 Agent 的事件
+class LatencyHooks(RunHooks):
+    def __init__(self, recorder: LatencyRecorder | None = None):
+        self.recorder = recorder or LatencyRecorder()
+
+    async def on_agent_start(self, context: RunContextWrapper, agent: Agent) -> None:
+        self.recorder.agent_start(context, agent)
+
+    async def on_agent_end(self, context: RunContextWrapper, agent: Agent, output: Any) -> None:
+        self.recorder.agent_end(context, agent)
+
+    async def on_handoff(
+        self, context: RunContextWrapper, from_agent: Agent, to_agent: Agent
+    ) -> None:
+        self.recorder.handoff(context, from_agent, to_agent)
+
+    async def on_tool_start(self, context: RunContextWrapper, agent: Agent, tool: Tool) -> None:
+        self.recorder.tool_start(context, agent, tool)
+
+    async def on_tool_end(
+        self, context: RunContextWrapper, agent: Agent, tool: Tool, result: str
+    ) -> None:
+        self.recorder.tool_end(context, agent, tool)
+
+    async def on_llm_start(
+        self, context: RunContextWrapper, agent: Agent, system_prompt: str | None, input_items: list
+    ) -> None:
+        self.recorder.llm_start(context, agent)
+
+    async def on_llm_end(
+        self, context: RunContextWrapper, agent: Agent, response: ModelResponse
+    ) -> None:
+        self.recorder.llm_end(context, agent)
+
+
+# 以 AgentHooks 的形式接入单个 Agent，多个 Agent 可以共享同一个 recorder
+class LatencyAgentHooks(AgentHooks):
+    def __init__(self, recorder: LatencyRecorder | None = None):
+        self.recorder = recorder or LatencyRecorder()
+
+    async def on_start(self, context: RunContextWrapper, agent: Agent) -> None:
+        self.recorder.agent_start(context, agent)
+
+    async def on_end(self, context: RunContextWrapper, agent: Agent, output: Any) -> None:
+        self.recorder.agent_end(context, agent)
+
+    async def on_handoff(self, context: RunContextWrapper, agent: Agent, source: Agent) -> None:
+        self.recorder.handoff(context, source, agent)
+
+    async def on_tool_start(self, context: RunContextWrapper, agent: Agent, tool: Tool) -> None:
+        self.recorder.tool_start(context, agent, tool)
+
+    async def on_tool_end(
+        self, context: RunContextWrapper, agent: Agent, tool: Tool, result: str
+    ) -> None:
+        self.recorder.tool_end(context, agent, tool)
+
+    async def on_llm_start(
+        self, context: RunContextWrapper, agent: Agent, system_prompt: str | None, input_items: list
+    ) -> None:
+        self.recorder.llm_start(context, agent)
+
+    async def on_llm_end(
+        self, context: RunContextWrapper, agent: Agent, response: ModelResponse
+    ) -> None:
+        self.recorder.llm_end(context, agent)
+
+
+@function_tool
+def random_number(max: int) -> int:
+    """
+    生成一个随机数，范围在 0 到 max 之间。
+    """
+    return random.randint(0, max)
+
+
+@function_tool
+def multiply_by_two(x: int) -> int:
+    """
+    返回 x 乘以 2 的结果。
+    """
+    return x * 2
+
+
+multiply_agent = Agent(
+    name="Multiply Agent",
+    instructions="将数字乘以 2，然后返回最终结果。",
+    tools=[multiply_by_two],
+    output_type=str,
+    model=MODEL_NAME,
+)
+
+start_agent = Agent(
+    name="Start Agent",
+    instructions=(
+        "调用 random_number 生成一个随机数。"
+        "如果这个数字是偶数，则直接输出并结束；"
+        "如果是奇数，则移交给 Multiply Agent。"
+    ),
+    tools=[random_number],
+    output_type=str,
+    handoffs=[multiply_agent],
+    model=MODEL_NAME,
+)
+
+
+async def bench(events: int = 200_000) -> None:
+    """离线测量每个 hook 事件的平均开销，不需要访问模型。"""
+
+    class _Named:
+        def __init__(self, name: str):
+            self.name = name
+
+    hooks = LatencyHooks()
+    context = RunContextWrapper(context=None)
+    agent, tool = _Named("Bench Agent"), _Named("bench_tool")
+
+    started = time.perf_counter_ns()
+    for _ in range(events // 4):
+        await hooks.on_agent_start(context, agent)
+        await hooks.on_tool_start(context, agent, tool)
+        await hooks.on_tool_end(context, agent, tool, "ok")
+        await hooks.on_agent_end(context, agent, "ok")
+    elapsed = time.perf_counter_ns() - started
+
+    overhead = hooks.recorder.snapshot()["hook_overhead"]
+    print(f"端到端: 每个事件 {elapsed / events:.0f} ns（包含协程调度）")
+    print(f"hook 内部: 每个事件 {overhead['mean_ns']} ns，预算 {overhead['budget_ns']} ns，"
+          f"{'满足' if overhead['within_budget'] else '超出'}预算")
+
+
+async def main() -> None:
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
+    set_tracing_disabled(disabled=True)
+
+    hooks = LatencyHooks()
+    hooks.recorder.start_periodic_dump(interval=5.0)
+
+    user_input = input("请输入一个最大数字: ")
+    # 连续运行几次，让直方图里有足够的数据
+    for _ in range(3):
+        await Runner.run(
+            start_agent,
+            hooks=hooks,
+            input=f"生成 0 到 {user_input} 之间的随机数。",
+        )
+
+    hooks.recorder.stop_periodic_dump()
+    print(json.dumps(hooks.recorder.snapshot(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="离线测量 hook 开销。")
+    args = parser.parse_args()
+    asyncio.run(bench() if args.bench else main())
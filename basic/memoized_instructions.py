@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import os
+import random
+import string
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterable, Literal
+
+# 从 agents 包中导入所需的类和函数
+from agents import (
+    Agent,
+    RunContextWrapper,
+    Runner,
+    set_default_openai_client,
+    set_default_openai_api,
+    set_tracing_disabled,
+)
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# 加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+dynamic_system_prompt.py 中的 custom_instructions 在每一轮都会根据上下文重新生成系统提示。
+实际服务中生成指令往往要渲染模板、查询数据库，在高 QPS 下这部分开销会出现在每一轮里。
+
+本示例提供两个工具：
+- InstructionTemplate：模板只解析一次，之后每次渲染只是按顺序拼接字符串；
+- memoized_instructions：装饰指令函数（同步或异步均可），按 Agent 名称和上下文中选定的字段缓存结果。
+  - 缓存是有上限的 LRU，可选 ttl 过期；
+  - 同一个键同时有多个请求未命中时，只执行一次指令函数，其余请求等待同一个结果；
+  - invalidate(**fields) 按字段使部分缓存失效（例如某个用户的配置更新后），invalidate_all() 清空全部；
+  - stats() 返回命中、未命中、合并等待的次数与当前缓存大小。
+
+注意：只有当指令完全由选定字段决定时才能缓存；依赖其他状态的部分需要放进 key_fields，
+或者在状态变化时调用 invalidate。
+
+使用方式：
+python basic/memoized_instructions.py           # 调用真实模型，同一风格的后续请求直接使用缓存
+python basic/memoized_instructions.py --bench   # 模拟高 QPS 下每轮生成指令的开销
+"""
+
+
+class InstructionTemplate:
+    """预编译的 string.Template：构造时解析一次，render 只做拼接。"""
+
+    def __init__(self, template: str):
+        self.template = template
+        self._parts: list[str] = []
+        self._fields: list[str] = []
+        literal: list[str] = []
+        position = 0
+        for match in string.Template.pattern.finditer(template):
+            literal.append(template[position : match.start()])
+            position = match.end()
+            if match.group("escaped") is not None:
+                literal.append("$")
+                continue
+            name = match.group("named") or match.group("braced")
+            if name is None:
+                raise ValueError(f"模板中有无效的占位符：位置 {match.start()}")
+            self._parts.append("".join(literal))
+            self._fields.append(name)
+            literal = []
+        literal.append(template[position:])
+        self._tail = "".join(literal)
+
+    @property
+    def fields(self) -> tuple[str, ...]:
+        return tuple(self._fields)
+
+    def render(self, values: dict[str, Any]) -> str:
+        pieces = []
+        for part, name in zip(self._parts, self._fields):
+            pieces.append(part)
+            pieces.append(str(values[name]))
+        pieces.append(self._tail)
+        return "".join(pieces)
+
+
+InstructionsFunction = Callable[[RunContextWrapper[Any], Agent[Any]], "str | Awaitable[str]"]
+
+
+class MemoizedInstructions:
+    def __init__(
+        self,
+        func: InstructionsFunction,
+        key_fields: Iterable[str],
+        maxsize: int = 1024,
+        ttl: float | None = None,
+    ):
+        self.func = func
+        self.key_fields = tuple(key_fields)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # 每次失效加一；生成期间发生过失效的结果不写入缓存
+        self._generation = 0
+        # (agent 名称, 字段值...) -> (生成时间, 指令)
+        self._cache: OrderedDict[tuple, tuple[float, str]] = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self._is_async = inspect.iscoroutinefunction(func)
+
+    def _key(self, run_context: RunContextWrapper[Any], agent: Agent[Any]) -> tuple:
+        context = run_context.context
+        return (agent.name, *(getattr(context, field) for field in self.key_fields))
+
+    async def __call__(self, run_context: RunContextWrapper[Any], agent: Agent[Any]) -> str:
+        key = self._key(run_context, agent)
+        cached = self._cache.get(key)
+        if cached is not None and (self.ttl is None or time.monotonic() - cached[0] < self.ttl):
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        generation = self._generation
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = self.func(run_context, agent)
+            if self._is_async:
+                value = await value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # 没有其他等待者时，避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        future.set_result(value)
+        if generation != self._generation:
+            return value
+
+        self._cache[key] = (time.monotonic(), value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return value
+
+    def invalidate(self, agent_name: str | None = None, **fields: Any) -> int:
+        """使匹配的缓存失效，返回失效的条目数；不传参数时不做任何事。"""
+        if agent_name is None and not fields:
+            return 0
+        unknown = set(fields) - set(self.key_fields)
+        if unknown:
+            raise ValueError(f"未知的字段：{sorted(unknown)}")
+        positions = [(self.key_fields.index(name) + 1, value) for name, value in fields.items()]
+        if agent_name is not None:
+            positions.append((0, agent_name))
+        stale = [key for key in self._cache if all(key[i] == value for i, value in positions)]
+        for key in stale:
+            del self._cache[key]
+        self._generation += 1
+        return len(stale)
+
+    def invalidate_all(self) -> None:
+        self._cache.clear()
+        self._generation += 1
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._cache),
+        }
+
+
+def memoized_instructions(
+    key_fields: Iterable[str], maxsize: int = 1024, ttl: float | None = None
+) -> Callable[[InstructionsFunction], MemoizedInstructions]:
+    """装饰器：@memoized_instructions(key_fields=("style",))"""
+
+    def decorator(func: InstructionsFunction) -> MemoizedInstructions:
+        return MemoizedInstructions(func, key_fields, maxsize=maxsize, ttl=ttl)
+
+    return decorator
+
+
+class CustomContext:
+    """与 dynamic_system_prompt.py 相同，另外带有一个用户 ID。"""
+
+    def __init__(self, style: Literal["haiku", "pirate", "robot"], user_id: str = "demo"):
+        self.style = style
+        self.user_id = user_id
+
+
+STYLE_TEMPLATE = InstructionTemplate(
+    "你正在为用户 ${user_id} 服务，对方的会员等级是 ${tier}。\n${style_rule}"
+)
+
+STYLE_RULES = {
+    "haiku": "请使用俳句（haiku）的形式进行回复。",
+    "pirate": "请使用海盗（pirate）的口吻进行回复。",
+    "robot": "请使用机器人（robot）的口吻进行回复，并经常说“beep boop”。",
+}
+
+
+async def lookup_tier(user_id: str) -> str:
+    """模拟一次耗时约 2ms 的数据库查询。"""
+    await asyncio.sleep(0.002)
+    return "gold" if hash(user_id) % 2 else "silver"
+
+
+async def build_instructions(run_context: RunContextWrapper[CustomContext], agent: Agent[CustomContext]) -> str:
+    context = run_context.context
+    tier = await lookup_tier(context.user_id)
+    return STYLE_TEMPLATE.render({
+        "user_id": context.user_id,
+        "tier": tier,
+        "style_rule": STYLE_RULES[context.style],
+    })
+
+
+cached_instructions = memoized_instructions(key_fields=("user_id", "style"))(build_instructions)
+
+
+async def bench(requests: int = 20000, concurrency: int = 200, users: int = 50) -> None:
+    """按 concurrency 个并发模拟 requests 次取系统提示，对比每轮的指令生成开销。"""
+    styles = list(STYLE_RULES)
+    contexts = [
+        RunContextWrapper(CustomContext(random.choice(styles), f"user-{random.randrange(users)}"))
+        for _ in range(requests)
+    ]
+
+    for label, instructions in (
+        ("不缓存", build_instructions),
+        ("缓存", memoized_instructions(key_fields=("user_id", "style"))(build_instructions)),
+    ):
+        agent = Agent(name="聊天代理", instructions=instructions)
+        queue = iter(contexts)
+        latencies: list[float] = []
+
+        async def worker() -> None:
+            for context in queue:
+                started = time.perf_counter()
+                await agent.get_system_prompt(context)
+                latencies.append(time.perf_counter() - started)
+                # 一轮中的其余部分（调用模型等）会让出事件循环
+                await asyncio.sleep(0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        extra = f"，{instructions.stats()}" if isinstance(instructions, MemoizedInstructions) else ""
+        print(
+            f"{label}: {requests} 次，{requests / elapsed:.0f} 次/s，"
+            f"每轮 p50 {latencies[len(latencies) // 2] * 1e6:.1f} µs，"
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.1f} µs{extra}"
+        )
+
+    # 模板渲染本身：预编译 vs 每次 string.Template.substitute
+    values = {"user_id": "user-1", "tier": "gold", "style_rule": STYLE_RULES["haiku"]}
+    raw = string.Template(STYLE_TEMPLATE.template)
+    for label, render in (("string.Template", lambda: raw.substitute(values)), ("预编译模板", lambda: STYLE_TEMPLATE.render(values))):
+        started = time.perf_counter()
+        for _ in range(100_000):
+            render()
+        print(f"{label}: 每次渲染 {(time.perf_counter() - started) / 100_000 * 1e6:.2f} µs")
+
+
+async def main():
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
+    set_tracing_disabled(disabled=True)
+
+    agent = Agent(
+        name="聊天代理 (Chat agent)",
+        instructions=cached_instructions,
+        model=MODEL_NAME,
+    )
+
+    for turn in range(3):
+        context = CustomContext(style=random.choice(["haiku", "pirate", "robot"]))
+        result = await Runner.run(agent, "给我讲个笑话吧。", context=context)
+        print(f"[{context.style}] 助理: {result.final_output}\n")
+    print(f"指令缓存: {cached_instructions.stats()}")
+
+    # 用户配置变化后，使该用户的缓存失效
+    removed = cached_instructions.invalidate(user_id="demo")
+    print(f"已失效 {removed} 条缓存")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="模拟高 QPS 下每轮生成指令的开销。")
+    args = parser.parse_args()
+    asyncio.run(bench() if args.bench else main())
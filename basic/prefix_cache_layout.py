@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Literal
+
+# 从 agents 包中导入所需的类和函数
+from agents import (
+    Agent,
+    ModelResponse,
+    ModelSettings,
+    RunContextWrapper,
+    RunHooks,
+    Runner,
+    TResponseInputItem,
+    function_tool,
+    set_default_openai_client,
+    set_default_openai_api,
+    set_tracing_disabled,
+)
+from agents.run import CallModelData, ModelInputData, RunConfig
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# 读取缓存命中 token 数的逻辑与 usage_exporter.py 的计费统计共用
+from usage_exporter import cached_tokens_from_response
+
+# 加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+DeepSeek 会缓存请求的公共前缀：命中缓存的输入 token 价格低得多，首 token 也更快。
+但 dynamic_system_prompt.py 把随上下文变化的指令放在系统提示里，也就是请求的最前面，
+每换一种风格，整个请求从第一个 token 开始就不同了，历史再长也无法命中缓存。
+
+PrefixCacheLayout 通过 RunConfig.call_model_input_filter 在每次调用模型之前重新排列请求：
+- 系统提示固定为不变的 static_instructions；
+- Agent 动态生成的指令不再放在开头，而是作为一条 system 消息放在所有历史之后；
+- 历史中的工具调用参数按键排序、紧凑格式重新序列化，同样的内容总是得到同样的文本；
+- stable_tools() 按名称对工具排序，工具定义的顺序不随注册顺序变化。
+这样本次请求的前缀（系统提示 + 工具 + 之前的历史）与上一次请求完全一致。
+
+PrefixCacheHooks 在每次 LLM 调用结束时读取缓存命中的 token 数，按 Agent 统计命中率。
+DeepSeek 在 usage 中返回 prompt_cache_hit_tokens，需要 ModelSettings(preserve_raw_usage=True)
+才能拿到原始 usage；OpenAI 风格的 prompt_tokens_details.cached_tokens 也会被读取。
+
+使用方式：
+python basic/prefix_cache_layout.py                    # 使用缓存友好的请求布局，打印每轮的命中情况
+python basic/prefix_cache_layout.py --layout default   # 使用默认布局（动态指令放在系统提示中）对比
+python basic/prefix_cache_layout.py --simulate         # 不调用模型，比较两种布局下相邻请求的公共前缀长度
+"""
+
+
+def canonical_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def _canonical_item(item: TResponseInputItem) -> TResponseInputItem:
+    if item.get("type") != "function_call":
+        return item
+    try:
+        arguments = canonical_json(json.loads(item.get("arguments") or "{}"))
+    except json.JSONDecodeError:
+        return item
+    if arguments == item.get("arguments"):
+        return item
+    return {**item, "arguments": arguments}
+
+
+def stable_tools(agent: Agent) -> Agent:
+    """返回按名称排序工具后的 Agent 副本。"""
+    return agent.clone(tools=sorted(agent.tools, key=lambda tool: tool.name))
+
+
+class PrefixCacheLayout:
+    def __init__(self, static_instructions: str, dynamic_role: Literal["system", "developer"] = "system"):
+        self.static_instructions = static_instructions
+        self.dynamic_role = dynamic_role
+
+    def call_model_input_filter(self, data: CallModelData[Any]) -> ModelInputData:
+        items = [_canonical_item(item) for item in data.model_data.input]
+        dynamic = data.model_data.instructions
+        if dynamic and dynamic != self.static_instructions:
+            # 动态部分放在最后，只影响请求末尾，不破坏前面的公共前缀
+            items.append({"role": self.dynamic_role, "content": dynamic})
+        return ModelInputData(input=items, instructions=self.static_instructions)
+
+    def run_config(self, model_settings: ModelSettings | None = None, **kwargs: Any) -> RunConfig:
+        """带有本布局与 preserve_raw_usage 的 RunConfig，其余参数与 RunConfig 相同。
+
+        传入的 model_settings 会与 preserve_raw_usage=True 合并。
+        """
+        settings = (model_settings or ModelSettings()).resolve(ModelSettings(preserve_raw_usage=True))
+        return RunConfig(
+            call_model_input_filter=self.call_model_input_filter,
+            model_settings=settings,
+            **kwargs,
+        )
+
+
+@dataclass
+class CacheStats:
+    requests: int = 0
+    input_tokens: int = 0
+    cached_tokens: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.cached_tokens / self.input_tokens if self.input_tokens else 0.0
+
+
+class PrefixCacheHooks(RunHooks):
+    """按 Agent 统计缓存命中的输入 token。"""
+
+    def __init__(self, verbose: bool = False):
+        self.by_agent: dict[str, CacheStats] = {}
+        self.verbose = verbose
+
+    async def on_llm_end(self, context: RunContextWrapper, agent: Agent, response: ModelResponse) -> None:
+        cached = cached_tokens_from_response(response)
+        stats = self.by_agent.setdefault(agent.name, CacheStats())
+        stats.requests += 1
+        stats.input_tokens += response.usage.input_tokens
+        stats.cached_tokens += cached
+        if self.verbose:
+            print(f"[cache] {agent.name}: 输入 {response.usage.input_tokens} token，命中缓存 {cached} token")
+
+    def summary(self) -> dict[str, dict[str, Any]]:
+        return {
+            name: {
+                "requests": stats.requests,
+                "input_tokens": stats.input_tokens,
+                "cached_tokens": stats.cached_tokens,
+                "hit_rate": round(stats.hit_rate, 4),
+            }
+            for name, stats in self.by_agent.items()
+        }
+
+
+class CustomContext:
+    """与 dynamic_system_prompt.py 相同：style 决定回复风格。"""
+
+    def __init__(self, style: Literal["haiku", "pirate", "robot"]):
+        self.style = style
+
+
+STATIC_INSTRUCTIONS = "你是一个幽默的聊天助手，回答要简短。需要随机数时调用 random_number 工具。"
+
+STYLE_INSTRUCTIONS = {
+    "haiku": "请使用俳句（haiku）的形式进行回复。",
+    "pirate": "请使用海盗（pirate）的口吻进行回复。",
+    "robot": "请使用机器人（robot）的口吻进行回复，并经常说“beep boop”。",
+}
+
+
+def custom_instructions(run_context: RunContextWrapper[CustomContext], agent: Agent[CustomContext]) -> str:
+    return f"{STATIC_INSTRUCTIONS}\n{STYLE_INSTRUCTIONS[run_context.context.style]}"
+
+
+def style_only_instructions(run_context: RunContextWrapper[CustomContext], agent: Agent[CustomContext]) -> str:
+    # 使用 PrefixCacheLayout 时，静态部分已经在系统提示里，动态指令只需要包含变化的部分
+    return STYLE_INSTRUCTIONS[run_context.context.style]
+
+
+@function_tool
+def random_number(max: int) -> int:
+    """
+    返回 0 到 max 之间的随机整数。
+    """
+    return random.randint(0, max)
+
+
+def simulate(turns: int = 6) -> None:
+    """不调用模型：按两种布局构造多轮请求，比较相邻两次请求序列化后的公共前缀。"""
+    styles = ["haiku", "pirate", "robot"]
+    layout = PrefixCacheLayout(STATIC_INSTRUCTIONS)
+    agent = Agent(name="聊天代理", instructions=style_only_instructions)
+
+    def serialize(instructions: str | None, items: list[TResponseInputItem]) -> str:
+        return canonical_json([{"role": "system", "content": instructions}, *items])
+
+    for label in ("default", "cache"):
+        history: list[TResponseInputItem] = []
+        previous = ""
+        ratios = []
+        for turn in range(turns):
+            style = styles[turn % len(styles)]
+            history.append({"role": "user", "content": f"第 {turn} 个问题：给我讲个笑话吧。"})
+            if label == "default":
+                request = serialize(f"{STATIC_INSTRUCTIONS}\n{STYLE_INSTRUCTIONS[style]}", history)
+            else:
+                data = CallModelData(
+                    model_data=ModelInputData(input=list(history), instructions=STYLE_INSTRUCTIONS[style]),
+                    agent=agent,
+                    context=CustomContext(style),
+                )
+                filtered = layout.call_model_input_filter(data)
+                request = serialize(filtered.instructions, filtered.input)
+            if previous:
+                shared = len(os.path.commonprefix([previous, request]))
+                ratios.append(shared / len(request))
+            previous = request
+            history.append({"role": "assistant", "content": f"第 {turn} 个笑话。" * 10})
+        print(f"{label:>7} 布局：相邻请求的公共前缀平均占 {sum(ratios) / len(ratios):.1%}")
+
+
+async def main(layout_name: str):
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
+    set_tracing_disabled(disabled=True)
+
+    hooks = PrefixCacheHooks(verbose=True)
+    if layout_name == "cache":
+        agent = stable_tools(Agent(
+            name="聊天代理",
+            instructions=style_only_instructions,
+            tools=[random_number],
+            model=MODEL_NAME,
+        ))
+        run_config = PrefixCacheLayout(STATIC_INSTRUCTIONS).run_config()
+    else:
+        agent = Agent(
+            name="聊天代理",
+            instructions=custom_instructions,
+            tools=[random_number],
+            model=MODEL_NAME,
+            model_settings=ModelSettings(preserve_raw_usage=True),
+        )
+        run_config = None
+
+    history: list[TResponseInputItem] = []
+    for turn, style in enumerate(["haiku", "pirate", "robot", "haiku"], start=1):
+        history.append({"role": "user", "content": f"给我讲第 {turn} 个笑话吧，笑话里要有一个随机数。"})
+        result = await Runner.run(
+            agent, history, context=CustomContext(style), hooks=hooks, run_config=run_config
+        )
+        print(f"第 {turn} 轮（{style}）: {result.final_output}\n")
+        history = result.to_input_list()
+
+    print(json.dumps(hooks.summary(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layout", choices=["cache", "default"], default="cache", help="请求布局。")
+    parser.add_argument("--simulate", action="store_true", help="不调用模型，比较两种布局的公共前缀长度。")
+    args = parser.parse_args()
+    if args.simulate:
+        simulate()
+    else:
+        asyncio.run(main(args.layout))
@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from openai.types.responses import (
+    ResponseCreatedEvent,
+    ResponseFunctionCallArgumentsDeltaEvent,
+    ResponseOutputItemAddedEvent,
+)
+from pydantic import ValidationError
+
+# 从 agents 包中导入所需的类和函数
+from agents import (
+    Agent,
+    FunctionTool,
+    ItemHelpers,
+    Runner,
+    StreamEvent,
+    function_tool,
+    set_default_openai_client,
+    set_default_openai_api,
+    set_tracing_disabled,
+)
+from agents.function_schema import FuncSchema, function_schema
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# 加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+在 stream_items.py 中，工具要等整个模型响应结束、tool_call_item 到达之后才会执行。
+
+本示例在流式消费循环里增量解析工具调用参数：
+- IncrementalJSONObject 逐段接收参数增量，在顶层 JSON 对象闭合的那一刻给出信号；
+- 对于标记为"安全"的工具（只读、幂等、没有副作用），参数一完整就立即在后台开始执行；
+- 等 runner 在响应结束后真正调用该工具时，直接复用已经在执行（或已经完成）的结果；
+- 每次复用都会记录节省的时间：原本的结束时间 - 实际的结束时间。
+
+安全工具必须是不接收 context 参数的普通函数。提前执行前用与 function_tool 相同的参数 schema 校验、转换参数，
+与 SDK 正常调用时传给工具的参数完全一致；参数不合法时不提前执行，提前执行失败时退回到正常调用。
+
+使用方式：
+python basic/speculative_tools.py
+"""
+
+
+class IncrementalJSONObject:
+    """跟踪括号深度和字符串状态，判断一个 JSON 对象是否已经完整。"""
+
+    def __init__(self):
+        self.parts: list[str] = []
+        self.depth = 0
+        self.started = False
+        self.complete = False
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, delta: str) -> bool:
+        if self.complete:
+            return True
+        self.parts.append(delta)
+        for char in delta:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self.depth += 1
+                self.started = True
+            elif char in "}]":
+                self.depth -= 1
+                if self.started and self.depth == 0:
+                    self.complete = True
+                    break
+        return self.complete
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+class _Speculation:
+    """一次提前执行：校验后的调用参数、开始时间、后台任务，以及工具实际执行的耗时。"""
+
+    __slots__ = ("arguments", "args", "kwargs", "started", "task", "duration")
+
+    def __init__(self, arguments: str, args: list[Any], kwargs: dict[str, Any], task: asyncio.Task):
+        self.arguments = arguments
+        self.args = args
+        self.kwargs = kwargs
+        self.started = time.perf_counter()
+        self.task = task
+        self.duration: float | None = None
+
+    def matches(self, args: Any, kwargs: dict[str, Any]) -> bool:
+        return list(args) == self.args and kwargs == self.kwargs
+
+
+class SpeculativeToolExecutor:
+    def __init__(self):
+        self.savings: list[dict[str, Any]] = []
+        # 工具名 -> (原函数, 参数 schema)；参数用与 function_tool 相同的 schema 校验和转换
+        self._functions: dict[str, tuple[Callable[..., Any], FuncSchema]] = {}
+        # output_index -> (工具名, 参数解析器)，每个模型响应开始时清空
+        self._streaming: dict[int, tuple[str, IncrementalJSONObject]] = {}
+        # 工具名 -> 已经开始、还没有被 runner 用到的提前执行
+        self._started: dict[str, list[_Speculation]] = {}
+        # 同步工具由 SDK 放到线程里执行，取用提前执行的结果时需要加锁
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def safe_tool(self, func: Callable[..., Any]) -> FunctionTool:
+        """与 function_tool 相同，但把工具登记为可以提前执行的安全工具。
+
+        交给 function_tool 的是一个签名相同的包装函数：参数校验、failure_error_function、
+        同步工具放到线程执行等仍由 SDK 完成，包装函数只在参数与提前执行的一致时复用其结果。
+        """
+        name = func.__name__
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                invoked = time.perf_counter()
+                speculation = self._take(name, args, kwargs)
+                if speculation is None:
+                    return await func(*args, **kwargs)
+                try:
+                    result = await speculation.task
+                except Exception:
+                    # 提前执行失败，退回正常调用，出错时由 SDK 按 failure_error_function 处理
+                    return await func(*args, **kwargs)
+                self._record_saving(name, speculation, invoked)
+                return result
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                # SDK 在线程中调用同步工具，这里阻塞等待事件循环中的提前执行任务
+                invoked = time.perf_counter()
+                speculation = self._take(name, args, kwargs)
+                if speculation is None:
+                    return func(*args, **kwargs)
+                try:
+                    result = asyncio.run_coroutine_threadsafe(_wait(speculation.task), self._loop).result()
+                except Exception:
+                    return func(*args, **kwargs)
+                self._record_saving(name, speculation, invoked)
+                return result
+
+        tool = function_tool(wrapper)
+        self._functions[tool.name] = (func, function_schema(func))
+        return tool
+
+    def _take(self, name: str, args: Any, kwargs: dict[str, Any]) -> _Speculation | None:
+        with self._lock:
+            started = self._started.get(name, [])
+            for i, speculation in enumerate(started):
+                if speculation.matches(args, kwargs):
+                    return started.pop(i)
+        return None
+
+    def _record_saving(self, name: str, speculation: _Speculation, invoked: float) -> None:
+        finished = time.perf_counter()
+        duration = speculation.duration if speculation.duration is not None else finished - speculation.started
+        # 不提前执行时，工具会在 invoked 开始、invoked + duration 结束
+        saved = (invoked + duration) - max(invoked, finished)
+        self.savings.append({"tool": name, "arguments": speculation.arguments, "saved_ms": round(saved * 1000, 3)})
+
+    def _start(self, name: str, arguments: str) -> None:
+        func, schema = self._functions[name]
+        try:
+            data = json.loads(arguments or "{}")
+            parsed = schema.params_pydantic_model(**data) if data else schema.params_pydantic_model()
+        except (json.JSONDecodeError, TypeError, ValidationError):
+            # 参数不合法时不提前执行，由 SDK 在正常调用时报错
+            return
+        args, kwargs = schema.to_call_args(parsed)
+        with self._lock:
+            if any(speculation.matches(args, kwargs) for speculation in self._started.get(name, [])):
+                return
+
+        async def _run() -> Any:
+            began = time.perf_counter()
+            try:
+                if inspect.iscoroutinefunction(func):
+                    return await func(*args, **kwargs)
+                return await asyncio.to_thread(func, *args, **kwargs)
+            finally:
+                speculation.duration = time.perf_counter() - began
+
+        self._loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(_run())
+        # 结果若最终没有被使用，避免出现 "exception was never retrieved" 警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        speculation = _Speculation(arguments, args, kwargs, task)
+        with self._lock:
+            self._started.setdefault(name, []).append(speculation)
+
+    def observe(self, event: StreamEvent) -> None:
+        """在 stream_events() 循环里对每个事件调用一次。"""
+        if event.type != "raw_response_event":
+            return
+        data = event.data
+        if isinstance(data, ResponseCreatedEvent):
+            self._streaming.clear()
+        elif isinstance(data, ResponseOutputItemAddedEvent) and data.item.type == "function_call":
+            if data.item.name in self._functions:
+                parser = IncrementalJSONObject()
+                self._streaming[data.output_index] = (data.item.name, parser)
+                if data.item.arguments and parser.feed(data.item.arguments):
+                    self._start(data.item.name, parser.text)
+        elif isinstance(data, ResponseFunctionCallArgumentsDeltaEvent):
+            streaming = self._streaming.get(data.output_index)
+            if streaming is None:
+                return
+            name, parser = streaming
+            if not parser.complete and parser.feed(data.delta):
+                self._start(name, parser.text)
+
+    def discard_unused(self) -> None:
+        """取消没有被 runner 用到的提前执行任务。"""
+        with self._lock:
+            for started in self._started.values():
+                for speculation in started:
+                    speculation.task.cancel()
+            self._started.clear()
+
+
+async def _wait(task: asyncio.Task) -> Any:
+    return await task
+
+
+speculative = SpeculativeToolExecutor()
+
+
+@speculative.safe_tool
+async def get_weather(city: str) -> str:
+    """
+    查询城市天气（模拟一次耗时 1 秒的只读外部接口调用）。
+    """
+    await asyncio.sleep(1.0)
+    return f"{city}：晴，18-25°C"
+
+
+async def main():
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
+    set_tracing_disabled(disabled=True)
+
+    agent = Agent(
+        name="天气助手",
+        instructions="对用户提到的每个城市分别调用 get_weather 工具，然后汇总回答。",
+        tools=[get_weather],
+        model=MODEL_NAME,
+    )
+
+    result = Runner.run_streamed(agent, input="北京、上海、广州今天天气怎么样？")
+
+    print("=== Run starting ===")
+    async for event in result.stream_events():
+        # 观察原始增量事件，参数一完整就提前执行安全工具
+        speculative.observe(event)
+        if event.type == "run_item_stream_event":
+            if event.item.type == "tool_call_item":
+                print("-- Tool was called")
+            elif event.item.type == "tool_call_output_item":
+                print(f"-- Tool output: {event.item.output}")
+            elif event.item.type == "message_output_item":
+                print(f"-- Message output:\n {ItemHelpers.text_message_output(event.item)}")
+    speculative.discard_unused()
+    print("=== Run complete ===")
+
+    for saving in speculative.savings:
+        print(f"{saving['tool']}({saving['arguments']}) 节省 {saving['saved_ms']} ms")
+
+
+if __name__ == "__main__":
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main())
@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import random
+from pathlib import Path
+from typing import Any
+
+# ResponseTextDeltaEvent 代表的是流式返回的文本增量事件
+from openai.types.responses import ResponseTextDeltaEvent
+
+# 从 agents 包中导入所需的类和函数
+from agents import (
+    Agent,
+    ItemHelpers,
+    RunResultStreaming,
+    Runner,
+    StreamEvent,
+    function_tool,
+    set_default_openai_client,
+    set_default_openai_api,
+    set_tracing_disabled,
+)
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# 加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+stream_items.py 在本地用一个循环消费 stream_events()。部署时往往需要把同一次 run 的事件
+同时推送给多个监听者（界面、日志、审计）。
+
+本示例用 asyncio 实现了一个本地 SSE（Server-Sent Events）服务：
+- 每个事件只序列化一次，得到的字节帧被所有订阅者共享；
+- 每个订阅者有自己的有界队列，队列满说明消费太慢，直接断开该订阅者，不拖慢其他人；
+- run 结束时向所有订阅者发送 done 事件。
+
+只依赖标准库，因此使用 SSE 而不是 WebSocket；浏览器可直接用 EventSource 订阅。
+
+使用方式：
+python basic/stream_fanout_server.py --port 8765
+curl -N http://127.0.0.1:8765/events     # 在其他终端中订阅，可以开多个
+"""
+
+
+def serialize_event(event: StreamEvent) -> bytes | None:
+    """把流式事件转换为一帧 SSE 数据；不需要转发的事件返回 None。"""
+    if event.type == "raw_response_event":
+        if not isinstance(event.data, ResponseTextDeltaEvent):
+            return None
+        name, payload = "text_delta", {"delta": event.data.delta}
+    elif event.type == "agent_updated_stream_event":
+        name, payload = "agent_updated", {"agent": event.new_agent.name}
+    elif event.type == "run_item_stream_event":
+        name = event.name
+        payload = {"item_type": event.item.type}
+        if event.item.type == "tool_call_output_item":
+            payload["output"] = event.item.output
+        elif event.item.type == "message_output_item":
+            payload["text"] = ItemHelpers.text_message_output(event.item)
+    else:
+        return None
+    data = json.dumps(payload, ensure_ascii=False, default=str)
+    return f"event: {name}\ndata: {data}\n\n".encode("utf-8")
+
+
+class Subscriber:
+    def __init__(self, subscriber_id: int, max_queue: int):
+        self.id = subscriber_id
+        self.queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=max_queue)
+        self.sent = 0
+        self.disconnected = False
+
+
+class RunBroadcaster:
+    """把一次 run 的事件扇出给多个订阅者。"""
+
+    def __init__(self, max_queue: int = 1024):
+        self.max_queue = max_queue
+        self.subscribers: dict[int, Subscriber] = {}
+        self.serialized = 0
+        self.slow_consumers_dropped = 0
+        self.finished = False
+        self._ids = itertools.count(1)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(next(self._ids), self.max_queue)
+        if self.finished:
+            subscriber.queue.put_nowait(b"event: done\ndata: {}\n\n")
+            subscriber.queue.put_nowait(None)
+        else:
+            self.subscribers[subscriber.id] = subscriber
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.pop(subscriber.id, None)
+
+    def _drop(self, subscriber: Subscriber) -> None:
+        # 慢消费者：清空它的队列并放入结束标记，由它自己的连接协程关闭连接
+        self.slow_consumers_dropped += 1
+        subscriber.disconnected = True
+        self.unsubscribe(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    def publish_frame(self, frame: bytes) -> None:
+        for subscriber in list(self.subscribers.values()):
+            try:
+                subscriber.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+    def publish(self, event: StreamEvent) -> None:
+        frame = serialize_event(event)
+        if frame is None:
+            return
+        self.serialized += 1
+        self.publish_frame(frame)
+
+    def close(self) -> None:
+        self.publish_frame(b"event: done\ndata: {}\n\n")
+        self.finished = True
+        for subscriber in list(self.subscribers.values()):
+            try:
+                subscriber.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+        self.subscribers.clear()
+
+    async def pump(self, result: RunResultStreaming) -> None:
+        """消费一次 run 的全部事件并广播出去。"""
+        try:
+            async for event in result.stream_events():
+                self.publish(event)
+        finally:
+            self.close()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        parts = request.decode("latin-1").split(" ", 2)
+        path = parts[1] if len(parts) > 1 else "/"
+        if path.split("?", 1)[0] != "/events":
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            writer.close()
+            return
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n"
+        )
+        subscriber = self.subscribe()
+        try:
+            while True:
+                frame = await subscriber.queue.get()
+                if frame is None:
+                    break
+                writer.write(frame)
+                await writer.drain()
+                subscriber.sent += 1
+        except ConnectionError:
+            pass
+        finally:
+            self.unsubscribe(subscriber)
+            writer.close()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "subscribers": len(self.subscribers),
+            "serialized_events": self.serialized,
+            "slow_consumers_dropped": self.slow_consumers_dropped,
+        }
+
+
+@function_tool
+def how_many_jokes() -> int:
+    """
+    返回一个随机整数，表示要讲多少个笑话。
+    """
+    return random.randint(1, 10)
+
+
+async def main(port: int):
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
+    set_tracing_disabled(disabled=True)
+
+    agent = Agent(
+        name="Joker",
+        instructions="First call the `how_many_jokes` tool, then tell that many jokes.",
+        tools=[how_many_jokes],
+        model=MODEL_NAME,
+    )
+
+    broadcaster = RunBroadcaster()
+    server = await asyncio.start_server(broadcaster.handle_connection, "127.0.0.1", port)
+    print(f"订阅地址：http://127.0.0.1:{port}/events")
+    await asyncio.to_thread(input, "订阅者连接好后按回车键开始运行...")
+
+    result = Runner.run_streamed(agent, input="Hello")
+    await broadcaster.pump(result)
+    print(f"=== Run complete === {broadcaster.stats()}")
+
+    # 留一点时间让订阅者收完最后的数据
+    await asyncio.sleep(1)
+    server.close()
+    await server.wait_closed()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765, help="SSE 服务监听的本地端口。")
+    args = parser.parse_args()
+    asyncio.run(main(args.port))
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+# ResponseTextDeltaEvent 代表的是流式返回的文本增量事件
+from openai.types.responses import ResponseCompletedEvent, ResponseCreatedEvent, ResponseTextDeltaEvent
+
+# 从 agents 包中导入所需的类和函数
+from agents import (
+    Agent,
+    ItemHelpers,
+    RunResultStreaming,
+    Runner,
+    StreamEvent,
+    function_tool,
+    set_default_openai_client,
+    set_default_openai_api,
+    set_tracing_disabled,
+)
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# 复用 latency_hooks.py 中的固定内存直方图来统计 token 间隔
+from latency_hooks import LatencyHistogram
+
+# 加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+stream_text.py 和 stream_items.py 只处理流式事件，没有任何时间数据。
+
+本示例提供 run_streamed_timed()：它包装 Runner.run_streamed，在转发事件的同时记录
+- 首 token 时间（TTFT）：从发起 run 到第一个文本增量；
+- token 间隔分布：同一次模型响应中相邻两个文本增量之间的间隔（p50 / p90 / p99 / 最大值），
+  每个 response.created 事件都会重新开始计算，不会把两次模型调用之间的工具执行时间算成间隔；
+- 每秒 token 数：只统计输出了文本的模型响应，用它们 Usage 中的 output_tokens（没有时按增量个数估算）
+  除以这些响应各自从第一个到最后一个文本增量的时间之和；只调用工具、没有文本的响应不计入；
+- 每个 run_item_stream_event（工具调用、工具输出、消息输出等）相对开始时间的偏移；
+- 整个 run 的总耗时。
+
+使用方式：
+python basic/stream_timing.py --timing              # 运行结束后打印统计
+python basic/stream_timing.py --timing-output t.json # 把统计保存为 JSON
+"""
+
+
+@dataclass
+class StreamTiming:
+    started: float
+    first_token_at: float | None = None
+    last_token_at: float | None = None
+    finished: float | None = None
+    text_deltas: int = 0
+    # 整个 run 的 output_tokens，包含只调用工具的模型响应
+    output_tokens: int = 0
+    # 输出了文本的模型响应的 output_tokens 之和，以及这些响应生成文本所用的时间之和
+    text_output_tokens: int = 0
+    text_generation_seconds: float = 0.0
+    gaps: LatencyHistogram = field(default_factory=LatencyHistogram)
+    items: list[dict[str, Any]] = field(default_factory=list)
+    # 当前模型响应中第一个与上一个文本增量的时间、文本增量个数
+    _response_first: float | None = field(default=None, init=False, repr=False)
+    _response_last: float | None = field(default=None, init=False, repr=False)
+    _response_deltas: int = field(default=0, init=False, repr=False)
+
+    def _finish_response(self, output_tokens: int | None) -> None:
+        if self._response_deltas:
+            self.text_output_tokens += output_tokens or self._response_deltas
+            self.text_generation_seconds += self._response_last - self._response_first
+        self._response_first = self._response_last = None
+        self._response_deltas = 0
+
+    def on_event(self, event: StreamEvent, now: float) -> None:
+        if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+            if self.first_token_at is None:
+                self.first_token_at = now
+            if self._response_last is not None:
+                self.gaps.record(int((now - self._response_last) * 1_000_000))
+            else:
+                self._response_first = now
+            self._response_last = self.last_token_at = now
+            self._response_deltas += 1
+            self.text_deltas += 1
+        elif event.type == "raw_response_event" and isinstance(event.data, ResponseCreatedEvent):
+            # 新的一次模型调用：之前的间隔里包含工具执行，不计入
+            self._finish_response(None)
+        elif event.type == "raw_response_event" and isinstance(event.data, ResponseCompletedEvent):
+            usage = event.data.response.usage
+            self._finish_response(usage.output_tokens if usage is not None else None)
+        elif event.type == "run_item_stream_event":
+            self.items.append({
+                "name": event.name,
+                "type": event.item.type,
+                "at_ms": round((now - self.started) * 1000, 3),
+            })
+        elif event.type == "agent_updated_stream_event":
+            self.items.append({
+                "name": "agent_updated",
+                "agent": event.new_agent.name,
+                "at_ms": round((now - self.started) * 1000, 3),
+            })
+
+    def summary(self) -> dict[str, Any]:
+        total = (self.finished or time.perf_counter()) - self.started
+        generation = self.text_generation_seconds
+        tokens = self.text_output_tokens
+        if self._response_deltas:
+            # 还没有收到 response.completed 的响应（仍在输出，或流被取消）按增量个数计入；
+            # 只在局部变量里累加，run 进行中调用 summary() 汇报进度不会影响后续统计
+            tokens += self._response_deltas
+            generation += self._response_last - self._response_first
+        return {
+            "ttft_ms": round((self.first_token_at - self.started) * 1000, 3)
+            if self.first_token_at is not None
+            else None,
+            "total_ms": round(total * 1000, 3),
+            "text_deltas": self.text_deltas,
+            "output_tokens": self.output_tokens,
+            "text_output_tokens": tokens,
+            "tokens_per_second": round(tokens / generation, 2) if generation > 0 else None,
+            "inter_token_gap": self.gaps.summary(),
+            "items": self.items,
+        }
+
+
+class TimedRun:
+    """包装 RunResultStreaming：迭代 stream_events() 时顺带记录时间数据。"""
+
+    def __init__(self, result: RunResultStreaming, started: float):
+        self.result = result
+        self.timing = StreamTiming(started=started)
+
+    async def stream_events(self) -> AsyncIterator[StreamEvent]:
+        try:
+            async for event in self.result.stream_events():
+                self.timing.on_event(event, time.perf_counter())
+                yield event
+        finally:
+            self.timing.finished = time.perf_counter()
+            self.timing.output_tokens = self.result.context_wrapper.usage.output_tokens
+
+
+def run_streamed_timed(agent: Agent, input: Any, **kwargs: Any) -> TimedRun:
+    """与 Runner.run_streamed 参数相同，返回带计时的 TimedRun。"""
+    started = time.perf_counter()
+    return TimedRun(Runner.run_streamed(agent, input, **kwargs), started)
+
+
+@function_tool
+def how_many_jokes() -> int:
+    """
+    返回一个随机整数，表示要讲多少个笑话。
+    """
+    return random.randint(1, 10)
+
+
+async def main(show_timing: bool, timing_output: str | None):
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
+    set_tracing_disabled(disabled=True)
+
+    agent = Agent(
+        name="Joker",
+        instructions="First call the `how_many_jokes` tool, then tell that many jokes.",
+        tools=[how_many_jokes],
+        model=MODEL_NAME,
+    )
+
+    run = run_streamed_timed(agent, input="Hello")
+
+    print("=== Run starting ===")
+    async for event in run.stream_events():
+        if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+            print(event.data.delta, end="", flush=True)
+        elif event.type == "run_item_stream_event":
+            if event.item.type == "tool_call_item":
+                print("-- Tool was called")
+            elif event.item.type == "tool_call_output_item":
+                print(f"-- Tool output: {event.item.output}")
+            elif event.item.type == "message_output_item":
+                print(f"\n-- Message output:\n {ItemHelpers.text_message_output(event.item)}")
+    print("=== Run complete ===")
+
+    summary = run.timing.summary()
+    if show_timing:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if timing_output:
+        with open(timing_output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"统计已保存到 {timing_output}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--timing", action="store_true", help="运行结束后打印 TTFT、token 间隔等统计。")
+    parser.add_argument("--timing-output", help="把统计保存为 JSON 文件。")
+    args = parser.parse_args()
+    asyncio.run(main(args.timing, args.timing_output))
@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# 从 agents 包中导入所需的类和函数
+from agents import (
+    Agent,
+    ModelResponse,
+    RunContextWrapper,
+    RunHooks,
+    Runner,
+    function_tool,
+    set_default_openai_client,
+    set_default_openai_api,
+    set_tracing_disabled,
+)
+
+# 加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+本示例把 runner_hook.py 中打印出来的 Usage 变成可用于容量规划的指标。
+
+- UsageAccountingHooks 在每次 LLM 调用结束（on_llm_end）时读取该次请求的 Usage，
+  按 Agent、按模型累计请求数、输入/缓存命中/输出 token、模型耗时和估算费用，
+  并按 run 统计整次运行的 token 与耗时。
+- 价格表可通过 --prices 指定 JSON 文件覆盖，单位是每百万 token 的美元价格。
+- 指标可写入 Prometheus textfile（供 node_exporter 的 textfile collector 采集），
+  也可以在本地启动一个 /metrics 端点（Prometheus 文本格式或 OpenMetrics 格式）。
+
+使用方式：
+python basic/usage_exporter.py --textfile usage.prom
+python basic/usage_exporter.py --serve 9464 --prices prices.json
+"""
+
+# 示例价格（美元 / 百万 token），实际价格请以各家官方为准
+DEFAULT_PRICE_TABLE: dict[str, dict[str, float]] = {
+    "deepseek-chat": {"input": 0.27, "cached_input": 0.07, "output": 1.10},
+    "deepseek-reasoner": {"input": 0.55, "cached_input": 0.14, "output": 2.19},
+}
+
+
+def cached_tokens_from_response(response: ModelResponse) -> int:
+    """读取一次模型响应中命中缓存的输入 token 数。"""
+    details = getattr(response.usage, "input_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) or 0
+    raw_usage = getattr(response, "raw_usage", None) or {}
+    # DeepSeek 使用 prompt_cache_hit_tokens 字段，需要 ModelSettings(preserve_raw_usage=True)
+    return max(cached, raw_usage.get("prompt_cache_hit_tokens", 0) or 0)
+
+
+@dataclass
+class UsageTotals:
+    requests: int = 0
+    input_tokens: int = 0
+    cached_input_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+    llm_seconds: float = 0.0
+    cost_usd: float = 0.0
+
+    def add(self, other: UsageTotals) -> None:
+        self.requests += other.requests
+        self.input_tokens += other.input_tokens
+        self.cached_input_tokens += other.cached_input_tokens
+        self.output_tokens += other.output_tokens
+        self.total_tokens += other.total_tokens
+        self.llm_seconds += other.llm_seconds
+        self.cost_usd += other.cost_usd
+
+    @property
+    def output_tokens_per_second(self) -> float:
+        return self.output_tokens / self.llm_seconds if self.llm_seconds else 0.0
+
+
+@dataclass
+class RunRecord:
+    started_at: float
+    duration: float
+    totals: UsageTotals
+
+
+class UsageAccountingHooks(RunHooks):
+    """
+    按 Agent / 模型 / run 三个维度累计 token 用量与费用的 RunHooks。
+
+    同一次 run 中的所有 hook 上下文共享同一个 Usage 对象，因此用 id(context.usage) 作为 run 的标识。
+    """
+
+    def __init__(
+        self,
+        price_table: dict[str, dict[str, float]] | None = None,
+        default_model: str = MODEL_NAME,
+        keep_runs: int = 1000,
+    ):
+        self.price_table = price_table if price_table is not None else DEFAULT_PRICE_TABLE
+        self.default_model = default_model
+        self.by_agent_model: dict[tuple[str, str], UsageTotals] = {}
+        self.runs_total = 0
+        self.run_seconds_total = 0.0
+        # 只保留最近 keep_runs 次运行的明细，避免内存无限增长
+        self.recent_runs: deque[RunRecord] = deque(maxlen=keep_runs)
+        self.keep_runs = keep_runs
+        self._active_runs: OrderedDict[int, tuple[float, float, UsageTotals]] = OrderedDict()
+        self._llm_started: dict[tuple[int, str], float] = {}
+        self._export_task: asyncio.Task | None = None
+
+    def _model_name(self, agent: Agent) -> str:
+        model = agent.model
+        if isinstance(model, str):
+            return model
+        return getattr(model, "model", None) or self.default_model
+
+    def estimate_cost(self, model: str, input_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+        prices = self.price_table.get(model)
+        if prices is None:
+            return 0.0
+        uncached = input_tokens - cached_tokens
+        cached_price = prices.get("cached_input", prices.get("input", 0.0))
+        return (
+            uncached * prices.get("input", 0.0)
+            + cached_tokens * cached_price
+            + output_tokens * prices.get("output", 0.0)
+        ) / 1_000_000
+
+    async def on_agent_start(self, context: RunContextWrapper, agent: Agent) -> None:
+        run_key = id(context.usage)
+        if run_key not in self._active_runs:
+            self._active_runs[run_key] = (time.time(), time.monotonic(), UsageTotals())
+            # 出错中断的 run 不会触发 on_agent_end，超出上限时丢弃最早的记录
+            while len(self._active_runs) > self.keep_runs:
+                self._active_runs.popitem(last=False)
+
+    async def on_agent_end(self, context: RunContextWrapper, agent: Agent, output: Any) -> None:
+        active = self._active_runs.pop(id(context.usage), None)
+        if active is None:
+            return
+        started_at, started, totals = active
+        duration = time.monotonic() - started
+        self.runs_total += 1
+        self.run_seconds_total += duration
+        self.recent_runs.append(RunRecord(started_at=started_at, duration=duration, totals=totals))
+
+    async def on_llm_start(
+        self, context: RunContextWrapper, agent: Agent, system_prompt: str | None, input_items: list
+    ) -> None:
+        self._llm_started[(id(context.usage), agent.name)] = time.monotonic()
+
+    async def on_llm_end(
+        self, context: RunContextWrapper, agent: Agent, response: ModelResponse
+    ) -> None:
+        run_key = id(context.usage)
+        started = self._llm_started.pop((run_key, agent.name), None)
+        usage = response.usage
+        model = self._model_name(agent)
+        cached = cached_tokens_from_response(response)
+
+        delta = UsageTotals(
+            requests=usage.requests or 1,
+            input_tokens=usage.input_tokens,
+            cached_input_tokens=cached,
+            output_tokens=usage.output_tokens,
+            total_tokens=usage.total_tokens,
+            llm_seconds=time.monotonic() - started if started is not None else 0.0,
+            cost_usd=self.estimate_cost(model, usage.input_tokens, cached, usage.output_tokens),
+        )
+
+        key = (agent.name, model)
+        if key not in self.by_agent_model:
+            self.by_agent_model[key] = UsageTotals()
+        self.by_agent_model[key].add(delta)
+
+        active = self._active_runs.get(run_key)
+        if active is not None:
+            active[2].add(delta)
+
+    def by_model(self) -> dict[str, UsageTotals]:
+        result: dict[str, UsageTotals] = {}
+        for (_, model), totals in self.by_agent_model.items():
+            result.setdefault(model, UsageTotals()).add(totals)
+        return result
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "by_agent": {
+                f"{agent}|{model}": asdict(totals)
+                for (agent, model), totals in self.by_agent_model.items()
+            },
+            "by_model": {
+                model: {**asdict(totals), "output_tokens_per_second": totals.output_tokens_per_second}
+                for model, totals in self.by_model().items()
+            },
+            "runs_total": self.runs_total,
+            "recent_runs": [asdict(run) for run in list(self.recent_runs)[-10:]],
+        }
+
+    def render_prometheus(self, openmetrics: bool = False) -> str:
+        """把累计值渲染为 Prometheus 文本格式；openmetrics=True 时输出 OpenMetrics 格式。"""
+
+        def _escape(value: str) -> str:
+            return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+        # OpenMetrics 中 counter 的 family 名不带 _total 后缀，样本名带 _total
+        lines: list[str] = []
+
+        def _family(name: str, kind: str, help_text: str) -> str:
+            family = name[: -len("_total")] if openmetrics and kind == "counter" else name
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            return name
+
+        name = _family("agents_llm_requests_total", "counter", "LLM requests issued.")
+        for (agent, model), t in self.by_agent_model.items():
+            lines.append(f'{name}{{agent="{_escape(agent)}",model="{_escape(model)}"}} {t.requests}')
+
+        name = _family("agents_llm_tokens_total", "counter", "Tokens by kind.")
+        for (agent, model), t in self.by_agent_model.items():
+            labels = f'agent="{_escape(agent)}",model="{_escape(model)}"'
+            lines.append(f'{name}{{{labels},kind="input"}} {t.input_tokens}')
+            lines.append(f'{name}{{{labels},kind="cached_input"}} {t.cached_input_tokens}')
+            lines.append(f'{name}{{{labels},kind="output"}} {t.output_tokens}')
+
+        name = _family("agents_llm_seconds_total", "counter", "Time spent waiting for the model.")
+        for (agent, model), t in self.by_agent_model.items():
+            lines.append(f'{name}{{agent="{_escape(agent)}",model="{_escape(model)}"}} {t.llm_seconds:.6f}')
+
+        name = _family("agents_llm_cost_usd_total", "counter", "Estimated cost from the price table.")
+        for (agent, model), t in self.by_agent_model.items():
+            lines.append(f'{name}{{agent="{_escape(agent)}",model="{_escape(model)}"}} {t.cost_usd:.8f}')
+
+        name = _family("agents_model_output_tokens_per_second", "gauge", "Output tokens per model second.")
+        for model, t in self.by_model().items():
+            lines.append(f'{name}{{model="{_escape(model)}"}} {t.output_tokens_per_second:.3f}')
+
+        name = _family("agents_runs_total", "counter", "Completed runs.")
+        lines.append(f"{name} {self.runs_total}")
+        name = _family("agents_run_seconds_total", "counter", "Wall-clock time of completed runs.")
+        lines.append(f"{name} {self.run_seconds_total:.6f}")
+
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str | Path) -> None:
+        """原子地写入 textfile，避免采集端读到写了一半的文件。"""
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(self.render_prometheus(), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def start_textfile_export(self, path: str | Path, interval: float = 15.0) -> asyncio.Task:
+        async def _export_loop() -> None:
+            while True:
+                self.write_textfile(path)
+                await asyncio.sleep(interval)
+
+        self._export_task = asyncio.create_task(_export_loop())
+        return self._export_task
+
+    def stop_textfile_export(self) -> None:
+        if self._export_task is not None:
+            self._export_task.cancel()
+            self._export_task = None
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9464) -> asyncio.AbstractServer:
+        """在本地启动 /metrics 端点；请求头 Accept 中包含 openmetrics 时返回 OpenMetrics 格式。"""
+
+        async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                request = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                writer.close()
+                return
+            head = request.decode("latin-1")
+            path = head.split(" ", 2)[1] if head.count(" ") >= 2 else "/"
+            if path.split("?", 1)[0] != "/metrics":
+                status, content_type, body = "404 Not Found", "text/plain", b"not found\n"
+            elif "application/openmetrics-text" in head.lower():
+                status = "200 OK"
+                content_type = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+                body = self.render_prometheus(openmetrics=True).encode()
+            else:
+                status = "200 OK"
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+                body = self.render_prometheus().encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            writer.close()
+
+        return await asyncio.start_server(_handle, host, port)
+
+
+def load_price_table(path: str | None) -> dict[str, dict[str, float]]:
+    if path is None:
+        return DEFAULT_PRICE_TABLE
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@function_tool
+def random_number(max: int) -> int:
+    """
+    生成一个随机数，范围在 0 到 max 之间。
+    """
+    return random.randint(0, max)
+
+
+start_agent = Agent(
+    name="Start Agent",
+    instructions="调用 random_number 生成一个随机数，然后告诉用户这个数字是奇数还是偶数。",
+    tools=[random_number],
+    output_type=str,
+    model=MODEL_NAME,
+)
+
+
+async def main(textfile: str | None, port: int | None, prices: str | None) -> None:
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
+    set_tracing_disabled(disabled=True)
+
+    hooks = UsageAccountingHooks(price_table=load_price_table(prices))
+    server = None
+    if port is not None:
+        server = await hooks.serve(port=port)
+        print(f"指标端点：http://127.0.0.1:{port}/metrics")
+    if textfile is not None:
+        hooks.start_textfile_export(textfile)
+
+    # 并发跑几次，模拟多个用户同时使用
+    await asyncio.gather(
+        *(Runner.run(start_agent, hooks=hooks, input="生成 0 到 100 之间的随机数。") for _ in range(5))
+    )
+
+    print(hooks.render_prometheus())
+    if textfile is not None:
+        hooks.stop_textfile_export()
+        hooks.write_textfile(textfile)
+    if server is not None:
+        await asyncio.to_thread(input, "按回车键停止指标端点...")
+        server.close()
+        await server.wait_closed()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--textfile", help="写入 Prometheus textfile 的路径。")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="在本地端口上提供 /metrics。")
+    parser.add_argument("--prices", help="价格表 JSON 文件，格式同 DEFAULT_PRICE_TABLE。")
+    args = parser.parse_args()
+    asyncio.run(main(args.textfile, args.serve, args.prices))
@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import asyncio
+import operator
+import time
+import tracemalloc
+from array import array
+from collections.abc import Sequence
+from typing import Any, AsyncIterator, Iterator
+
+from agents import Agent, ItemHelpers, Model, ModelResponse, Runner, TResponseInputItem, Usage, set_tracing_disabled
+from agents.items import HandoffOutputItem
+from agents.result import RunResultBase
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseCreatedEvent,
+    ResponseOutputMessage,
+    ResponseOutputText,
+)
+
+"""
+只追加的对话记录。
+
+message_filter.py 每一步都用 result.to_input_list() + [新消息] 构造下一次的输入：
+to_input_list() 会把上一次的全部输入重新转换、复制一遍，再拼上本次新增的条目，
+整个会话的开销随轮数平方增长。
+
+ConversationLog 只保存一份记录：
+- 每条记录只追加一次，record(result) 只追加本次 run 新增的条目（result.new_items）；
+- 每一轮的起始位置保存在 array('Q') 中，便于按轮截取；
+- view() / window() 返回 InputView，只保存起止下标，不复制任何条目；
+- InputView 可以直接作为 Runner.run / Runner.run_streamed 的 input；
+  record(result) 按视图的起止下标逐条核对 result.input，只有发生移交且 input_filter 改写了历史时
+  才替换视图覆盖的那一段，用 window() 截取的输入不会让更早的记录丢失。
+  SDK 在 run 开始时仍会对 input 做一次浅复制，这一步无法在外部省掉。
+
+使用方式：
+    log = ConversationLog()
+    log.append_user("你好")
+    result = await Runner.run(agent, input=log.view())
+    log.record(result)
+
+python handoffs/conversation_log.py            # 模拟 1000 轮会话，对比维护历史的耗时
+python handoffs/conversation_log.py --memory   # 同时统计内存分配峰值
+python handoffs/conversation_log.py --runner   # 用立即返回的模拟模型真正执行 Runner.run，对比每轮的总耗时
+"""
+
+
+class InputView(Sequence):
+    """ConversationLog 中一段记录的只读视图。"""
+
+    __slots__ = ("_items", "_start", "_stop")
+
+    def __init__(self, items: list[TResponseInputItem], start: int, stop: int):
+        self._items = items
+        self._start = start
+        self._stop = stop
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return self._items[self._start : self._stop][index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("InputView index out of range")
+        return self._items[self._start + index]
+
+    def __iter__(self) -> Iterator[TResponseInputItem]:
+        items = self._items
+        for i in range(self._start, self._stop):
+            yield items[i]
+
+    def copy(self) -> list[TResponseInputItem]:
+        # Runner 在 run 开始时会调用 input.copy()
+        return self._items[self._start : self._stop]
+
+
+def _is_user_message(item: Any) -> bool:
+    return isinstance(item, dict) and item.get("role") == "user" and item.get("type", "message") == "message"
+
+
+class ConversationLog:
+    def __init__(self):
+        self._items: list[TResponseInputItem] = []
+        # 第 i 轮从 _items[_turn_offsets[i]] 开始
+        self._turn_offsets = array("Q")
+        # 最近一次 view() / window() 返回的视图，record() 省略 view 时用它核对 run 的输入
+        self._last_view: InputView | None = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[TResponseInputItem]:
+        return iter(self._items)
+
+    @property
+    def turns(self) -> int:
+        return len(self._turn_offsets)
+
+    def append(self, item: TResponseInputItem) -> None:
+        self._items.append(item)
+
+    def append_user(self, content: str) -> None:
+        """追加一条用户消息，并开始新的一轮。"""
+        self._turn_offsets.append(len(self._items))
+        self._items.append({"content": content, "role": "user"})
+
+    def record(self, result: RunResultBase, view: InputView | None = None) -> None:
+        """追加一次 run 新增的条目；view 是这次 run 的输入，省略时使用最近一次 view() / window() 返回的视图。
+
+        移交的 input_filter 改写了历史时，result.input 已经是过滤后的历史，
+        这时用 result.to_input_list() 替换视图覆盖的那一段，视图之前的记录保持不变。
+        输入既不是这个视图、也不是移交改写后的结果时抛出 ValueError，不会改动记录。
+        """
+        view = view if view is not None else self._last_view
+        if view is None or view._items is not self._items:
+            raise ValueError("run 的输入必须是本记录当前的 view() 或 window()")
+        if self._is_view_input(result.input, view):
+            for item in result.new_items:
+                self._items.append(item.to_input_item())
+            return
+        if not any(isinstance(item, HandoffOutputItem) for item in result.new_items):
+            raise ValueError("result.input 与传入的视图不一致，且这次 run 没有发生移交")
+        self._replace(self._items[: view._start] + result.to_input_list())
+
+    @staticmethod
+    def _is_view_input(run_input: str | list[TResponseInputItem], view: InputView) -> bool:
+        # SDK 只对输入做浅复制，没有被改写时每一条都与视图中的是同一个对象
+        if isinstance(run_input, str) or len(run_input) != len(view):
+            return False
+        return all(map(operator.is_, run_input, view))
+
+    def _replace(self, items: list[TResponseInputItem]) -> None:
+        # 换成新的列表，之前返回的 InputView 仍指向旧列表，内容不变
+        self._items = list(items)
+        self._turn_offsets = array("Q", (i for i, item in enumerate(self._items) if _is_user_message(item)))
+        self._last_view = None
+
+    def view(self) -> InputView:
+        """截至当前的完整记录；之后追加的条目不会出现在这个视图中。"""
+        self._last_view = InputView(self._items, 0, len(self._items))
+        return self._last_view
+
+    def window(self, turns: int) -> InputView:
+        """最近 turns 轮的记录。"""
+        if turns >= len(self._turn_offsets):
+            return self.view()
+        start = self._turn_offsets[len(self._turn_offsets) - turns]
+        self._last_view = InputView(self._items, start, len(self._items))
+        return self._last_view
+
+
+def _synthetic_turn(turn: int) -> list[dict[str, Any]]:
+    """一轮模拟 run 新增的条目：一次工具调用、工具输出和一条助手回复。"""
+    return [
+        {"type": "function_call", "call_id": f"c{turn}", "name": "random_number_tool", "arguments": '{"max": 100}'},
+        {"type": "function_call_output", "call_id": f"c{turn}", "output": str(turn % 100)},
+        {
+            "type": "message",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": f"第 {turn} 轮的回答。" * 4, "annotations": []}],
+        },
+    ]
+
+
+def bench(turns: int = 1000, memory: bool = False) -> None:
+    """只比较调用方维护历史的开销，不包含模型调用与 SDK 内部的处理。"""
+
+    def rebuild() -> list[float]:
+        # 与 to_input_list() + [新消息] 相同：每轮重新转换上一次的全部输入
+        history: list[TResponseInputItem] = []
+        durations = []
+        for turn in range(turns):
+            started = time.perf_counter()
+            history = ItemHelpers.input_to_new_input_list(history) + _synthetic_turn(turn)
+            history = history + [{"content": f"问题 {turn}", "role": "user"}]
+            durations.append(time.perf_counter() - started)
+        return durations
+
+    def append_only() -> list[float]:
+        log = ConversationLog()
+        durations = []
+        for turn in range(turns):
+            started = time.perf_counter()
+            for item in _synthetic_turn(turn):
+                log.append(item)
+            log.append_user(f"问题 {turn}")
+            log.view()
+            durations.append(time.perf_counter() - started)
+        return durations
+
+    for label, func in (("to_input_list 重建", rebuild), ("只追加记录", append_only)):
+        if memory:
+            tracemalloc.start()
+        durations = func()
+        line = (
+            f"{label}: {turns} 轮，总耗时 {sum(durations) * 1000:.1f} ms，"
+            f"最后 100 轮平均每轮 {sum(durations[-100:]) / len(durations[-100:]) * 1e6:.1f} µs"
+        )
+        if memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            line += f"，内存分配峰值 {peak / 1024 / 1024:.2f} MiB"
+        print(line)
+
+
+class _InstantModel(Model):
+    """立即返回一条固定回复的模拟模型，用于 --runner：每轮的耗时只剩 SDK 与调用方的处理。"""
+
+    def _message(self, input: str | list[TResponseInputItem]) -> ResponseOutputMessage:
+        return ResponseOutputMessage(
+            id="msg",
+            type="message",
+            role="assistant",
+            status="completed",
+            content=[ResponseOutputText(type="output_text", text=f"已收到第 {len(input)} 条。", annotations=[])],
+        )
+
+    async def get_response(self, system_instructions, input, *args: Any, **kwargs: Any) -> ModelResponse:
+        return ModelResponse(output=[self._message(input)], usage=Usage(requests=1), response_id=None)
+
+    async def stream_response(self, system_instructions, input, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        response = Response(
+            id="resp",
+            created_at=time.time(),
+            model="instant",
+            object="response",
+            output=[],
+            tool_choice="auto",
+            parallel_tool_calls=False,
+            tools=[],
+        )
+        yield ResponseCreatedEvent(type="response.created", response=response, sequence_number=0)
+        completed = response.model_copy(update={"output": [self._message(input)], "status": "completed"})
+        yield ResponseCompletedEvent(type="response.completed", response=completed, sequence_number=1)
+
+
+async def bench_runner(turns: int = 300) -> None:
+    """真正执行 Runner.run（模型立即返回），包含 SDK 在每次 run 中对输入的复制与转换。"""
+    set_tracing_disabled(disabled=True)
+    agent = Agent(name="助理", instructions="请尽量简明扼要回答。", model=_InstantModel())
+
+    async def rebuild() -> list[float]:
+        history: list[TResponseInputItem] = []
+        durations = []
+        for turn in range(turns):
+            started = time.perf_counter()
+            result = await Runner.run(agent, input=history + [{"content": f"问题 {turn}", "role": "user"}])
+            history = result.to_input_list()
+            durations.append(time.perf_counter() - started)
+        return durations
+
+    async def append_only() -> list[float]:
+        log = ConversationLog()
+        durations = []
+        for turn in range(turns):
+            started = time.perf_counter()
+            log.append_user(f"问题 {turn}")
+            result = await Runner.run(agent, input=log.view())
+            log.record(result)
+            durations.append(time.perf_counter() - started)
+        return durations
+
+    for label, func in (("to_input_list 重建", rebuild), ("只追加记录", append_only)):
+        durations = await func()
+        first, last = durations[:50], durations[-50:]
+        print(
+            f"{label}（Runner.run）: {turns} 轮，总耗时 {sum(durations) * 1000:.1f} ms，"
+            f"前 50 轮平均每轮 {sum(first) / len(first) * 1e6:.0f} µs，最后 50 轮平均每轮 {sum(last) / len(last) * 1e6:.0f} µs"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=None, help="模拟的会话轮数（默认 1000，--runner 时默认 300）。")
+    parser.add_argument("--memory", action="store_true", help="同时用 tracemalloc 统计内存分配峰值（会明显变慢）。")
+    parser.add_argument("--runner", action="store_true", help="用模拟模型真正执行 Runner.run 对比。")
+    args = parser.parse_args()
+    if args.runner:
+        asyncio.run(bench_runner(args.turns or 300))
+    else:
+        bench(args.turns or 1000, args.memory)
@@ -17,8 +17,10 @@ from agents import (
     set_default_openai_api,
     set_tracing_disabled,
 )
-# handoff_filters 提供了一些常用过滤器，用于在移交时对对话历史进行裁剪
-from agents.extensions import handoff_filters
+# filter_combinators 把多个过滤步骤合并为一次遍历，见 filter_combinators.py
+from filter_combinators import fuse, remove_tools, skip_history
+# ConversationLog 是只追加的对话记录，见 conversation_log.py
+from conversation_log import ConversationLog
 
 # 使用 python-dotenv 加载本地 .env 文件的环境变量
 from dotenv import load_dotenv
@@ -53,6 +55,9 @@ def random_number_tool(max: int) -> int:
     return random.randint(0, max)
 
 
+_spanish_handoff_filter = fuse(remove_tools(), skip_history(2))
+
+
 def spanish_handoff_message_filter(handoff_message_data: HandoffInputData) -> HandoffInputData:
     """
     当在对话中要从 second_agent 切换到 Spanish Agent 时调用本函数。
@@ -60,21 +65,8 @@ def spanish_handoff_message_filter(handoff_message_data: HandoffInputData) -> Ha
     1. 移除所有工具调用相关的历史记录（如 tool_call, tool_result 等）。
     2. 手动去掉对话最前面的两条消息（仅做演示用）。
     """
-    # 首先移除任何工具调用相关的消息
-    handoff_message_data = handoff_filters.remove_all_tools(handoff_message_data)
-
-    # 再额外去掉最前面的两条消息
-    history = (
-        tuple(handoff_message_data.input_history[2:])
-        if isinstance(handoff_message_data.input_history, tuple)
-        else handoff_message_data.input_history
-    )
-
-    return HandoffInputData(
-        input_history=history,
-        pre_handoff_items=tuple(handoff_message_data.pre_handoff_items),
-        new_items=tuple(handoff_message_data.new_items),
-    )
+    # 移除工具调用与去掉前两条消息合并为一次遍历，不再为每一步复制整段历史
+    return _spanish_handoff_filter(handoff_message_data)
 
 # 第一个 Agent：回答非常简明，并且可以调用 random_number_tool
 first_agent = Agent(
@@ -102,47 +94,37 @@ second_agent = Agent(
 
 
 async def main():
+    # 整个会话只维护一份只追加的记录，每一步用视图作为输入，不再重建整段历史
+    log = ConversationLog()
+
     # 第一步：将文本发送给第一个 Agent
-    result = await Runner.run(first_agent, input="你好，我叫 Sora。")
+    log.append_user("你好，我叫 Sora。")
+    result = await Runner.run(first_agent, input=log.view())
+    log.record(result)
     print("第 1 步完成")
 
     # 第二步：再次给第一个 Agent 提问，并让其调用 random_number_tool
-    result = await Runner.run(
-        first_agent,
-        input=result.to_input_list()
-        + [{"content": "能生成一个 0 到 100 之间的随机数吗？", "role": "user"}],
-    )
+    log.append_user("能生成一个 0 到 100 之间的随机数吗？")
+    result = await Runner.run(first_agent, input=log.view())
+    log.record(result)
     print("第 2 步完成")
 
     # 第三步：将对话历史交给第二个 Agent，询问关于纽约市的人口
-    result = await Runner.run(
-        second_agent,
-        input=result.to_input_list()
-        + [
-            {
-                "content": "我住在纽约市，你能告诉我这个城市的人口吗？",
-                "role": "user",
-            }
-        ],
-    )
+    log.append_user("我住在纽约市，你能告诉我这个城市的人口吗？")
+    result = await Runner.run(second_agent, input=log.view())
+    log.record(result)
     print("第 3 步完成")
 
     # 第四步：用户用西班牙语提问，触发移交逻辑 -> 切换到西班牙语助理
-    result = await Runner.run(
-        second_agent,
-        input=result.to_input_list()
-        + [
-            {
-                "content": "Por favor habla en español. ¿Cuál es mi nombre y dónde vivo?",
-                "role": "user",
-            }
-        ],
-    )
+    log.append_user("Por favor habla en español. ¿Cuál es mi nombre y dónde vivo?")
+    result = await Runner.run(second_agent, input=log.view())
+    # 移交时 spanish_handoff_message_filter 改写了历史，record() 会用 result.to_input_list() 替换视图覆盖的那一段
+    log.record(result)
     print("第 4 步完成")
 
     print("\n=== 最终的消息列表 ===\n")
-    # 输出最终的消息列表，用于查看在移交时如何被过滤
-    for message in result.to_input_list():
+    # 输出最终的消息列表，用于查看在移交时如何被过滤（与 result.to_input_list() 相同）
+    for message in log:
         print(json.dumps(message, indent=2))
 
 
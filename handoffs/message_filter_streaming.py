@@ -18,7 +18,8 @@ from agents import (
     set_default_openai_api,
     set_tracing_disabled,
 )
-from agents.extensions import handoff_filters
+# filter_combinators 把多个过滤步骤合并为一次遍历，见 filter_combinators.py
+from filter_combinators import fuse, remove_tools, skip_history
 
 # 使用 python-dotenv 加载本地 .env 文件的环境变量
 from dotenv import load_dotenv
@@ -53,28 +54,18 @@ def random_number_tool(max: int) -> int:
     return random.randint(0, max)
 
 
+_spanish_handoff_filter = fuse(remove_tools(), skip_history(2))
+
+
 def spanish_handoff_message_filter(handoff_message_data: HandoffInputData) -> HandoffInputData:
     """
     当要将对话从 second_agent 移交给 Spanish Assistant 时，会调用本函数进行消息过滤。
     这里演示两步操作：
-    1. 使用 remove_all_tools 移除与工具调用相关的对话历史（tool_call, tool_result 等）。
+    1. 使用 remove_tools（与 handoff_filters.remove_all_tools 相同）移除与工具调用相关的对话历史（tool_call, tool_result 等）。
     2. 手动去除对话前两条历史记录，仅做演示用。
     """
-    # 先移除所有工具调用的记录
-    handoff_message_data = handoff_filters.remove_all_tools(handoff_message_data)
-
-    # 再手动丢弃前两条消息
-    history = (
-        tuple(handoff_message_data.input_history[2:])
-        if isinstance(handoff_message_data.input_history, tuple)
-        else handoff_message_data.input_history
-    )
-
-    return HandoffInputData(
-        input_history=history,
-        pre_handoff_items=tuple(handoff_message_data.pre_handoff_items),
-        new_items=tuple(handoff_message_data.new_items),
-    )
+    # 移除工具调用与去掉前两条消息合并为一次遍历，不再为每一步复制整段历史
+    return _spanish_handoff_filter(handoff_message_data)
 
 
 # 第一个 Agent：回答简洁，并提供一个随机数工具函数
@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable
+
+import openai
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from agents import (
+    Agent,
+    Runner,
+    set_default_openai_api,
+    set_default_openai_client,
+    set_tracing_disabled,
+)
+
+from stub_server import StubBackend, StubBackendConfig
+
+# 在脚本文件所在目录的上一层目录中查找 .env 文件并加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+# 从环境变量获取配置
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+固定的并发上限很难选：设低了浪费后端的吞吐，设高了一忙起来就是成片的 429。
+
+AdaptiveConcurrencyLimiter 用 AIMD（加性增、乘性减）自动调整并发上限：
+- 请求成功且延迟稳定（不超过基线延迟的 latency_tolerance 倍）时，上限每次增加 1 / 当前上限，
+  相当于每完成"一整轮"请求上限加 1；
+- 遇到 429 或超时时，上限乘以 backoff（默认减半）；同一轮里接连出现的多个 429 只减一次；
+- 上限始终在 [min_limit, max_limit] 之间，current_limit 与 stats() 可以随时读取。
+
+AdaptiveAsyncOpenAI 是 AsyncOpenAI 的子类，所有请求都在 request() 中经过限流器，
+把它传给 set_default_openai_client，所有使用默认客户端的 Agent 都会共用同一个上限。
+流式请求在流读完或关闭之前一直占用名额。
+
+建议设置 max_retries=0，让 429 直接反馈给限流器，而不是被客户端内部的重试掩盖。
+
+使用方式：
+python model_providers/adaptive_concurrency.py           # 使用自适应并发的默认客户端并发调用模型
+python model_providers/adaptive_concurrency.py --bench   # 在超过隐藏容量就返回 429 的本地桩服务上对比固定上限与自适应上限
+"""
+
+OVERLOAD_ERRORS = (openai.RateLimitError, openai.APITimeoutError)
+
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(
+        self,
+        initial_limit: float = 4,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        backoff: float = 0.5,
+        latency_tolerance: float = 2.0,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self.overloads = 0
+        # 最近 100 次成功请求的最低延迟作为基线
+        self._recent_latencies: deque[float] = deque(maxlen=100)
+        self._last_decrease = 0.0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self) -> None:
+        if self.in_flight < self.current_limit and not self._waiters:
+            self.in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._waiters.remove(future)
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < self.current_limit:
+            future = self._waiters.popleft()
+            if not future.cancelled():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def on_success(self, latency: float) -> None:
+        self._recent_latencies.append(latency)
+        baseline = min(self._recent_latencies)
+        if latency <= baseline * self.latency_tolerance and self.limit < self.max_limit:
+            # 只有上限被用满时才继续增加，否则增加的名额并没有经过验证
+            if self.in_flight + 1 >= self.current_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.increases += 1
+                self._wake()
+
+    def on_overload(self) -> None:
+        self.overloads += 1
+        now = time.monotonic()
+        # 同一轮（约一个基线延迟内）的多个 429 是同一次过载造成的，只减一次
+        window = min(self._recent_latencies) if self._recent_latencies else 0.0
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        self.decreases += 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "limit": self.current_limit,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "overloads": self.overloads,
+            "baseline_latency_ms": round(min(self._recent_latencies) * 1000, 1) if self._recent_latencies else None,
+        }
+
+
+class _ReleasingStream:
+    """包装 AsyncStream：流读完或关闭时归还并发名额，其余属性原样转发。"""
+
+    def __init__(self, stream: Any, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    def _release_once(self) -> None:
+        if not self._released:
+            self._released = True
+            self._release()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            self._release_once()
+
+    async def close(self) -> None:
+        try:
+            await self._stream.close()
+        finally:
+            self._release_once()
+
+
+class AdaptiveAsyncOpenAI(AsyncOpenAI):
+    def __init__(self, *, limiter: AdaptiveConcurrencyLimiter | None = None, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.limiter = limiter or AdaptiveConcurrencyLimiter()
+
+    async def request(self, *args: Any, stream: bool = False, **kwargs: Any) -> Any:
+        limiter = self.limiter
+        await limiter.acquire()
+        started = time.monotonic()
+        try:
+            response = await super().request(*args, stream=stream, **kwargs)
+        except OVERLOAD_ERRORS:
+            limiter.on_overload()
+            limiter.release()
+            raise
+        except BaseException:
+            limiter.release()
+            raise
+        # 流式请求的延迟按收到响应头的时间计算
+        limiter.on_success(time.monotonic() - started)
+        if stream:
+            return _ReleasingStream(response, limiter.release)
+        limiter.release()
+        return response
+
+
+async def bench(requests: int = 2000, workers: int = 96, capacity: int = 24) -> None:
+    """桩服务同时处理超过 capacity 个请求时返回 429；每个请求失败后等 20ms 重试，直到成功。"""
+    set_tracing_disabled(disabled=True)
+    set_default_openai_api("chat_completions")
+    agent = Agent(name="助手", instructions="你是一个有帮助的助手。", model="stub")
+
+    for label, limiter in (
+        ("固定上限 4", AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=4)),
+        (f"固定上限 {workers}", AdaptiveConcurrencyLimiter(initial_limit=workers, max_limit=workers, min_limit=workers)),
+        ("自适应 AIMD", AdaptiveConcurrencyLimiter(initial_limit=4)),
+    ):
+        stub = await StubBackend(StubBackendConfig(latency=0.05, jitter=0.01, capacity=capacity), seed=1).start()
+        client = AdaptiveAsyncOpenAI(base_url=stub.base_url, api_key="stub", max_retries=0, limiter=limiter)
+        set_default_openai_client(client=client, use_for_tracing=False)
+        counter = iter(range(requests))
+        limits: list[int] = []
+
+        async def worker() -> None:
+            for i in counter:
+                while True:
+                    try:
+                        await Runner.run(agent, f"请求 {i}")
+                        break
+                    except openai.RateLimitError:
+                        await asyncio.sleep(0.02)
+                limits.append(limiter.current_limit)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        elapsed = time.perf_counter() - started
+        tail = limits[len(limits) // 2 :]
+        print(
+            f"[{label}] {requests / elapsed:.0f} 次/s，429 {stub.stats.throttled} 次，"
+            f"后半程平均上限 {sum(tail) / len(tail):.1f}（隐藏容量 {capacity}），{limiter.stats()}"
+        )
+        await stub.stop()
+
+
+async def main():
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+
+    client = AdaptiveAsyncOpenAI(base_url=BASE_URL, api_key=API_KEY, max_retries=0)
+    set_default_openai_client(client=client, use_for_tracing=False)
+    set_default_openai_api("chat_completions")
+    set_tracing_disabled(disabled=True)
+
+    agent = Agent(
+        name="智能助手",
+        instructions="你是一个有帮助的助手，请用一句话回答。",
+        model=MODEL_NAME,
+    )
+    results = await asyncio.gather(
+        *(Runner.run(agent, f"用一句话介绍数字 {i}") for i in range(12)),
+        return_exceptions=True,
+    )
+    for result in results:
+        print(result if isinstance(result, Exception) else result.final_output)
+    print(client.limiter.stats())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="在本地桩服务上对比固定上限与自适应上限。")
+    args = parser.parse_args()
+    asyncio.run(bench() if args.bench else main())
@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Literal
+
+import openai
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from agents import (
+    Agent,
+    Model,
+    ModelProvider,
+    ModelResponse,
+    OpenAIChatCompletionsModel,
+    RunConfig,
+    Runner,
+    set_tracing_disabled,
+)
+
+from stub_server import StubBackend, StubBackendConfig
+
+# 在脚本文件所在目录的上一层目录中查找 .env 文件并加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+# 从环境变量获取配置
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+customer_llm_provider.py 中的 CustomModelProvider 只绑定一个客户端和一个 BASE_URL。
+
+LoadBalancingProvider 同时持有多个 OpenAI 兼容的后端，每次模型调用时选择一个后端：
+- least_outstanding：选择正在处理的请求数最少的后端；
+- ewma：选择 (正在处理的请求数 + 1) × 延迟 EWMA 最小的后端，兼顾负载与速度；
+- 连续失败 failure_threshold 次（连接错误、超时、429、5xx）的后端被摘除 eject_seconds 秒，
+  到期后用 GET /models 探测，探测成功才重新加入；
+- 非流式请求失败时换一个后端重试；流式请求只在还没有收到任何事件时重试；
+- stats() 返回每个后端的请求数、错误数、正在处理的请求数、延迟 EWMA 和健康状态。
+
+每个后端的 AsyncOpenAI 客户端都设置 max_retries=0，重试与故障转移统一由本提供方负责。
+
+使用方式：
+python model_providers/load_balancing_provider.py --backend http://127.0.0.1:8001/v1 --backend http://127.0.0.1:8002/v1
+python model_providers/load_balancing_provider.py --bench   # 启动 3 个本地桩服务（其中一个很慢、一个中途故障）做对比
+"""
+
+# 这些错误说明问题出在后端本身，换一个后端可能成功
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError, openai.InternalServerError)
+
+
+@dataclass
+class BackendStats:
+    requests: int = 0
+    errors: int = 0
+    ejections: int = 0
+    outstanding: int = 0
+    ewma_latency: float | None = None
+    healthy: bool = True
+
+
+class Backend:
+    def __init__(self, name: str, base_url: str, api_key: str, timeout: float = 60.0):
+        self.name = name
+        self.base_url = base_url
+        self.client = AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0, timeout=timeout)
+        self.stats = BackendStats()
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.probing = False
+        self._models: dict[str, Model] = {}
+
+    def model(self, model_name: str) -> Model:
+        model = self._models.get(model_name)
+        if model is None:
+            model = self._models[model_name] = OpenAIChatCompletionsModel(model=model_name, openai_client=self.client)
+        return model
+
+
+class LoadBalancingProvider(ModelProvider):
+    def __init__(
+        self,
+        backends: list[Backend],
+        policy: Literal["least_outstanding", "ewma"] = "ewma",
+        default_model: str = MODEL_NAME,
+        failure_threshold: int = 3,
+        eject_seconds: float = 5.0,
+        ewma_alpha: float = 0.2,
+        max_attempts: int = 2,
+    ):
+        if not backends:
+            raise ValueError("至少需要一个后端")
+        self.backends = backends
+        self.policy = policy
+        self.default_model = default_model
+        self.failure_threshold = failure_threshold
+        self.eject_seconds = eject_seconds
+        self.ewma_alpha = ewma_alpha
+        self.max_attempts = max_attempts
+        self._probes: set[asyncio.Task] = set()
+
+    @classmethod
+    def from_urls(cls, urls: list[str], api_key: str, **kwargs: Any) -> LoadBalancingProvider:
+        backends = [Backend(f"backend-{i}", url, api_key) for i, url in enumerate(urls)]
+        return cls(backends, **kwargs)
+
+    def get_model(self, model_name: str | None) -> Model:
+        return BalancedModel(self, model_name or self.default_model)
+
+    def _score(self, backend: Backend) -> float:
+        stats = backend.stats
+        if self.policy == "least_outstanding" or stats.ewma_latency is None:
+            # 还没有延迟数据的后端按最少请求数参与选择
+            return float(stats.outstanding)
+        return (stats.outstanding + 1) * stats.ewma_latency
+
+    def pick(self, exclude: set[str] = frozenset()) -> Backend:
+        now = time.monotonic()
+        candidates = []
+        for backend in self.backends:
+            if not backend.stats.healthy:
+                if now >= backend.ejected_until and not backend.probing:
+                    self._start_probe(backend)
+                continue
+            if backend.name not in exclude:
+                candidates.append(backend)
+        if not candidates:
+            # 所有后端都不可用时，退而求其次：选择最早可以恢复的那个
+            candidates = [min(self.backends, key=lambda backend: backend.ejected_until)]
+        best = min(self._score(backend) for backend in candidates)
+        # 分数相同的后端随机选择，避免总是压在列表第一个上
+        return random.choice([backend for backend in candidates if self._score(backend) == best])
+
+    def record_success(self, backend: Backend, latency: float) -> None:
+        stats = backend.stats
+        backend.consecutive_failures = 0
+        if stats.ewma_latency is None:
+            stats.ewma_latency = latency
+        else:
+            stats.ewma_latency += self.ewma_alpha * (latency - stats.ewma_latency)
+
+    def record_failure(self, backend: Backend) -> None:
+        backend.stats.errors += 1
+        backend.consecutive_failures += 1
+        if backend.stats.healthy and backend.consecutive_failures >= self.failure_threshold:
+            backend.stats.healthy = False
+            backend.stats.ejections += 1
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+
+    def _start_probe(self, backend: Backend) -> None:
+        backend.probing = True
+        task = asyncio.ensure_future(self._probe(backend))
+        self._probes.add(task)
+        task.add_done_callback(self._probes.discard)
+
+    async def _probe(self, backend: Backend) -> None:
+        try:
+            await backend.client.models.list()
+        except Exception:
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+        else:
+            backend.consecutive_failures = 0
+            backend.stats.healthy = True
+        finally:
+            backend.probing = False
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        return {
+            backend.name: {
+                "base_url": backend.base_url,
+                "requests": backend.stats.requests,
+                "errors": backend.stats.errors,
+                "ejections": backend.stats.ejections,
+                "outstanding": backend.stats.outstanding,
+                "ewma_latency_ms": round(backend.stats.ewma_latency * 1000, 1) if backend.stats.ewma_latency else None,
+                "healthy": backend.stats.healthy,
+            }
+            for backend in self.backends
+        }
+
+
+class BalancedModel(Model):
+    """每次调用时由 LoadBalancingProvider 选择后端，再交给该后端的 OpenAIChatCompletionsModel。"""
+
+    def __init__(self, provider: LoadBalancingProvider, model_name: str):
+        self.provider = provider
+        self.model_name = model_name
+
+    async def get_response(self, *args: Any, **kwargs: Any) -> ModelResponse:
+        provider = self.provider
+        tried: set[str] = set()
+        for attempt in range(provider.max_attempts):
+            backend = provider.pick(exclude=tried)
+            tried.add(backend.name)
+            backend.stats.requests += 1
+            backend.stats.outstanding += 1
+            started = time.monotonic()
+            try:
+                response = await backend.model(self.model_name).get_response(*args, **kwargs)
+            except RETRYABLE_ERRORS:
+                provider.record_failure(backend)
+                if attempt + 1 >= provider.max_attempts:
+                    raise
+                continue
+            finally:
+                backend.stats.outstanding -= 1
+            provider.record_success(backend, time.monotonic() - started)
+            return response
+        raise RuntimeError("unreachable")
+
+    async def stream_response(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        provider = self.provider
+        tried: set[str] = set()
+        for attempt in range(provider.max_attempts):
+            backend = provider.pick(exclude=tried)
+            tried.add(backend.name)
+            backend.stats.requests += 1
+            backend.stats.outstanding += 1
+            started = time.monotonic()
+            yielded = False
+            try:
+                async for event in backend.model(self.model_name).stream_response(*args, **kwargs):
+                    yielded = True
+                    yield event
+            except RETRYABLE_ERRORS:
+                provider.record_failure(backend)
+                # 已经把部分事件交给调用方时不能换后端重来
+                if yielded or attempt + 1 >= provider.max_attempts:
+                    raise
+                continue
+            finally:
+                backend.stats.outstanding -= 1
+            provider.record_success(backend, time.monotonic() - started)
+            return
+
+
+async def bench(requests: int = 300, concurrency: int = 16) -> None:
+    """启动 3 个本地桩服务：正常、很慢、中途故障，对比两种选择策略。"""
+    set_tracing_disabled(disabled=True)
+    for policy in ("least_outstanding", "ewma"):
+        stubs = [
+            await StubBackend(StubBackendConfig(latency=0.05, jitter=0.02), name="fast", seed=1).start(),
+            await StubBackend(StubBackendConfig(latency=0.40, jitter=0.05), name="slow", seed=2).start(),
+            await StubBackend(StubBackendConfig(latency=0.05, jitter=0.02), name="flaky", seed=3).start(),
+        ]
+        provider = LoadBalancingProvider(
+            [Backend(stub.name, stub.base_url, "stub") for stub in stubs],
+            policy=policy,
+            default_model="stub",
+            eject_seconds=1.0,
+        )
+        agent = Agent(name="助手", instructions="你是一个有帮助的助手。")
+        run_config = RunConfig(model_provider=provider)
+        latencies: list[float] = []
+        failures = 0
+        counter = iter(range(requests))
+
+        async def worker() -> None:
+            nonlocal failures
+            for i in counter:
+                if i == requests // 3:
+                    stubs[2].healthy = False  # flaky 后端开始故障
+                elif i == requests * 2 // 3:
+                    stubs[2].healthy = True  # 恢复，等待探测后重新加入
+                started = time.perf_counter()
+                try:
+                    await Runner.run(agent, f"请求 {i}", run_config=run_config)
+                except Exception:
+                    failures += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        print(
+            f"[{policy}] {requests} 次请求，失败 {failures}，耗时 {elapsed:.2f} s，"
+            f"p50 {latencies[len(latencies) // 2] * 1000:.0f} ms，p99 {latencies[int(len(latencies) * 0.99)] * 1000:.0f} ms"
+        )
+        for name, backend_stats in provider.stats().items():
+            print(f"  {name}: {json.dumps(backend_stats, ensure_ascii=False)}")
+        for stub in stubs:
+            await stub.stop()
+
+
+async def main(urls: list[str]):
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+    set_tracing_disabled(disabled=True)
+
+    provider = LoadBalancingProvider.from_urls(urls, API_KEY)
+    agent = Agent(
+        name="智能助手",
+        instructions="你是一个有帮助的助手，请用中文回答。",
+    )
+    run_config = RunConfig(model_provider=provider)
+
+    results = await asyncio.gather(*(
+        Runner.run(agent, f"用一句话介绍数字 {i}", run_config=run_config) for i in range(6)
+    ))
+    for result in results:
+        print(result.final_output)
+    print(json.dumps(provider.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", action="append", help="后端的 Base URL，可重复指定；默认只使用 API_BASE。")
+    parser.add_argument("--bench", action="store_true", help="使用本地桩服务对比两种选择策略。")
+    args = parser.parse_args()
+    asyncio.run(bench() if args.bench else main(args.backend or [BASE_URL]))
@@ -0,0 +1,397 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+import openai
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from agents import (
+    Agent,
+    Model,
+    ModelProvider,
+    ModelResponse,
+    OpenAIProvider,
+    RunConfig,
+    Runner,
+    set_tracing_disabled,
+)
+
+from stub_server import StubBackend, StubBackendConfig
+
+# 在脚本文件所在目录的上一层目录中查找 .env 文件并加载环境变量
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+# 从环境变量获取配置
+BASE_URL = os.getenv("API_BASE", "https://api.deepseek.com")
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
+
+"""
+只有一个后端时，后端的一次延迟抖动会让每个 Runner.run 都跟着等待。
+
+ResilientModel 包装任意 Model，在模型层提供三种保护：
+- 对冲请求（hedging）：记录最近成功请求的延迟，等待超过 p95 仍未返回时再发一个相同的请求，
+  谁先成功用谁，另一个取消。流式请求按"首个事件"的等待时间对冲。对冲会增加请求量，
+  hedge_budget 限制对冲请求占全部请求的比例；
+- 重试：遇到 429、5xx、连接错误和超时时，按"全抖动"指数退避（0 到 base × 2^n 之间随机）重试；
+  流式请求只在还没有收到任何事件时重试；
+- 熔断：连续失败 failure_threshold 次后熔断 recovery_timeout 秒，期间直接抛出 CircuitOpenError，
+  到期后放行一个试探请求，成功则恢复。
+
+ResilientProvider 包装另一个 ModelProvider，同名模型共享同一个 ResilientModel（延迟统计与熔断状态）。
+
+使用方式：
+python model_providers/resilient_model.py           # 通过 RunConfig 使用包装后的模型
+python model_providers/resilient_model.py --bench   # 在带有随机慢响应和错误的本地桩服务上对比尾延迟
+"""
+
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError, openai.InternalServerError)
+
+# 流结束的标记
+_END = object()
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断期间拒绝请求。"""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self.opens = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def before_request(self) -> None:
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.recovery_timeout:
+                raise CircuitOpenError("模型后端熔断中，请稍后再试")
+            self.state = "half_open"
+        if self.state == "half_open":
+            # 半开状态只放行一个试探请求
+            if self._trial_in_flight:
+                raise CircuitOpenError("模型后端熔断恢复中，请稍后再试")
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._trial_in_flight = False
+        self.state = "closed"
+
+    def release(self) -> None:
+        """请求被取消，没有得到结论：只释放半开状态的试探名额。"""
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+
+@dataclass
+class ResilienceStats:
+    requests: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+    retries: int = 0
+    failures: int = 0
+    rejected: int = 0
+
+
+class ResilientModel(Model):
+    def __init__(
+        self,
+        inner: Model,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+        hedge_budget: float = 0.1,
+        max_retries: int = 3,
+        backoff_base: float = 0.2,
+        backoff_cap: float = 5.0,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.inner = inner
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_budget = hedge_budget
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = ResilienceStats()
+        # 最近成功请求的延迟（流式请求记录首个事件的等待时间），用于估计对冲阈值
+        self._latencies: deque[float] = deque(maxlen=256)
+        self._first_event_latencies: deque[float] = deque(maxlen=256)
+
+    def _hedge_delay(self, samples: deque[float]) -> float | None:
+        if len(samples) < self.hedge_min_samples:
+            return None
+        if self.stats.hedged >= self.hedge_budget * self.stats.requests:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_quantile))]
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def _race(
+        self,
+        start: Callable[[], Awaitable[Any]],
+        delay: float | None,
+        discard: Callable[[Any], None] | None = None,
+    ) -> Any:
+        """先启动一个请求，超过 delay 仍未完成时再启动一个，返回先成功的结果。
+
+        落败的请求会被取消；如果它同时成功了，用 discard 释放它的结果（例如关闭流）。
+        """
+        primary = asyncio.ensure_future(start())
+        if delay is None:
+            return await primary
+        tasks = [primary]
+        winner: asyncio.Future | None = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.stats.hedged += 1
+                tasks.append(asyncio.ensure_future(start()))
+            pending = set(tasks)
+            error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    error = task.exception()
+                if winner is not None:
+                    break
+            if winner is None:
+                raise error
+            if winner is not primary:
+                self.stats.hedge_wins += 1
+            return winner.result()
+        finally:
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif discard is not None and not task.cancelled() and task.exception() is None:
+                    discard(task.result())
+
+    async def get_response(self, *args: Any, **kwargs: Any) -> ModelResponse:
+        self.stats.requests += 1
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.breaker.before_request()
+            except CircuitOpenError:
+                self.stats.rejected += 1
+                raise
+            started = time.monotonic()
+            try:
+                response = await self._race(
+                    lambda: self.inner.get_response(*args, **kwargs), self._hedge_delay(self._latencies)
+                )
+            except RETRYABLE_ERRORS:
+                self.breaker.record_failure()
+                self.stats.failures += 1
+                if attempt >= self.max_retries:
+                    raise
+                self.stats.retries += 1
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            except Exception:
+                # 400 等错误说明后端能正常响应，只是请求本身有问题
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            self._latencies.append(time.monotonic() - started)
+            return response
+        raise RuntimeError("unreachable")
+
+    async def _open_stream(self, args: tuple, kwargs: dict) -> tuple[asyncio.Task, asyncio.Queue, Any]:
+        """在后台任务中消费一条流并等到第一个事件，返回 (后台任务, 事件队列, 第一个事件)。
+
+        SDK 在流式生成器内部使用 contextvars 记录 span，生成器不能跨任务迭代，
+        所以整条流都由同一个后台任务读取，再通过队列交给调用方。
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def pump() -> None:
+            try:
+                async for event in self.inner.stream_response(*args, **kwargs):
+                    queue.put_nowait((event, None))
+            except Exception as error:
+                queue.put_nowait((_END, error))
+            else:
+                queue.put_nowait((_END, None))
+
+        task = asyncio.ensure_future(pump())
+        try:
+            first, error = await queue.get()
+        except BaseException:
+            task.cancel()
+            raise
+        if error is not None:
+            raise error
+        return task, queue, first
+
+    async def stream_response(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        self.stats.requests += 1
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.breaker.before_request()
+            except CircuitOpenError:
+                self.stats.rejected += 1
+                raise
+            started = time.monotonic()
+            try:
+                # 对冲只覆盖"等待首个事件"这一段；一旦开始输出就固定使用这条流
+                pump, queue, event = await self._race(
+                    lambda: self._open_stream(args, kwargs),
+                    self._hedge_delay(self._first_event_latencies),
+                    discard=lambda opened: opened[0].cancel(),
+                )
+            except RETRYABLE_ERRORS:
+                self.breaker.record_failure()
+                self.stats.failures += 1
+                if attempt >= self.max_retries:
+                    raise
+                self.stats.retries += 1
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            except Exception:
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                self.breaker.release()
+                raise
+            self._first_event_latencies.append(time.monotonic() - started)
+            try:
+                while event is not _END:
+                    yield event
+                    event, error = await queue.get()
+                if error is not None:
+                    raise error
+            except RETRYABLE_ERRORS:
+                self.breaker.record_failure()
+                self.stats.failures += 1
+                raise
+            except BaseException:
+                self.breaker.release()
+                raise
+            finally:
+                pump.cancel()
+            self.breaker.record_success()
+            return
+
+
+class ResilientProvider(ModelProvider):
+    def __init__(self, inner: ModelProvider, **options: Any):
+        self.inner = inner
+        self.options = options
+        self._models: dict[str | None, ResilientModel] = {}
+
+    def get_model(self, model_name: str | None) -> Model:
+        model = self._models.get(model_name)
+        if model is None:
+            model = self._models[model_name] = ResilientModel(self.inner.get_model(model_name), **self.options)
+        return model
+
+
+def _percentiles(values: list[float]) -> str:
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000
+    return f"p50 {pick(0.5):.0f} ms，p95 {pick(0.95):.0f} ms，p99 {pick(0.99):.0f} ms，p99.9 {pick(0.999):.0f} ms，max {ordered[-1] * 1000:.0f} ms"
+
+
+async def bench(requests: int = 1000, concurrency: int = 8) -> None:
+    """桩服务：基础延迟 50ms，5% 的请求额外慢 1.5s，3% 返回 429，2% 返回 500。"""
+    set_tracing_disabled(disabled=True)
+    config = StubBackendConfig(
+        latency=0.05,
+        jitter=0.02,
+        slow_probability=0.05,
+        slow_latency=1.5,
+        error_429_probability=0.03,
+        error_500_probability=0.02,
+    )
+    agent = Agent(name="助手", instructions="你是一个有帮助的助手。")
+    for label in ("直接调用", "对冲 + 重试 + 熔断"):
+        stub = await StubBackend(config, name="stub", seed=7).start()
+        client = AsyncOpenAI(base_url=stub.base_url, api_key="stub", max_retries=0)
+        provider: ModelProvider = OpenAIProvider(openai_client=client, use_responses=False)
+        if label != "直接调用":
+            provider = ResilientProvider(provider, breaker=CircuitBreaker(failure_threshold=20))
+        run_config = RunConfig(model_provider=provider)
+        latencies: list[float] = []
+        failures = 0
+        counter = iter(range(requests))
+
+        async def worker() -> None:
+            nonlocal failures
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    await Runner.run(agent, f"请求 {i}", run_config=run_config)
+                except Exception:
+                    failures += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        print(f"[{label}] 成功 {len(latencies)}，失败 {failures}，{_percentiles(latencies)}")
+        if isinstance(provider, ResilientProvider):
+            for model in provider._models.values():
+                print(f"  {model.stats}，熔断 {model.breaker.opens} 次")
+        print(f"  桩服务收到 {stub.stats.requests} 个请求")
+        await stub.stop()
+
+
+async def main():
+    if not API_KEY:
+        raise ValueError("请设置 API_KEY 环境变量")
+    set_tracing_disabled(disabled=True)
+
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY, max_retries=0)
+    provider = ResilientProvider(OpenAIProvider(openai_client=client, use_responses=False))
+    agent = Agent(
+        name="智能助手",
+        instructions="你是一个有帮助的助手，请用中文回答。",
+        model=MODEL_NAME,
+    )
+    result = await Runner.run(agent, "请介绍一下你自己", run_config=RunConfig(model_provider=provider))
+    print(result.final_output)
+    print(provider.get_model(MODEL_NAME).stats)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="在本地桩服务上对比尾延迟。")
+    args = parser.parse_args()
+    asyncio.run(bench() if args.bench else main())
@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+"""
+一个只依赖标准库的本地 OpenAI 兼容桩服务（/v1/chat/completions），用于在不访问真实模型的情况下
+测试负载均衡、对冲请求、限流、自适应并发等功能。
+
+- 支持普通请求与流式（SSE）请求，流式时按 chunk_chars 切分文本或工具调用参数；
+- 可以配置基础延迟、抖动、一定比例的慢响应、随机 429 / 500；
+- capacity 模拟服务端隐藏的并发容量，超出时返回 429；
+- healthy 设为 False 时所有请求返回 503，用于模拟后端故障；
+- responder 根据请求体决定回复内容，返回 {"content": "..."} 或 {"tool_calls": [{"name": ..., "arguments": "..."}]}，
+  可选 "cached_tokens" 字段控制 usage 中的缓存命中 token 数。
+
+既可以在其他脚本中用 StubBackend(...).start() 启动，也可以单独运行：
+python model_providers/stub_server.py --port 8001 --latency 0.2 --slow-probability 0.05
+然后把 API_BASE 设为 http://127.0.0.1:8001/v1 运行其他示例。
+"""
+
+
+def default_responder(request: dict[str, Any]) -> dict[str, Any]:
+    """默认把最后一条用户消息原样回显。"""
+    for message in reversed(request.get("messages", [])):
+        if message.get("role") == "user":
+            content = message.get("content")
+            if isinstance(content, list):
+                content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+            return {"content": f"echo: {content}"}
+    return {"content": "echo"}
+
+
+def _count_tokens(text: str) -> int:
+    # 粗略估算：按 4 个字符一个 token
+    return max(1, len(text) // 4)
+
+
+@dataclass
+class StubBackendConfig:
+    latency: float = 0.05
+    jitter: float = 0.02
+    slow_probability: float = 0.0
+    slow_latency: float = 2.0
+    error_429_probability: float = 0.0
+    error_500_probability: float = 0.0
+    capacity: int | None = None
+    chunk_chars: int = 4
+    chunk_delay: float = 0.005
+    responder: Callable[[dict[str, Any]], dict[str, Any]] = default_responder
+
+
+@dataclass
+class StubBackendStats:
+    requests: int = 0
+    completed: int = 0
+    throttled: int = 0
+    errors: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    latencies: list[float] = field(default_factory=list)
+
+
+class StubBackend:
+    def __init__(self, config: StubBackendConfig | None = None, name: str = "stub", seed: int | None = None):
+        self.config = config or StubBackendConfig()
+        self.name = name
+        self.stats = StubBackendStats()
+        self.random = random.Random(seed)
+        self.healthy = True
+        self._server: asyncio.AbstractServer | None = None
+        self._connections: set[asyncio.StreamWriter] = set()
+        self._ids = itertools.count(1)
+        self.port: int | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def start(self, port: int = 0) -> StubBackend:
+        self._server = await asyncio.start_server(self._handle_connection, "127.0.0.1", port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # 客户端的 keep-alive 连接不会自己断开，主动关闭
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple[str, str, dict[str, str], bytes] | None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        method, path, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", "0")))
+        return method, path, headers, body
+
+    @staticmethod
+    def _response(status: str, body: bytes, content_type: str = "application/json", extra: str = "") -> bytes:
+        return (
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n{extra}\r\n"
+        ).encode() + body
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # HTTP/1.1 keep-alive：同一连接上循环处理多个请求
+        self._connections.add(writer)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_open = await self._handle_request(method, path, body, writer)
+                if not keep_open:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _handle_request(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter) -> bool:
+        if method == "GET" and (path.startswith("/health") or path.endswith("/models")):
+            status = "200 OK" if self.healthy else "503 Service Unavailable"
+            models = {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": self.name}]}
+            writer.write(self._response(status, json.dumps(models).encode()))
+            await writer.drain()
+            return True
+        if method != "POST" or not path.endswith("/chat/completions"):
+            writer.write(self._response("404 Not Found", b'{"error": {"message": "not found"}}'))
+            await writer.drain()
+            return True
+
+        config = self.config
+        stats = self.stats
+        stats.requests += 1
+        if not self.healthy:
+            stats.errors += 1
+            writer.write(self._response("503 Service Unavailable", b'{"error": {"message": "unhealthy"}}'))
+            await writer.drain()
+            return True
+        if config.capacity is not None and stats.in_flight >= config.capacity:
+            stats.throttled += 1
+            writer.write(self._response("429 Too Many Requests", b'{"error": {"message": "rate limited"}}', extra="Retry-After: 0\r\n"))
+            await writer.drain()
+            return True
+
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        started = time.perf_counter()
+        try:
+            roll = self.random.random()
+            if roll < config.error_429_probability:
+                stats.throttled += 1
+                writer.write(self._response("429 Too Many Requests", b'{"error": {"message": "rate limited"}}', extra="Retry-After: 0\r\n"))
+                await writer.drain()
+                return True
+            if roll < config.error_429_probability + config.error_500_probability:
+                stats.errors += 1
+                writer.write(self._response("500 Internal Server Error", b'{"error": {"message": "boom"}}'))
+                await writer.drain()
+                return True
+
+            delay = config.latency + self.random.uniform(0, config.jitter)
+            if self.random.random() < config.slow_probability:
+                delay += config.slow_latency
+            await asyncio.sleep(delay)
+
+            payload = json.loads(body or b"{}")
+            reply = config.responder(payload)
+            if payload.get("stream"):
+                await self._write_stream(payload, reply, writer)
+                keep_open = False
+            else:
+                writer.write(self._response("200 OK", json.dumps(self._completion(payload, reply)).encode()))
+                await writer.drain()
+                keep_open = True
+            stats.completed += 1
+            stats.latencies.append(time.perf_counter() - started)
+            return keep_open
+        finally:
+            stats.in_flight -= 1
+
+    def _usage(self, payload: dict[str, Any], reply: dict[str, Any]) -> dict[str, Any]:
+        prompt = json.dumps(payload.get("messages", []), ensure_ascii=False)
+        output = reply.get("content") or json.dumps(reply.get("tool_calls", []))
+        prompt_tokens, completion_tokens = _count_tokens(prompt), _count_tokens(output)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": reply.get("cached_tokens", 0)},
+        }
+
+    def _completion(self, payload: dict[str, Any], reply: dict[str, Any]) -> dict[str, Any]:
+        message: dict[str, Any] = {"role": "assistant", "content": reply.get("content")}
+        finish_reason = "stop"
+        if reply.get("tool_calls"):
+            finish_reason = "tool_calls"
+            message["tool_calls"] = [
+                {
+                    "id": f"call_{next(self._ids)}",
+                    "type": "function",
+                    "function": {"name": call["name"], "arguments": call.get("arguments", "{}")},
+                }
+                for call in reply["tool_calls"]
+            ]
+        return {
+            "id": f"chatcmpl-{self.name}-{next(self._ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": self._usage(payload, reply),
+        }
+
+    async def _write_stream(self, payload: dict[str, Any], reply: dict[str, Any], writer: asyncio.StreamWriter) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n"
+        )
+        completion_id = f"chatcmpl-{self.name}-{next(self._ids)}"
+        model = payload.get("model", "stub")
+        size = self.config.chunk_chars
+
+        async def send(delta: dict[str, Any], finish_reason: str | None = None, usage: dict | None = None) -> None:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if usage is not None:
+                chunk["usage"] = usage
+            writer.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await writer.drain()
+            if self.config.chunk_delay:
+                await asyncio.sleep(self.config.chunk_delay)
+
+        await send({"role": "assistant", "content": ""})
+        content = reply.get("content") or ""
+        for i in range(0, len(content), size):
+            await send({"content": content[i : i + size]})
+        for index, call in enumerate(reply.get("tool_calls") or []):
+            arguments = call.get("arguments", "{}")
+            await send({"tool_calls": [{
+                "index": index,
+                "id": f"call_{next(self._ids)}",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": ""},
+            }]})
+            for i in range(0, len(arguments), size):
+                await send({"tool_calls": [{"index": index, "function": {"arguments": arguments[i : i + size]}}]})
+        finish_reason = "tool_calls" if reply.get("tool_calls") else "stop"
+        await send({}, finish_reason=finish_reason, usage=self._usage(payload, reply))
+        writer.write(b"data: [DONE]\n\n")
+        await writer.drain()
+
+
+async def serve(port: int, config: StubBackendConfig) -> None:
+    backend = await StubBackend(config, name=f"stub-{port}").start(port)
+    print(f"桩服务已启动：{backend.base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await backend.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # 处理 Windows 平台的事件循环策略
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8001, help="监听的本地端口。")
+    parser.add_argument("--latency", type=float, default=0.05, help="基础延迟（秒）。")
+    parser.add_argument("--jitter", type=float, default=0.02, help="在基础延迟上增加的随机抖动上限（秒）。")
+    parser.add_argument("--slow-probability", type=float, default=0.0, help="慢响应的比例。")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="慢响应额外增加的延迟（秒）。")
+    parser.add_argument("--error-429", type=float, default=0.0, help="随机返回 429 的比例。")
+    parser.add_argument("--error-500", type=float, default=0.0, help="随机返回 500 的比例。")
+    parser.add_argument("--capacity", type=int, default=None, help="并发容量，超出时返回 429。")
+    args = parser.parse_args()
+    config = StubBackendConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        slow_probability=args.slow_probability,
+        slow_latency=args.slow_latency,
+        error_429_probability=args.error_429,
+        error_500_probability=args.error_500,
+        capacity=args.capacity,
+    )
+    try:
+        asyncio.run(serve(args.port, config))
+    except KeyboardInterrupt:
+        pass